@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django import forms
 from django.utils.html import format_html
-from .models import Medico, Paziente, NotaDiario, Messaggio, RiassuntoCasoClinico
+from .models import Medico, Paziente, NotaDiario, Messaggio, RiassuntoCasoClinico, JobAnalisi, StatisticheUmore, JobRiassunto
 
 
 class MedicoAdminForm(forms.ModelForm):
@@ -49,3 +49,6 @@ admin.site.register(Paziente, PazienteAdmin)
 admin.site.register(NotaDiario)
 admin.site.register(Messaggio)
 admin.site.register(RiassuntoCasoClinico)
+admin.site.register(JobAnalisi)
+admin.site.register(StatisticheUmore)
+admin.site.register(JobRiassunto)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class SouldiaryconnectappConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "SoulDiaryConnectApp"
+
+    def ready(self):
+        from .views.utils.utenti import registra_invalidazione
+        registra_invalidazione()
@@ -0,0 +1,61 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from SoulDiaryConnectApp.models import JobRiassunto
+from SoulDiaryConnectApp.views.utils.jobs import (
+    esegui_job,
+    esegui_job_riassunto,
+    identificativo_worker,
+    preleva_job,
+    recupera_note_orfane
+)
+
+
+class Command(BaseCommand):
+    help = "Esegue i job di analisi delle note e di generazione dei riassunti clinici dalle code persistenti. Più worker (anche su nodi diversi) possono girare in parallelo."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=1, help='Job prelevati per ogni ciclo')
+        parser.add_argument('--intervallo', type=float, default=2.0, help='Secondi di attesa quando la coda è vuota')
+        parser.add_argument('--una-volta', action='store_true', help='Svuota la coda ed esce')
+
+    def handle(self, *args, **options):
+        worker = identificativo_worker('worker')
+        self._in_chiusura = False
+        signal.signal(signal.SIGTERM, self._richiedi_chiusura)
+        signal.signal(signal.SIGINT, self._richiedi_chiusura)
+
+        recuperate = recupera_note_orfane()
+        self.stdout.write(f"Worker {worker} avviato ({recuperate} note orfane rimesse in coda)")
+
+        while not self._in_chiusura:
+            close_old_connections()
+            jobs = preleva_job(worker, limite=options['batch'])
+
+            # The summaries are run only when there are no note analyses waiting
+            if not jobs:
+                jobs_riassunto = preleva_job(worker, limite=1, modello=JobRiassunto)
+                for job in jobs_riassunto:
+                    self.stdout.write(f"Job riassunto {job.id} (paziente {job.paz_id}, {job.periodo}, tentativo {job.tentativi})")
+                    esegui_job_riassunto(job, worker)
+                if jobs_riassunto:
+                    continue
+
+            if not jobs:
+                if options['una_volta']:
+                    break
+                time.sleep(options['intervallo'])
+                continue
+
+            for job in jobs:
+                self.stdout.write(f"Job {job.id} (nota {job.nota_id}, tentativo {job.tentativi})")
+                esegui_job(job, worker)
+
+        self.stdout.write(self.style.SUCCESS(f"Worker {worker} terminato"))
+
+    def _richiedi_chiusura(self, signum, frame):
+        # The job being processed is completed before exiting
+        self._in_chiusura = True
@@ -0,0 +1,89 @@
+import re
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from SoulDiaryConnectApp.models import NotaDiario
+from SoulDiaryConnectApp.views.utils.ai import (
+    _valida_contesto,
+    _valida_emozione,
+    analizza_emozione_e_contesto_json,
+    genera_con_ollama
+)
+from SoulDiaryConnectApp.views.utils.constants import CONTESTI_EMOJI, EMOZIONI_EMOJI
+from SoulDiaryConnectApp.views.utils.prompt import (
+    get_prompt_analizza_contesto_sociale,
+    get_prompt_analizza_emozione_e_contesto,
+    get_prompt_analizza_sentiment
+)
+
+TESTI_ESEMPIO = [
+    "Oggi al lavoro il mio capo mi ha criticato davanti a tutti i colleghi e mi sono sentito umiliato.",
+    "Ho passato la serata con Marco, abbiamo riso tantissimo e mi sono sentito finalmente sereno.",
+    "Non riesco a dormire, continuo a pensare all'esame di domani e ho il cuore che batte fortissimo.",
+    "Ho litigato con mia madre perché non capisce le mie scelte, sono stufo di doverle spiegare tutto.",
+    "Sono andato in palestra dopo settimane e alla fine dell'allenamento ero stanco ma orgoglioso.",
+]
+
+
+def _estrai(risposta, etichetta):
+    match = re.search(rf'^\s*{etichetta}:\s*(.+)$', risposta, flags=re.I | re.M)
+    return match.group(1).strip().lower().rstrip('.!?,;:') if match else None
+
+
+class Command(BaseCommand):
+    help = "Confronto A/B tra le due chiamate separate (emozione + contesto) e la chiamata unica con output JSON: latenza, dimensione del prompt e tasso di risposte non interpretabili. Richiede Ollama attivo."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--note', type=int, default=0, help='Usa le ultime N note del database invece dei testi di esempio')
+        parser.add_argument('--ripetizioni', type=int, default=1, help='Ripetizioni per ciascun testo')
+
+    def handle(self, *args, **options):
+        testi = TESTI_ESEMPIO
+        if options['note']:
+            testi = list(NotaDiario.objects.order_by('-data_nota').values_list('testo_paziente', flat=True)[:options['note']])
+
+        emozioni_lista = ', '.join(EMOZIONI_EMOJI.keys())
+        contesti_lista = ', '.join(CONTESTI_EMOJI.keys())
+
+        tempi_separati, tempi_combinati = [], []
+        caratteri_separati = caratteri_combinati = 0
+        errori_separati = errori_combinati = 0
+
+        for testo in testi:
+            for _ in range(options['ripetizioni']):
+                # A: two calls with free-text parsing
+                prompt_emozione = get_prompt_analizza_sentiment(None, emozioni_lista, testo)
+                prompt_contesto = get_prompt_analizza_contesto_sociale(None, testo, contesti_lista)
+                caratteri_separati += len(prompt_emozione) + len(prompt_contesto)
+
+                inizio = time.perf_counter()
+                risposta_emozione = genera_con_ollama(prompt_emozione, max_chars=300, temperature=0.2, usa_cache=False)
+                risposta_contesto = genera_con_ollama(prompt_contesto, max_chars=400, temperature=0.2, usa_cache=False)
+                tempi_separati.append(time.perf_counter() - inizio)
+
+                emozione = _valida_emozione(_estrai(risposta_emozione, 'emozione'))
+                contesto = _estrai(risposta_contesto, 'contesto')
+                if not emozione or not contesto or _valida_contesto(contesto) not in CONTESTI_EMOJI:
+                    errori_separati += 1
+
+                # B: single structured-output call
+                caratteri_combinati += len(get_prompt_analizza_emozione_e_contesto(None, emozioni_lista, contesti_lista, testo))
+
+                inizio = time.perf_counter()
+                risultato = analizza_emozione_e_contesto_json(testo, usa_cache=False)
+                tempi_combinati.append(time.perf_counter() - inizio)
+
+                if risultato is None:
+                    errori_combinati += 1
+
+        totale = len(tempi_separati)
+        self._stampa("Due chiamate", tempi_separati, caratteri_separati, errori_separati, totale)
+        self._stampa("Chiamata unica JSON", tempi_combinati, caratteri_combinati, errori_combinati, totale)
+
+    def _stampa(self, etichetta, tempi, caratteri, errori, totale):
+        self.stdout.write(
+            f"{etichetta}: latenza media {statistics.mean(tempi):.2f}s | mediana {statistics.median(tempi):.2f}s | "
+            f"prompt medio {caratteri // totale} caratteri | risposte non valide {errori}/{totale} ({errori / totale:.0%})"
+        )
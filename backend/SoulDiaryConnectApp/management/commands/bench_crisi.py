@@ -0,0 +1,126 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from SoulDiaryConnectApp.views.utils.crisi import CATEGORIE_CRISI, AutomaCrisi, normalizza_testo_crisi, trova_contenuto_crisi
+
+PAROLE_NEUTRE = [
+    'oggi', 'sono', 'andato', 'lavoro', 'casa', 'mia', 'madre', 'amici', 'stanco', 'sera',
+    'pensato', 'molto', 'poco', 'dormito', 'male', 'bene', 'mangiato', 'uscito', 'treno',
+    'ufficio', 'riunione', 'collega', 'telefonato', 'sorella', 'paura', 'ansia', 'sereno',
+]
+
+# Variants of the keywords that an exact substring match does not find
+VARIANTI = [
+    "Non ce la faccio piu' a vivere",
+    "non ce la faccio piu a vivere",
+    "voglio   morire",
+    "vogliooo morireee",
+    "Voglio morìre",
+    "mi-picchia quando beve",
+    "mi ammmazzo",
+    "farla\nfinita",
+    "tutti starebbero meglio senza di me!!!",
+    "mi faccio   del male",
+    "Ho paura di lui…",
+    "SUICIDIO",
+]
+
+
+def _scansione_lineare(categorie, testo):
+    """Previous algorithm: one substring scan per keyword, stops at the first hit."""
+    testo_lower = testo.lower()
+    for categoria, keywords in categorie.items():
+        for keyword in keywords:
+            if keyword in testo_lower:
+                return categoria
+    return None
+
+
+def _keywords_sintetiche(categorie, moltiplicatore):
+    """Inflates each list with variants that never occur in the texts, to simulate large tables."""
+    if moltiplicatore <= 1:
+        return categorie
+    return {
+        categoria: keywords + [f"{keyword} {i}x" for i in range(moltiplicatore - 1) for keyword in keywords]
+        for categoria, keywords in categorie.items()
+    }
+
+
+class Command(BaseCommand):
+    help = "Confronto tra la scansione lineare delle keyword di crisi e l'automa Aho-Corasick su note lunghe e liste di keyword estese, con costo e recall della normalizzazione del testo."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--note', type=int, default=200, help='Numero di note sintetiche')
+        parser.add_argument('--parole', type=int, default=1500, help='Parole per nota')
+        parser.add_argument('--moltiplicatore', type=int, default=20, help='Fattore di moltiplicazione delle liste di keyword')
+        parser.add_argument('--quota-crisi', type=float, default=0.1, help='Frazione di note che contengono una keyword')
+
+    def handle(self, *args, **options):
+        casuale = random.Random(42)
+        tutte_keywords = [keyword for keywords in CATEGORIE_CRISI.values() for keyword in keywords]
+
+        testi = []
+        for _ in range(options['note']):
+            parole = casuale.choices(PAROLE_NEUTRE, k=options['parole'])
+            if casuale.random() < options['quota_crisi']:
+                parole.insert(casuale.randrange(len(parole)), casuale.choice(tutte_keywords))
+            testi.append(' '.join(parole))
+
+        categorie = _keywords_sintetiche(CATEGORIE_CRISI, options['moltiplicatore'])
+        numero_keywords = sum(len(keywords) for keywords in categorie.values())
+
+        inizio = time.perf_counter()
+        automa = AutomaCrisi(categorie)
+        costruzione = time.perf_counter() - inizio
+
+        tempi_lineari, tempi_automa, tempi_normalizzazione = [], [], []
+        differenze = 0
+        for testo in testi:
+            inizio = time.perf_counter()
+            atteso = _scansione_lineare(categorie, testo)
+            tempi_lineari.append(time.perf_counter() - inizio)
+
+            inizio = time.perf_counter()
+            normalizzato = normalizza_testo_crisi(testo)
+            tempi_normalizzazione.append(time.perf_counter() - inizio)
+            trovato = automa.categoria_prioritaria(automa.cerca(normalizzato))
+            tempi_automa.append(time.perf_counter() - inizio)
+
+            if atteso != trovato:
+                differenze += 1
+
+        self.stdout.write(
+            f"{len(testi)} note da {options['parole']} parole (~{statistics.mean(len(t) for t in testi):.0f} caratteri), "
+            f"{numero_keywords} keyword, automa costruito in {costruzione * 1000:.1f} ms"
+        )
+        self._stampa("Scansione lineare", tempi_lineari)
+        self._stampa("Aho-Corasick (con normalizzazione)", tempi_automa)
+        self._stampa("  di cui normalizzazione", tempi_normalizzazione)
+        self.stdout.write(f"Tipo di emergenza diverso tra i due metodi: {differenze}/{len(testi)}")
+
+        # Cost of the normalization on a note of typical length, with accented text
+        nota_tipica = "Oggi mi sono sentita più stanca del solito, perché non ho dormito bene… " * 8
+        ripetizioni = 5000
+        inizio = time.perf_counter()
+        for _ in range(ripetizioni):
+            normalizza_testo_crisi(nota_tipica)
+        self.stdout.write(
+            f"Normalizzazione di una nota di {len(nota_tipica)} caratteri: "
+            f"{(time.perf_counter() - inizio) / ripetizioni * 1e6:.1f} µs"
+        )
+
+        rilevate_prima = sum(1 for variante in VARIANTI if _scansione_lineare(CATEGORIE_CRISI, variante))
+        rilevate_dopo = sum(1 for variante in VARIANTI if trova_contenuto_crisi(variante))
+        self.stdout.write(
+            f"Varianti rilevate: scansione esatta {rilevate_prima}/{len(VARIANTI)}, "
+            f"testo normalizzato {rilevate_dopo}/{len(VARIANTI)}"
+        )
+
+    def _stampa(self, etichetta, tempi):
+        self.stdout.write(
+            f"{etichetta}: media {statistics.mean(tempi) * 1000:.3f} ms | mediana {statistics.median(tempi) * 1000:.3f} ms | "
+            f"max {max(tempi) * 1000:.3f} ms per nota"
+        )
@@ -0,0 +1,115 @@
+import contextlib
+import io
+import random
+import statistics
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from SoulDiaryConnectApp.models import Medico, Paziente
+from SoulDiaryConnectApp.views.auth_views import cerca_utente, login_view
+
+
+def _cerca_utente_due_query(email, password):
+    """Previous lookup of login_view: one query on the doctors and one on the patients."""
+    medico = Medico.objects.filter(email=email, password=password).first()
+    paziente = Paziente.objects.filter(email=email, password=password).first()
+    if medico:
+        return medico.codice_identificativo, 'medico'
+    if paziente:
+        return paziente.codice_fiscale, 'paziente'
+    return None
+
+
+class Command(BaseCommand):
+    help = "Confronta il login con due query (medici e poi pazienti) e con la query unica, su utenti fittizi creati in una transazione annullata al termine."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--medici', type=int, default=200, help='Medici fittizi creati per la misura')
+        parser.add_argument('--pazienti', type=int, default=10000, help='Pazienti fittizi creati per la misura')
+        parser.add_argument('--login', type=int, default=2000, help='Login eseguiti per ciascuna modalità')
+        parser.add_argument('--quota-errati', type=float, default=0.05, help='Quota di login con password errata')
+
+    def handle(self, *args, **options):
+        if options['medici'] < 1 or options['pazienti'] < 1 or options['login'] < 1:
+            raise CommandError("--medici, --pazienti e --login devono essere almeno 1")
+
+        with transaction.atomic():
+            credenziali = self._crea_utenti(options['medici'], options['pazienti'])
+
+            # Mostly patients log in (there are many more of them), a few with a wrong password
+            casuale = random.Random(42)
+            login = []
+            for _ in range(options['login']):
+                email, password = casuale.choice(credenziali)
+                if casuale.random() < options['quota_errati']:
+                    password = 'sbagliata'
+                login.append((email, password))
+
+            for etichetta, funzione in (("Due query (prima)", _cerca_utente_due_query), ("Query unica (dopo)", cerca_utente)):
+                funzione(*login[0])  # warm-up of connection and query plans
+                tempi, query = self._misura(funzione, login)
+                self._stampa(etichetta, tempi, query)
+
+            fabbrica = RequestFactory()
+            richieste = [fabbrica.post('/api/login/', {'email': email, 'password': password}) for email, password in login]
+            inizio = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                for richiesta in richieste:
+                    login_view(richiesta)
+            durata = time.perf_counter() - inizio
+            self.stdout.write(
+                f"login_view completa (query unica + firma del token): {len(richieste) / durata:.0f} login/s"
+            )
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Misura su {options['medici']} medici e {options['pazienti']} pazienti fittizi (annullati al termine)"
+        ))
+
+    def _crea_utenti(self, numero_medici, numero_pazienti):
+        medici = [
+            Medico(
+                codice_identificativo=f"BNC{i:09d}", nome='Bench', cognome=f"Medico{i}",
+                indirizzo_studio='Via Prova', citta='Roma', numero_civico='1',
+                email=f"bench.medico{i}@example.invalid", password=f"pw-medico-{i}",
+            )
+            for i in range(numero_medici)
+        ]
+        Medico.objects.bulk_create(medici, batch_size=1000)
+
+        pazienti = [
+            Paziente(
+                codice_fiscale=f"BNC{i:013d}", nome='Bench', cognome=f"Paziente{i}",
+                data_di_nascita=date(1990, 1, 1), med=medici[i % numero_medici],
+                email=f"bench.paziente{i}@example.invalid", password=f"pw-paziente-{i}",
+            )
+            for i in range(numero_pazienti)
+        ]
+        Paziente.objects.bulk_create(pazienti, batch_size=1000)
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE medico")
+            cursor.execute("ANALYZE paziente")
+
+        return [(m.email, m.password) for m in medici] + [(p.email, p.password) for p in pazienti]
+
+    def _misura(self, funzione, login):
+        tempi = []
+        with CaptureQueriesContext(connection) as query:
+            for email, password in login:
+                inizio = time.perf_counter()
+                funzione(email, password)
+                tempi.append(time.perf_counter() - inizio)
+        return tempi, len(query)
+
+    def _stampa(self, etichetta, tempi, query):
+        self.stdout.write(
+            f"{etichetta}: {len(tempi) / sum(tempi):.0f} login/s | media {statistics.mean(tempi) * 1000:.3f} ms | "
+            f"mediana {statistics.median(tempi) * 1000:.3f} ms | {query / len(tempi):.1f} query per login"
+        )
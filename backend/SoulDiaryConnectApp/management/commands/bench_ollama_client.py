@@ -0,0 +1,80 @@
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from django.core.management.base import BaseCommand
+
+from SoulDiaryConnectApp.views.utils.ollama_client import OllamaClient
+
+
+class _StubOllamaHandler(BaseHTTPRequestHandler):
+    """Minimal /api/generate stub answering with HTTP/1.1 keep-alive."""
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately: with Nagle enabled the body of a
+    # response on a reused connection waits for the client's delayed ACK (~40 ms)
+    disable_nagle_algorithm = True
+    latenza = 0.0
+
+    def do_POST(self):
+        lunghezza = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(lunghezza)
+        if self.latenza:
+            time.sleep(self.latenza)
+        corpo = json.dumps({"model": "stub", "response": "Risposta di prova.", "done": True}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = "Confronta la latenza per chiamata tra requests.post e il client Ollama con pool keep-alive, usando un server Ollama fittizio locale."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chiamate', type=int, default=500, help='Numero di chiamate per ciascuna modalità')
+        parser.add_argument('--latenza-ms', type=float, default=0.0, help='Latenza simulata del server fittizio (ms)')
+
+    def handle(self, *args, **options):
+        _StubOllamaHandler.latenza = options['latenza_ms'] / 1000
+        server = ThreadingHTTPServer(('127.0.0.1', 0), _StubOllamaHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/api/generate"
+        payload = {"model": "stub", "prompt": "Ciao", "stream": False}
+
+        try:
+            senza_pool = self._misura(lambda: requests.post(url, json=payload, timeout=(5, 500)), options['chiamate'])
+            client = OllamaClient(base_url=url)
+            con_pool = self._misura(lambda: client.post(payload), options['chiamate'])
+            client.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self._stampa("requests.post (nuova connessione)", senza_pool)
+        self._stampa("OllamaClient (keep-alive)", con_pool)
+        risparmio = statistics.mean(senza_pool) - statistics.mean(con_pool)
+        self.stdout.write(self.style.SUCCESS(f"Latenza risparmiata per chiamata: {risparmio * 1000:.3f} ms"))
+
+    def _misura(self, chiamata, n):
+        chiamata()  # warm-up
+        tempi = []
+        for _ in range(n):
+            inizio = time.perf_counter()
+            chiamata().json()
+            tempi.append(time.perf_counter() - inizio)
+        return tempi
+
+    def _stampa(self, etichetta, tempi):
+        tempi_ordinati = sorted(tempi)
+        p95 = tempi_ordinati[int(len(tempi_ordinati) * 0.95) - 1]
+        self.stdout.write(
+            f"{etichetta}: media {statistics.mean(tempi) * 1000:.3f} ms | "
+            f"mediana {statistics.median(tempi) * 1000:.3f} ms | p95 {p95 * 1000:.3f} ms"
+        )
@@ -0,0 +1,93 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import jwt
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.http import JsonResponse
+from django.test import RequestFactory
+
+from SoulDiaryConnectApp.views import auth_views
+from SoulDiaryConnectApp.views.auth_views import token_required
+from SoulDiaryConnectApp.views.utils.jwt_cache import CacheTokenVerificati
+
+
+@token_required
+def _vista_vuota(request):
+    return JsonResponse({'user_id': request.user_id})
+
+
+def _vista_senza_decoratore(request):
+    return JsonResponse({'user_id': None})
+
+
+class Command(BaseCommand):
+    help = "Misura il costo per richiesta del decoratore token_required con la verifica JWT ad ogni richiesta e con la cache dei token già verificati."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--richieste', type=int, default=20000, help='Richieste per ciascuna modalità')
+        parser.add_argument('--token', type=int, default=200, help='Token distinti (utenti attivi) usati a rotazione')
+        parser.add_argument('--thread', type=int, default=1, help='Thread che eseguono le richieste in parallelo')
+
+    def handle(self, *args, **options):
+        if options['richieste'] < 1 or options['token'] < 1 or options['thread'] < 1:
+            raise CommandError("--richieste, --token e --thread devono essere almeno 1")
+
+        scadenza = datetime.now(timezone.utc) + timedelta(days=7)
+        fabbrica = RequestFactory()
+        richieste = []
+        for i in range(options['token']):
+            token = jwt.encode(
+                {'user_id': f"BNCHMK{i:010d}", 'user_type': 'paziente', 'exp': scadenza},
+                settings.SECRET_KEY, algorithm='HS256'
+            )
+            richieste.append(fabbrica.get('/api/patient/notes/', HTTP_AUTHORIZATION=f"Bearer {token}"))
+        sequenza = [richieste[i % len(richieste)] for i in range(options['richieste'])]
+
+        base = self._misura(_vista_senza_decoratore, sequenza, options['thread'])
+
+        with mock.patch.object(auth_views, 'get_cache_token', return_value=None):
+            prima = self._misura(_vista_vuota, sequenza, options['thread'])
+
+        cache = CacheTokenVerificati()
+        with mock.patch.object(auth_views, 'get_cache_token', return_value=cache):
+            dopo = self._misura(_vista_vuota, sequenza, options['thread'])
+
+        self.stdout.write(
+            f"{len(sequenza)} richieste, {len(richieste)} token distinti, {options['thread']} thread"
+        )
+        self._stampa("Vista senza decoratore", base)
+        self._stampa("token_required con jwt.decode ad ogni richiesta", prima)
+        self._stampa("token_required con cache dei token verificati", dopo)
+
+        costo_prima = statistics.mean(prima) - statistics.mean(base)
+        costo_dopo = statistics.mean(dopo) - statistics.mean(base)
+        self.stdout.write(
+            f"Costo del decoratore: {costo_prima * 1e6:.1f} µs -> {costo_dopo * 1e6:.1f} µs per richiesta"
+            + (f" ({costo_prima / costo_dopo:.1f}x)" if costo_dopo > 0 else "")
+        )
+        self.stdout.write(self.style.SUCCESS(f"Statistiche della cache: {cache.statistiche()}"))
+
+    def _misura(self, vista, sequenza, thread):
+        def esegui(blocco):
+            tempi = []
+            for richiesta in blocco:
+                inizio = time.perf_counter()
+                vista(richiesta)
+                tempi.append(time.perf_counter() - inizio)
+            return tempi
+
+        if thread == 1:
+            return esegui(sequenza)
+        with ThreadPoolExecutor(max_workers=thread) as esecutore:
+            blocchi = esecutore.map(esegui, [sequenza[i::thread] for i in range(thread)])
+            return [tempo for blocco in blocchi for tempo in blocco]
+
+    def _stampa(self, etichetta, tempi):
+        self.stdout.write(
+            f"{etichetta}: media {statistics.mean(tempi) * 1e6:.1f} µs | mediana {statistics.median(tempi) * 1e6:.1f} µs | "
+            f"max {max(tempi) * 1e6:.1f} µs per richiesta"
+        )
@@ -0,0 +1,133 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Exists, F, Max, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from SoulDiaryConnectApp.models import JobRiassunto, NotaDiario, Paziente, RiassuntoCasoClinico
+from SoulDiaryConnectApp.views.utils.jobs import accoda_riassunto, esegui_job_riassunto, identificativo_worker, preleva_job
+from SoulDiaryConnectApp.views.utils.riassunti import PERIODI_RIASSUNTO, calcola_finestra_periodo
+
+
+def _pazienti_da_aggiornare(periodo, giorni_emergenza):
+    """
+    Patients with notes added or changed in the period window after their last
+    summary for that period (or without a summary), with the doctor they belong to.
+    Patients with an emergency note in the last giorni_emergenza days come first.
+    """
+    _, data_inizio, _ = calcola_finestra_periodo(periodo)
+
+    ultima_modifica = NotaDiario.objects.filter(
+        paz=OuterRef('pk'), data_nota__gte=data_inizio
+    ).order_by().values('paz').annotate(ultima=Max('data_modifica')).values('ultima')
+    ultima_generazione = RiassuntoCasoClinico.objects.filter(
+        paz=OuterRef('pk'), med=OuterRef('med'), periodo=periodo
+    ).order_by('-data_generazione').values('data_generazione')[:1]
+    emergenza_recente = NotaDiario.objects.filter(
+        paz=OuterRef('pk'), is_emergency=True, data_nota__gte=timezone.now() - timedelta(days=giorni_emergenza)
+    )
+
+    return (
+        Paziente.objects
+        .annotate(
+            ultima_modifica=Subquery(ultima_modifica),
+            ultima_generazione=Subquery(ultima_generazione),
+            emergenza_recente=Exists(emergenza_recente),
+        )
+        .filter(med__isnull=False, ultima_modifica__isnull=False)
+        .filter(Q(ultima_generazione__isnull=True) | Q(ultima_modifica__gt=F('ultima_generazione')))
+        .values_list('codice_fiscale', 'med_id', 'emergenza_recente', 'ultima_modifica')
+    )
+
+
+class Command(BaseCommand):
+    help = "Precalcola (es. di notte, da cron) i riassunti clinici dei pazienti con note nuove dall'ultimo riassunto, per ogni periodo, così che al mattino la lettura non chiami Ollama. I pazienti con emergenze recenti vengono elaborati per primi."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--periodo', action='append', default=[], choices=list(PERIODI_RIASSUNTO), help='Periodo da precalcolare (ripetibile). Di default tutti')
+        parser.add_argument('--concorrenza', type=int, default=2, help='Riassunti generati in parallelo')
+        parser.add_argument('--budget-minuti', type=float, default=240, help='Dopo questo tempo non vengono avviati nuovi riassunti')
+        parser.add_argument('--giorni-emergenza', type=int, default=7, help='Finestra (giorni) delle note in emergenza che danno priorità al paziente')
+        parser.add_argument('--incrementale', action='store_true', help='Aggiorna i riassunti esistenti con le sole note nuove')
+        parser.add_argument('--dry-run', action='store_true', help='Mostra i riassunti da precalcolare senza generarli')
+
+    def handle(self, *args, **options):
+        if options['concorrenza'] < 1:
+            raise CommandError("--concorrenza deve essere almeno 1")
+
+        periodi = options['periodo'] or list(PERIODI_RIASSUNTO)
+        lavori = [
+            (paz_id, med_id, periodo, emergenza, ultima_modifica)
+            for periodo in periodi
+            for paz_id, med_id, emergenza, ultima_modifica in _pazienti_da_aggiornare(periodo, options['giorni_emergenza'])
+        ]
+        # Emergencies first, then the shorter periods (the ones read most often), then the most recent activity
+        lavori.sort(key=lambda lavoro: (not lavoro[3], periodi.index(lavoro[2]), -lavoro[4].timestamp()))
+
+        emergenze = sum(1 for lavoro in lavori if lavoro[3])
+        self.stdout.write(f"Riassunti da precalcolare: {len(lavori)} ({emergenze} di pazienti con emergenze recenti)")
+
+        if options['dry_run']:
+            for paz_id, med_id, periodo, emergenza, ultima_modifica in lavori:
+                self.stdout.write(f"  {paz_id} ({periodo}){' [emergenza]' if emergenza else ''}: ultima nota modificata il {ultima_modifica:%d/%m/%Y %H:%M}")
+            return
+
+        scadenza = time.monotonic() + options['budget_minuti'] * 60
+        worker = identificativo_worker('precalcolo')
+        esiti = {}
+
+        with ThreadPoolExecutor(max_workers=options['concorrenza'], thread_name_prefix='precalcolo-riassunti') as esecutore:
+            in_corso = set()
+            for indice, (paz_id, med_id, periodo, _, _) in enumerate(lavori):
+                # Jobs are enqueued only when they can start: when the budget runs out,
+                # nothing is left in the queue to compete with the morning requests
+                while len(in_corso) >= options['concorrenza']:
+                    completati, in_corso = wait(in_corso, return_when=FIRST_COMPLETED)
+                    self._registra(completati, esiti)
+
+                if time.monotonic() >= scadenza:
+                    self.stdout.write(self.style.WARNING(f"Budget di tempo esaurito: {len(lavori) - indice} riassunti non avviati"))
+                    break
+
+                in_corso.add(esecutore.submit(self._precalcola, worker, paz_id, med_id, periodo, options['incrementale']))
+
+            self._registra(wait(in_corso).done, esiti)
+
+        riepilogo = ', '.join(f"{esito}: {numero}" for esito, numero in sorted(esiti.items()))
+        self.stdout.write(self.style.SUCCESS(f"Precalcolo terminato ({riepilogo or 'nessun riassunto'})"))
+
+    def _precalcola(self, worker, paz_id, med_id, periodo, incrementale):
+        inizio = time.monotonic()
+        try:
+            job, avviato = accoda_riassunto(paz_id, med_id, periodo, incrementale)
+            if not avviato:
+                # Already queued or running (e.g. requested by the doctor): left to whoever runs it
+                return paz_id, periodo, 'già in corso', 0, None
+
+            for job in preleva_job(worker, job_id=job.id, modello=JobRiassunto):
+                esegui_job_riassunto(job, worker)
+
+            job.refresh_from_db()
+            if job.stato == 'completato':
+                esito = job.modalita_generazione or 'nessuna nota'
+            else:
+                # Generation failed: nothing was saved and the job is retried with backoff
+                # (stato 'in_coda') or has used up its attempts (stato 'fallito')
+                esito = 'da ritentare' if job.stato == 'in_coda' else job.stato
+            return paz_id, periodo, esito, time.monotonic() - inizio, job.ultimo_errore
+        finally:
+            connection.close()
+
+    def _registra(self, futures, esiti):
+        for future in futures:
+            try:
+                paz_id, periodo, esito, durata, errore = future.result()
+            except Exception as e:
+                esito = 'errore'
+                self.stdout.write(self.style.ERROR(f"  Errore nel precalcolo: {e}"))
+            else:
+                self.stdout.write(f"  {paz_id} ({periodo}): {esito} in {durata:.1f}s" + (f": {errore}" if errore else ""))
+            esiti[esito] = esiti.get(esito, 0) + 1
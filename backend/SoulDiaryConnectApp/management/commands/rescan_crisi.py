@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from SoulDiaryConnectApp.models import NotaDiario, Paziente
+from SoulDiaryConnectApp.views.utils.ai import genera_messaggio_emergenza
+from SoulDiaryConnectApp.views.utils.crisi import AUTOMA_CRISI, CATEGORIE_CRISI, trova_contenuto_crisi
+
+FILE_CHECKPOINT = 'rescan_crisi.checkpoint.json'
+
+
+def _impronta_keywords():
+    """Fingerprint of the keyword lists: a checkpoint is only valid for the lists it was made with."""
+    contenuto = json.dumps(CATEGORIE_CRISI, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(contenuto.encode('utf-8')).hexdigest()
+
+
+class Command(BaseCommand):
+    help = "Rivaluta is_emergency / tipo_emergenza di tutte le note con le keyword di crisi attuali. Scorre la tabella a blocchi (keyset su id) in memoria costante e riprende dall'ultimo checkpoint."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=2000, help='Note lette e aggiornate per blocco')
+        parser.add_argument('--dry-run', action='store_true', help='Mostra le modifiche senza scrivere nel database')
+        parser.add_argument('--checkpoint', default=os.path.join(settings.BASE_DIR, FILE_CHECKPOINT), help='File del checkpoint')
+        parser.add_argument('--riparti', action='store_true', help='Ignora il checkpoint e riparte dalla prima nota')
+        parser.add_argument('--solo-aggiunte', action='store_true', help='Non rimuove le emergenze già segnalate')
+        parser.add_argument('--esempi', type=int, default=10, help='Id di esempio mostrati per ogni tipo di modifica')
+
+    def handle(self, *args, **options):
+        impronta = _impronta_keywords()
+        ultimo_id = 0 if options['riparti'] else self._leggi_checkpoint(options['checkpoint'], impronta)
+        dry_run = options['dry_run']
+
+        esaminate = aggiornate = 0
+        transizioni = Counter()
+        esempi = {}
+
+        self.stdout.write(f"Rivalutazione delle note con id > {ultimo_id}{' (dry-run)' if dry_run else ''}")
+
+        while True:
+            blocco = (
+                NotaDiario.objects
+                .filter(id__gt=ultimo_id)
+                .order_by('id')
+                .only('id', 'paz_id', 'testo_paziente', 'is_emergency', 'tipo_emergenza')
+            )[:options['batch']]
+
+            modificate = []
+            letti = 0
+            for nota in blocco.iterator(chunk_size=options['batch']):
+                letti += 1
+                ultimo_id = nota.id
+
+                tipo = AUTOMA_CRISI.categoria_prioritaria(trova_contenuto_crisi(nota.testo_paziente)) or 'none'
+                if tipo == nota.tipo_emergenza or (tipo == 'none' and options['solo_aggiunte']):
+                    continue
+
+                transizione = f"{nota.tipo_emergenza} -> {tipo}"
+                transizioni[transizione] += 1
+                esempi_transizione = esempi.setdefault(transizione, [])
+                if len(esempi_transizione) < options['esempi']:
+                    esempi_transizione.append(nota.id)
+
+                nota.is_emergency = tipo != 'none'
+                nota.tipo_emergenza = tipo
+                modificate.append(nota)
+
+            if not letti:
+                break
+            esaminate += letti
+
+            if modificate and not dry_run:
+                self._salva(modificate)
+                aggiornate += len(modificate)
+
+            if not dry_run:
+                self._scrivi_checkpoint(options['checkpoint'], impronta, ultimo_id)
+
+            self.stdout.write(f"  ... {esaminate} note esaminate (ultimo id {ultimo_id}), {sum(transizioni.values())} da modificare")
+
+        self.stdout.write(f"Note esaminate: {esaminate}")
+        for transizione, numero in transizioni.most_common():
+            self.stdout.write(f"  {transizione}: {numero} (es. id {', '.join(map(str, esempi[transizione]))})")
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING(f"Dry-run: {sum(transizioni.values())} note da modificare, nessuna scrittura"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Note aggiornate: {aggiornate}"))
+
+    def _salva(self, note):
+        # The emergency message includes the doctor's contacts: the doctors of the
+        # patients involved are loaded once per batch
+        pazienti = Paziente.objects.select_related('med').in_bulk(
+            {nota.paz_id for nota in note if nota.is_emergency}
+        )
+        for nota in note:
+            nota.messaggio_emergenza = (
+                genera_messaggio_emergenza(nota.tipo_emergenza, pazienti[nota.paz_id].med)
+                if nota.is_emergency else None
+            )
+
+        with transaction.atomic():
+            NotaDiario.objects.bulk_update(note, ['is_emergency', 'tipo_emergenza', 'messaggio_emergenza'])
+
+    def _leggi_checkpoint(self, percorso, impronta):
+        try:
+            with open(percorso, encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return 0
+
+        if checkpoint.get('impronta') != impronta:
+            self.stdout.write("Le keyword sono cambiate dall'ultimo checkpoint: si riparte dalla prima nota")
+            return 0
+        return checkpoint.get('ultimo_id', 0)
+
+    def _scrivi_checkpoint(self, percorso, impronta, ultimo_id):
+        # Written to a temporary file and renamed, so an interruption never leaves a truncated checkpoint
+        temporaneo = f"{percorso}.tmp"
+        with open(temporaneo, 'w', encoding='utf-8') as f:
+            json.dump({'impronta': impronta, 'ultimo_id': ultimo_id}, f)
+        os.replace(temporaneo, percorso)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from SoulDiaryConnectApp.models import Paziente
+from SoulDiaryConnectApp.views.utils.statistiche import ricostruisci_statistiche_umore
+
+
+class Command(BaseCommand):
+    help = "Ricostruisce da zero le statistiche dell'umore (tabella statistiche_umore) a partire dalle note di ogni paziente."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paziente', action='append', default=[], help='Codice fiscale del paziente (ripetibile). Di default tutti i pazienti')
+
+    def handle(self, *args, **options):
+        pazienti = Paziente.objects.order_by('codice_fiscale').values_list('codice_fiscale', flat=True)
+        if options['paziente']:
+            pazienti = pazienti.filter(codice_fiscale__in=options['paziente'])
+
+        ricostruite = 0
+        for paz_id in pazienti.iterator():
+            stat = ricostruisci_statistiche_umore(paz_id)
+            ricostruite += 1
+            self.stdout.write(f"{paz_id}: {stat.totale_note} note, {stat.note_con_emozione} con emozione")
+
+        self.stdout.write(self.style.SUCCESS(f"Statistiche ricostruite per {ricostruite} pazienti"))
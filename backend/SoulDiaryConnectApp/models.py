@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 class Medico(models.Model):
     codice_identificativo = models.CharField(max_length=12, primary_key=True)
@@ -56,6 +57,10 @@ class NotaDiario(models.Model):
     contesto_sociale = models.CharField(max_length=50, null=True, blank=True)
     spiegazione_contesto = models.TextField(null=True, blank=True)
     data_nota = models.DateTimeField()
+    # Ultima modifica del contenuto usato dai riassunti (testo, analisi, emozione): invalida le sintesi in cache
+    # e rende il riassunto non aggiornato. Va impostata esplicitamente solo quando cambiano questi campi,
+    # così che il commento del medico o la frase di supporto non la modifichino
+    data_modifica = models.DateTimeField(default=timezone.now)
     # Campi per il modulo di emergenza/crisi
     is_emergency = models.BooleanField(default=False)
     tipo_emergenza = models.CharField(max_length=20, choices=TIPO_EMERGENZA_CHOICES, default='none')
@@ -67,6 +72,13 @@ class NotaDiario(models.Model):
         db_table = 'nota_diario'
         verbose_name = 'Nota Diario'
         verbose_name_plural = 'Note Diario'
+        indexes = [
+            # Note di un paziente in ordine di data (liste, contesto clinico, riassunti, statistiche)
+            models.Index(fields=['paz', 'data_nota', 'id'], name='nota_diario_paz_data_idx'),
+            # Indici parziali: contengono solo le poche note in emergenza / in generazione
+            models.Index(fields=['paz', 'data_nota'], name='nota_diario_emergenza_idx', condition=models.Q(is_emergency=True)),
+            models.Index(fields=['id'], name='nota_diario_in_generaz_idx', condition=models.Q(generazione_in_corso=True)),
+        ]
 
 class Messaggio(models.Model):
     id = models.AutoField(primary_key=True)
@@ -96,6 +108,12 @@ class RiassuntoCasoClinico(models.Model):
     periodo = models.CharField(max_length=10, choices=PERIODO_CHOICES)
     testo_riassunto = models.TextField()
     data_generazione = models.DateTimeField()
+    note_coperte = models.JSONField(default=list)  # Id delle note di cui il riassunto tiene conto
+    # Impronta delle note da cui è stato generato (numero, data dell'ultima, hash di id e data_modifica):
+    # se non coincide con quella attuale il riassunto non è aggiornato
+    impronta_numero_note = models.IntegerField(default=0)
+    impronta_ultima_nota = models.DateTimeField(null=True, blank=True)
+    impronta_hash = models.CharField(max_length=32, null=True, blank=True)
     
     class Meta:
         db_table = 'riassunto_caso_clinico'
@@ -103,3 +121,84 @@ class RiassuntoCasoClinico(models.Model):
         verbose_name_plural = 'Riassunti Casi Clinici'
 
 
+class JobAnalisi(models.Model):
+    STATO_CHOICES = [
+        ('in_coda', 'In coda'),
+        ('in_esecuzione', 'In esecuzione'),
+        ('completato', 'Completato'),
+        ('fallito', 'Fallito'),
+    ]
+
+    id = models.AutoField(primary_key=True)
+    chiave = models.CharField(max_length=64, unique=True)  # Chiave di idempotenza del job
+    nota = models.ForeignKey(NotaDiario, on_delete=models.CASCADE)
+    stato = models.CharField(max_length=15, choices=STATO_CHOICES, default='in_coda')
+    tentativi = models.IntegerField(default=0)
+    disponibile_dal = models.DateTimeField()  # Il job non viene prelevato prima di questa data (backoff)
+    lease_scadenza = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=100, null=True, blank=True)
+    ultimo_errore = models.TextField(null=True, blank=True)
+    data_creazione = models.DateTimeField()
+    data_aggiornamento = models.DateTimeField()
+
+    class Meta:
+        db_table = 'job_analisi'
+        verbose_name = 'Job Analisi'
+        verbose_name_plural = 'Job Analisi'
+        indexes = [
+            models.Index(fields=['stato', 'disponibile_dal'], name='job_analisi_stato_disp_idx'),
+        ]
+
+
+class StatisticheUmore(models.Model):
+    # Aggregati dell'umore di un paziente, aggiornati in modo incrementale a ogni analisi o
+    # eliminazione di nota (ricostruibili con: python manage.py ricostruisci_statistiche_umore)
+    paz = models.OneToOneField(Paziente, on_delete=models.CASCADE, primary_key=True)
+    totale_note = models.IntegerField(default=0)
+    note_con_emozione = models.IntegerField(default=0)
+    somma_punteggi = models.IntegerField(default=0)
+    conteggio_emozioni = models.JSONField(default=dict)  # {emozione: numero di note}
+    conteggio_categorie = models.JSONField(default=dict)  # {categoria: numero di note}
+    matrice_contesti = models.JSONField(default=dict)  # {contesto: {categoria: n, 'total': n, 'sum': punteggi}}
+    data_aggiornamento = models.DateTimeField()
+
+    class Meta:
+        db_table = 'statistiche_umore'
+        verbose_name = 'Statistiche Umore'
+        verbose_name_plural = 'Statistiche Umore'
+
+
+class JobRiassunto(models.Model):
+    # Generazione in background di un riassunto clinico: un solo job per (paziente, medico, periodo),
+    # così le richieste concorrenti si uniscono allo stesso job invece di avviare generazioni duplicate
+    id = models.AutoField(primary_key=True)
+    chiave = models.CharField(max_length=64, unique=True)  # Chiave di idempotenza del job
+    paz = models.ForeignKey(Paziente, on_delete=models.CASCADE)
+    med = models.ForeignKey(Medico, on_delete=models.CASCADE)
+    periodo = models.CharField(max_length=10, choices=RiassuntoCasoClinico.PERIODO_CHOICES)
+    incrementale = models.BooleanField(default=False)
+    forza = models.BooleanField(default=False)  # Rigenera anche se le note non sono cambiate
+    stato = models.CharField(max_length=15, choices=JobAnalisi.STATO_CHOICES, default='in_coda')
+    tentativi = models.IntegerField(default=0)
+    disponibile_dal = models.DateTimeField()  # Il job non viene prelevato prima di questa data (backoff)
+    lease_scadenza = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=100, null=True, blank=True)
+    ultimo_errore = models.TextField(null=True, blank=True)
+    # Avanzamento della generazione, letto dal client in polling
+    fase = models.CharField(max_length=30, null=True, blank=True)
+    passi_completati = models.IntegerField(default=0)
+    passi_totali = models.IntegerField(default=0)
+    # Esito
+    riassunto = models.ForeignKey(RiassuntoCasoClinico, on_delete=models.SET_NULL, null=True, blank=True)
+    modalita_generazione = models.CharField(max_length=15, null=True, blank=True)
+    note_aggiunte = models.IntegerField(default=0)
+    data_creazione = models.DateTimeField()
+    data_aggiornamento = models.DateTimeField()
+
+    class Meta:
+        db_table = 'job_riassunto'
+        verbose_name = 'Job Riassunto'
+        verbose_name_plural = 'Job Riassunti'
+        indexes = [
+            models.Index(fields=['stato', 'disponibile_dal'], name='job_riassunto_stato_disp_idx'),
+        ]
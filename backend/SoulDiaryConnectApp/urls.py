@@ -14,18 +14,25 @@ urlpatterns = [
     path('doctor/patients/<str:codice_fiscale>/notes/', views.get_patient_notes, name='get_patient_notes'),
     path('doctor/patients/<str:codice_fiscale>/notes/<int:note_id>/', views.get_pat_note_details, name='get_patient_note_details'),
     path('doctor/patients/<str:paziente_id>/summary/', views.get_or_generate_clinical_summary, name='get_or_generate_clinical_summary'),
+    path('doctor/patients/<str:paziente_id>/summary/async/', views.get_or_generate_clinical_summary_async, name='get_or_generate_clinical_summary_async'),
+    path('doctor/summary-jobs/<int:job_id>/', views.get_clinical_summary_job, name='get_clinical_summary_job'),
     path('doctor/notes/<int:note_id>/comment/', views.add_clinical_comment, name='add_clinical_comment'),
     path('doctor/notes/<int:note_id>/regenerate-analysis/', views.regenerate_clinical_analysis, name='regenerate_clinical_analysis'),
+    path('doctor/notes/<int:note_id>/regenerate-analysis/stream/', views.regenerate_clinical_analysis_stream, name='regenerate_clinical_analysis_stream'),
+    path('doctor/notes/<int:note_id>/regenerate-analysis/async/', views.regenerate_clinical_analysis_async, name='regenerate_clinical_analysis_async'),
     path('doctor/patients/<str:paziente_id>/mood-stats/', views.get_patient_mood_stats, name='get_patient_mood_stats'),
     path('doctor/ai-parameters/', views.personalize_parameters, name='personalize_parameters'),
     
     path('patient/note/create/', views.create_nota, name='create_note'),
+    path('patient/note/create/async/', views.create_nota_async, name='create_note_async'),
     path('patient/note/', views.get_note, name='get_note'),
     path('patient/info/', views.get_patient_info, name='get_patient_info'),
     path('patient/doctor/', views.get_doctor_info, name='get_doctor_info'),
     path('patient/note/<int:pk>/', views.get_note_details, name='get_note_details'),
     path('patient/note/<int:pk>/delete/', views.delete_nota, name='delete_nota'),
     path('patient/note/<int:nota_id>/generate-support/', views.generate_note_support, name='generate-support'),
+    path('patient/note/<int:nota_id>/generate-support/stream/', views.generate_note_support_stream, name='generate-support-stream'),
+    path('patient/note/<int:nota_id>/generate-support/async/', views.generate_note_support_async, name='generate-support-async'),
     
 
     
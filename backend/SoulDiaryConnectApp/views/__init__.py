@@ -1,4 +1,4 @@
 from .auth_views import login_view, register_view, logout_view
 from .general_views import home
-from .doctor_views import get_doctor_profile, get_doctor_patients, get_patient_details, get_patient_notes, get_pat_note_details,add_clinical_comment, regenerate_clinical_analysis, get_or_generate_clinical_summary, get_patient_mood_stats, personalize_parameters
-from .patient_views import create_nota, get_note, get_patient_info, get_doctor_info, get_note_details, delete_nota, generate_note_support
+from .doctor_views import get_doctor_profile, get_doctor_patients, get_patient_details, get_patient_notes, get_pat_note_details,add_clinical_comment, regenerate_clinical_analysis, regenerate_clinical_analysis_stream, regenerate_clinical_analysis_async, get_or_generate_clinical_summary, get_or_generate_clinical_summary_async, get_clinical_summary_job, get_patient_mood_stats, personalize_parameters
+from .patient_views import create_nota, create_nota_async, get_note, get_patient_info, get_doctor_info, get_note_details, delete_nota, generate_note_support, generate_note_support_stream, generate_note_support_async
@@ -1,46 +1,96 @@
 import jwt
+from asgiref.sync import iscoroutinefunction
 from datetime import datetime, timedelta, timezone
-from functools import wraps
+from functools import partial, wraps
 from django.conf import settings
+from django.db.models import Value
 from django.http import JsonResponse
+from django.utils.functional import SimpleLazyObject
 from django.views.decorators.csrf import csrf_exempt
 from ..models import Medico, Paziente
+from .utils.jwt_cache import decodifica_token, get_cache_token
+from .utils.utenti import carica_medico, carica_paziente
 
 # ============================================================================
 # SAFETY DECORATOR
 # ============================================================================
+def _verifica_token(request):
+    """
+    Checks the JWT token of the request and attaches user_id and user_type to it.
+
+    Returns:
+    JsonResponse: the error response if the token is missing or not valid, None otherwise
+    """
+    token = None
+    
+    # Search token in the request header
+    if 'Authorization' in request.headers:
+        auth_header = request.headers['Authorization']
+        # The standard format that React Native should send is: "Bearer eyJhbGciOi..."
+        if auth_header.startswith('Bearer '):
+            token = auth_header.split(" ")[1]
+    
+    if not token:
+        return JsonResponse({'status': 'error', 'message': 'Token mancante! Accesso negato.'}, status=401)
+    
+    try:
+        # Decode and mathematically verify the token (once per token: the
+        # following requests with the same token read the cached claims until exp)
+        cache = get_cache_token()
+        data = cache.verifica(token) if cache else decodifica_token(token)
+        
+       # Attach user info to the request, so other views know who is logged in!
+        request.user_id = data['user_id']
+        request.user_type = data['user_type']
+        
+    except jwt.ExpiredSignatureError:
+        return JsonResponse({'status': 'error', 'message': 'Token scaduto! Effettua di nuovo il login.'}, status=401)
+    except jwt.InvalidTokenError:
+        return JsonResponse({'status': 'error', 'message': 'Token non valido!'}, status=401)
+
+    return None
+
+
+def _utente_richiesta(request, tipo, modello, carica):
+    if request.user_type != tipo:
+        raise modello.DoesNotExist(f"L'utente autenticato non è un {tipo}")
+    return carica(request.user_id)
+
+
+def _collega_utente(request):
+    """
+    Attaches request.paziente and request.medico: the profile is loaded on first
+    access (at most one query, the patient with their doctor) and then reused for
+    the rest of the request. Accessing the profile of the other user type raises
+    its DoesNotExist without querying the database.
+    """
+    request.paziente = SimpleLazyObject(partial(_utente_richiesta, request, 'paziente', Paziente, carica_paziente))
+    request.medico = SimpleLazyObject(partial(_utente_richiesta, request, 'medico', Medico, carica_medico))
+
+
 def token_required(f):
     """
     Decorator that protects views. Checks that the request
     contains a valid JWT token in the 'Authorization' header.
+    Works with both sync and async views.
+    Sync views also get the lazy request.paziente / request.medico profiles;
+    async views load them with utils.utenti.acarica_paziente.
     """
+    if iscoroutinefunction(f):
+        @wraps(f)
+        async def decorated_async(request, *args, **kwargs):
+            errore = _verifica_token(request)
+            if errore:
+                return errore
+            return await f(request, *args, **kwargs)
+        return decorated_async
+
     @wraps(f)
     def decorated(request, *args, **kwargs):
-        token = None
-        
-        # Search token in the request header
-        if 'Authorization' in request.headers:
-            auth_header = request.headers['Authorization']
-            # The standard format that React Native should send is: "Bearer eyJhbGciOi..."
-            if auth_header.startswith('Bearer '):
-                token = auth_header.split(" ")[1]
-        
-        if not token:
-            return JsonResponse({'status': 'error', 'message': 'Token mancante! Accesso negato.'}, status=401)
-        
-        try:
-            # Decode and mathematically verify the token
-            data = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
-            
-           # Attach user info to the request, so other views know who is logged in!
-            request.user_id = data['user_id']
-            request.user_type = data['user_type']
-            
-        except jwt.ExpiredSignatureError:
-            return JsonResponse({'status': 'error', 'message': 'Token scaduto! Effettua di nuovo il login.'}, status=401)
-        except jwt.InvalidTokenError:
-            return JsonResponse({'status': 'error', 'message': 'Token non valido!'}, status=401)
-        
+        errore = _verifica_token(request)
+        if errore:
+            return errore
+        _collega_utente(request)
         return f(request, *args, **kwargs)
     return decorated
 
@@ -48,6 +98,26 @@ def token_required(f):
 # ============================================================================
 # AUTHENTICATION VIEWS (API)
 # ============================================================================
+def cerca_utente(email, password):
+    """
+    Looks up the credentials among doctors and patients with a single UNION query
+    (email is unique, hence indexed, in both tables). A doctor wins over a patient
+    registered with the same credentials, as in the previous two-query lookup.
+
+    Returns:
+    tuple: (user_id, user_type), or None if the credentials are not valid
+    """
+    medici = Medico.objects.filter(email=email, password=password).annotate(
+        user_type=Value('medico'), priorita=Value(0)
+    ).values_list('codice_identificativo', 'user_type', 'priorita')
+    pazienti = Paziente.objects.filter(email=email, password=password).annotate(
+        user_type=Value('paziente'), priorita=Value(1)
+    ).values_list('codice_fiscale', 'user_type', 'priorita')
+
+    riga = medici.union(pazienti, all=True).order_by('priorita').first()
+    return riga[:2] if riga else None
+
+
 @csrf_exempt
 def login_view(request):
     """
@@ -58,15 +128,11 @@ def login_view(request):
         email = request.POST.get('email')
         password = request.POST.get('password')
 
-        medico = Medico.objects.filter(email=email, password=password).first()
-        paziente = Paziente.objects.filter(email=email, password=password).first()
+        utente = cerca_utente(email, password)
 
-        user = medico if medico else paziente
-        user_type = 'medico' if medico else ('paziente' if paziente else None)
+        if utente:
+            user_id, user_type = utente
 
-        if user:
-            user_id = user.codice_identificativo if medico else user.codice_fiscale
-            
             # Prepare the token contents
             payload = {
                 'user_id': user_id,
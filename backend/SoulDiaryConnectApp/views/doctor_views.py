@@ -1,15 +1,33 @@
+from asgiref.sync import sync_to_async
 from django.utils import timezone
 from django.http import JsonResponse
-from .utils.prompt import get_summary_prompt
-from .utils.ai import genera_con_ollama, genera_frasi_cliniche
+from .utils.ai import GenerazioneNonRiuscita, genera_frasi_cliniche, genera_frasi_cliniche_stream, genera_frasi_cliniche_async
 from .auth_views import token_required
-from ..models import Medico, NotaDiario, Paziente, RiassuntoCasoClinico
+from ..models import JobRiassunto, Medico, NotaDiario, Paziente, RiassuntoCasoClinico
 import logging
 from django.views.decorators.csrf import csrf_exempt
-from .utils.utils import get_emoji_for_context, get_emoji_for_emotion, get_emotion_category
+from .utils.utils import get_emoji_for_context, get_emoji_for_emotion, evento_sse, risposta_sse
+from .utils.riassunti import (
+    calcola_finestra_periodo,
+    formatta_data_generazione,
+    impronta_note,
+    riassunto_aggiornato
+)
+from .utils.statistiche import (
+    statistiche_umore_paziente,
+    serializza_statistiche_umore,
+    aggrega_statistiche_umore,
+    andamento_emotivo,
+    andamento_emotivo_per_bucket,
+    leggi_parametri_andamento,
+    ParametriAndamentoNonValidi
+)
+from .utils.constants import ANDAMENTO_MAX_PUNTI
+from .utils.jobs import accoda_riassunto, avvia_ripresa_job, chiave_job_riassunto, esegui_job_riassunto_in_processo, STATI_ATTIVI
+from .utils.worker_pool import get_pool_analisi, CodaAnalisiPiena
+from .utils.paginazione import leggi_parametri_paginazione, pagina_note, proiezione_lista_note, testo_lista_note, CursoreNonValido
 import json
 from django.utils import timezone
-from datetime import timedelta
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.shortcuts import get_object_or_404
@@ -30,8 +48,8 @@ def get_doctor_profile(request):
         }, status=403)
     
     try:
-        # Retrieve the doctor using the ID extracted from the Token (request.user_id)
-        medico = Medico.objects.get(codice_identificativo=request.user_id)
+        # The doctor of the Token (request.user_id), loaded by token_required on first access
+        medico = request.medico
         
         # Package the data needed by the React Native frontend
         data = {
@@ -133,17 +151,28 @@ def get_patient_details(request, codice_fiscale):
 def get_patient_notes(request, codice_fiscale):
     """
     Returns a list of notes for a specific patient for the Doctor view.
+    With ?limit=N (and ?cursor= taken from the previous page's next_cursor)
+    it returns one page of notes at a time. With ?vista=anteprima each note has
+    a preview of the text instead of the full text.
     """
     # Security check: only doctors can access
     if request.user_type != 'medico':
         return JsonResponse({'status': 'error', 'message': 'Non autorizzato'}, status=403)
     
     try:
+        paginata, cursore, limite = leggi_parametri_paginazione(request)
+        anteprima = request.GET.get('vista') == 'anteprima'
+
         # 1. Verifichiamo che il paziente appartenga al medico loggato (request.user_id)
         paziente = Paziente.objects.get(codice_fiscale=codice_fiscale, med_id=request.user_id)
         
-        # 2. Recuperiamo le note
-        note_db = NotaDiario.objects.filter(paz=paziente).order_by('-data_nota')
+        # 2. Recuperiamo le note (una pagina se richiesto con limit/cursor)
+        note_db = proiezione_lista_note(NotaDiario.objects.filter(paz=paziente), anteprima)
+        next_cursor = None
+        if paginata:
+            note_db, next_cursor = pagina_note(note_db, cursore, limite)
+        else:
+            note_db = note_db.order_by('-data_nota')
         
         note_list = []
         for nota in note_db:
@@ -159,13 +188,19 @@ def get_patient_notes(request, codice_fiscale):
             note_list.append({
                 "id": nota.id,
                 "data_iso": data_iso,
-                "testo": nota.testo_paziente,
+                **testo_lista_note(nota, anteprima),
                 "emozione": nota.emozione_predominante,
                 "generazione_in_corso": nota.generazione_in_corso
             })
 
-        return JsonResponse({'status': 'success', 'data': note_list})
+        risposta = {'status': 'success', 'data': note_list}
+        if paginata:
+            risposta['next_cursor'] = next_cursor
+
+        return JsonResponse(risposta)
         
+    except CursoreNonValido as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
     except Paziente.DoesNotExist:
         return JsonResponse({'status': 'error', 'message': 'Paziente non trovato o non associato a te'}, status=404)
     except Exception as e:
@@ -290,17 +325,20 @@ def regenerate_clinical_analysis(request, note_id):
             print(f"Nota: {nota}\nMedico:{nota.paz.med}\nPaziente:{nota.paz}\nTesto Paziente:{nota.testo_paziente}")
 
             # 2. Chiamiamo l'IA per generare la nuova frase clinica
+            # (senza cache: rigenerare deve sempre produrre un testo nuovo)
             nuova_analisi = genera_frasi_cliniche(
                 testo=nota.testo_paziente, 
                 medico=nota.paz.med, 
                 paziente=nota.paz, 
-                nota_id=nota.id
+                nota_id=nota.id,
+                usa_cache=False
             )
 
             # 3. Aggiorniamo il database
             nota.testo_clinico = nuova_analisi
+            nota.data_modifica = timezone.now()
             # Usiamo update_fields per essere veloci ed evitare sovrascritture accidentali
-            nota.save(update_fields=["testo_clinico"])
+            nota.save(update_fields=["testo_clinico", "data_modifica"])
 
             # 4. Restituiamo il nuovo testo al frontend
             return JsonResponse({
@@ -313,6 +351,9 @@ def regenerate_clinical_analysis(request, note_id):
 
         except NotaDiario.DoesNotExist:
             return JsonResponse({"status": "error", "message": "Nota non trovata o non autorizzata"}, status=404)
+        except GenerazioneNonRiuscita as e:
+            # L'analisi salvata resta quella precedente
+            return JsonResponse({"status": "error", "message": str(e)}, status=503)
         except Exception as e:
             return JsonResponse({"status": "error", "message": f"Errore AI: {str(e)}"}, status=500)
             
@@ -320,113 +361,205 @@ def regenerate_clinical_analysis(request, note_id):
 
 
 
+@csrf_exempt
+@token_required
+def regenerate_clinical_analysis_stream(request, note_id):
+    """
+    Versione in streaming di regenerate_clinical_analysis: il testo viene inviato
+    come Server-Sent Events man mano che il modello lo genera ("data: {"testo": ...}"),
+    poi salvato e confermato con un evento finale "fine". Se la generazione fallisce
+    viene inviato un evento "errore" e l'analisi salvata resta quella precedente.
+    """
+    if request.user_type != 'medico':
+        return JsonResponse({"status": "error", "message": "Non autorizzato"}, status=403)
+
+    if request.method != 'POST':
+        return JsonResponse({"status": "error", "message": "Metodo non consentito"}, status=405)
+
+    try:
+        nota = NotaDiario.objects.select_related('paz', 'paz__med').get(
+            id=note_id, 
+            paz__med__codice_identificativo=request.user_id
+        )
+    except NotaDiario.DoesNotExist:
+        return JsonResponse({"status": "error", "message": "Nota non trovata o non autorizzata"}, status=404)
+
+    def eventi():
+        parti = []
+        try:
+            for frammento in genera_frasi_cliniche_stream(
+                testo=nota.testo_paziente,
+                medico=nota.paz.med,
+                paziente=nota.paz,
+                nota_id=nota.id,
+                usa_cache=False
+            ):
+                parti.append(frammento)
+                yield evento_sse({"testo": frammento})
+        except GenerazioneNonRiuscita as e:
+            yield evento_sse({"message": str(e)}, evento="errore")
+            return
+
+        nota.testo_clinico = "".join(parti).strip()
+        nota.data_modifica = timezone.now()
+        nota.save(update_fields=["testo_clinico", "data_modifica"])
+        yield evento_sse({"testo_clinico": nota.testo_clinico}, evento="fine")
+
+    return risposta_sse(eventi())
+
+
+@csrf_exempt
+@token_required
+async def regenerate_clinical_analysis_async(request, note_id):
+    """
+    Versione asincrona (ASGI) di regenerate_clinical_analysis: l'attesa di Ollama
+    non occupa un thread del server.
+    """
+    if request.user_type != 'medico':
+        return JsonResponse({"status": "error", "message": "Non autorizzato"}, status=403)
+
+    if request.method != 'POST':
+        return JsonResponse({"status": "error", "message": "Metodo non consentito"}, status=405)
+
+    try:
+        nota = await NotaDiario.objects.select_related('paz', 'paz__med').aget(
+            id=note_id, 
+            paz__med__codice_identificativo=request.user_id
+        )
+
+        nuova_analisi = await genera_frasi_cliniche_async(
+            testo=nota.testo_paziente, 
+            medico=nota.paz.med, 
+            paziente=nota.paz, 
+            nota_id=nota.id,
+            usa_cache=False
+        )
+
+        nota.testo_clinico = nuova_analisi
+        nota.data_modifica = timezone.now()
+        await nota.asave(update_fields=["testo_clinico", "data_modifica"])
+
+        return JsonResponse({
+            "status": "success", 
+            "message": "Analisi clinica rigenerata con successo",
+            "data": {
+                "testo_clinico": nota.testo_clinico
+            }
+        })
+
+    except NotaDiario.DoesNotExist:
+        return JsonResponse({"status": "error", "message": "Nota non trovata o non autorizzata"}, status=404)
+    except GenerazioneNonRiuscita as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=503)
+    except Exception as e:
+        return JsonResponse({"status": "error", "message": f"Errore AI: {str(e)}"}, status=500)
+
+
+def _riassunto_o_job(paziente, med_id, parametri):
+    """
+    Logica comune a get_or_generate_clinical_summary e alla sua versione asincrona.
+    Con genera=1 (e note cambiate, o forza=1) accoda il job di generazione e restituisce
+    i suoi dati con status 202; altrimenti restituisce il riassunto salvato.
+
+    Returns:
+    tuple: (dati della risposta, status HTTP)
+    """
+    # 1. Gestione Parametri
+    forza_generazione = parametri.get('genera', '0') == '1'
+    incrementale = parametri.get('incrementale', '0') == '1'
+    forza = parametri.get('forza', '0') == '1'
+
+    # 2. Calcolo Finestra Temporale
+    periodo, data_inizio, periodo_label = calcola_finestra_periodo(parametri.get('periodo', '7days'))
+
+    # 3. Recupero Note
+    note_periodo = NotaDiario.objects.filter(
+        paz=paziente,
+        data_nota__gte=data_inizio
+    )
+
+    # 4. Riassunto salvato e impronta attuale delle note (una sola query aggregata):
+    # il riassunto non è aggiornato se le note da cui è stato generato sono cambiate
+    riassunto_esistente = RiassuntoCasoClinico.objects.filter(
+        paz=paziente,
+        med_id=med_id,
+        periodo=periodo
+    ).first()
+    impronta = impronta_note(note_periodo)
+    stale = not riassunto_aggiornato(riassunto_esistente, impronta) and (
+        riassunto_esistente is not None or impronta.numero_note > 0
+    )
+
+    # 5. Logica Principale: Generare o Recuperare?
+    # Se le note non sono cambiate la generazione viene saltata (salvo forza=1)
+    if forza_generazione and (stale or forza):
+        # La generazione può durare minuti: viene eseguita da un job in background e il
+        # client ne segue l'avanzamento su doctor/summary-jobs/<job_id>/. Richieste
+        # concorrenti per lo stesso paziente e periodo si uniscono allo stesso job
+        job, avviato = accoda_riassunto(paziente.codice_fiscale, med_id, periodo, incrementale, forza)
+        if avviato:
+            avvia_ripresa_job()
+            try:
+                get_pool_analisi().submit(esegui_job_riassunto_in_processo, job.id)
+            except CodaAnalisiPiena:
+                # Il job resta nella coda persistente: viene ripreso appena il pool si
+                # libera (riprendi_job_in_processo) o da un analysis_worker
+                logger.warning(f"Coda analisi piena, job riassunto {job.id} rimandato")
+
+        response_data = _dati_job_riassunto(job)
+        response_data["unito_a_job_esistente"] = not avviato
+        return response_data, 202
+
+    # Modalità Lettura
+    riassunto_testo = None
+    data_generazione = None
+    if riassunto_esistente:
+        riassunto_testo = riassunto_esistente.testo_riassunto
+        data_generazione = riassunto_esistente.data_generazione
+
+    job_in_corso = JobRiassunto.objects.filter(
+        chiave=chiave_job_riassunto(paziente.codice_fiscale, med_id, periodo),
+        stato__in=STATI_ATTIVI
+    ).values_list('id', flat=True).first()
+
+    # 6. Prepara la risposta JSON
+    response_data = {
+        "periodo_valore": periodo,
+        "periodo_label": periodo_label,
+        "numero_note_analizzate": impronta.numero_note,
+        "testo_riassunto": riassunto_testo,
+        "data_generazione": formatta_data_generazione(data_generazione),
+        "ha_note": impronta.numero_note > 0,
+        "stale": stale,
+        "generazione_saltata": forza_generazione,
+        "job_in_corso": job_in_corso
+    }
+    return response_data, 200
+
+
 @csrf_exempt
 @token_required
 def get_or_generate_clinical_summary(request, paziente_id):
     """
     API per recuperare o generare un riassunto clinico di un paziente per un dato periodo.
+    Con ?genera=1 la generazione viene accodata in background e la risposta (202) contiene
+    il job da seguire su get_clinical_summary_job; con anche &incrementale=1 il riassunto
+    salvato viene aggiornato con le sole note che non copre ancora. La generazione viene
+    saltata se le note del periodo non sono cambiate (stale=false), salvo con &forza=1.
     """
     if request.user_type != 'medico':
         return JsonResponse({"status": "error", "message": "Non autorizzato"}, status=403)
 
     if request.method == 'GET':
         try:
-            # 1. Verifica permessi e recupera paziente
+            # Verifica permessi e recupera paziente
             paziente_selezionato = get_object_or_404(Paziente, codice_fiscale=paziente_id)
             
             if paziente_selezionato.med_id != request.user_id:
                 return JsonResponse({"status": "error", "message": "Paziente non assegnato a questo medico."}, status=403)
 
-            # 2. Gestione Parametri
-            periodo = request.GET.get('periodo', '7days')
-            forza_generazione = request.GET.get('genera', '0') == '1'
-
-            # 3. Calcolo Finestra Temporale
-            oggi = timezone.now()
-            if periodo == '7days':
-                data_inizio = oggi - timedelta(days=7)
-                periodo_label = 'Ultimi 7 giorni'
-            elif periodo == '30days':
-                data_inizio = oggi - timedelta(days=30)
-                periodo_label = 'Ultimo mese'
-            elif periodo == '3months':
-                data_inizio = oggi - timedelta(days=90)
-                periodo_label = 'Ultimi 3 mesi'
-            elif periodo == 'year':
-                data_inizio = oggi - timedelta(days=365)
-                periodo_label = 'Ultimo anno'
-            else:
-                data_inizio = oggi - timedelta(days=7)
-                periodo_label = 'Ultimi 7 giorni'
-                periodo = '7days' # fallback sicuro
-
-            # 4. Recupero Note
-            note_periodo = NotaDiario.objects.filter(
-                paz=paziente_selezionato,
-                data_nota__gte=data_inizio
-            ).order_by('data_nota')
-
-            riassunto_testo = None
-            data_generazione = None
-
-            # 5. Logica Principale: Generare o Recuperare?
-            if forza_generazione:
-                if note_periodo.exists():
-                    # Costruisci il contesto per Ollama
-                    note_testo = []
-                    for nota in note_periodo:
-                        nota_info = f"Data: {nota.data_nota.strftime('%d/%m/%Y')}"
-                        if nota.emozione_predominante:
-                            nota_info += f" | Emozione: {nota.emozione_predominante}"
-                        nota_info += f"\nNota paziente: {nota.testo_paziente}"
-                        if nota.testo_clinico:
-                            nota_info += f"\nAnalisi clinica: {nota.testo_clinico}"
-                        note_testo.append(nota_info)
-
-                    contesto_note = "\n\n---\n\n".join(note_testo)
-
-                    # Genera con IA
-                    prompt = get_summary_prompt(paziente_selezionato, periodo_label, note_periodo, contesto_note)
-                    riassunto_testo = genera_con_ollama(prompt, max_chars=2000, temperature=0.5)
-                    data_generazione = timezone.now()
-
-                    # Salva nel Database
-                    RiassuntoCasoClinico.objects.update_or_create(
-                        paz=paziente_selezionato,
-                        med_id=request.user_id,
-                        periodo=periodo,
-                        defaults={
-                            'testo_riassunto': riassunto_testo,
-                            'data_generazione': data_generazione,
-                        }
-                    )
-                else:
-                    riassunto_testo = "Non sono presenti note nel periodo selezionato."
-                    data_generazione = timezone.now()
-            
-            else:
-                # Modalità Lettura: cerca un riassunto esistente
-                riassunto_esistente = RiassuntoCasoClinico.objects.filter(
-                    paz=paziente_selezionato,
-                    med_id=request.user_id,
-                    periodo=periodo
-                ).first()
-
-                if riassunto_esistente:
-                    riassunto_testo = riassunto_esistente.testo_riassunto
-                    data_generazione = riassunto_esistente.data_generazione
-
-            # 6. Prepara la risposta JSON
-            response_data = {
-                "periodo_valore": periodo,
-                "periodo_label": periodo_label,
-                "numero_note_analizzate": note_periodo.count(),
-                "testo_riassunto": riassunto_testo,
-                "data_generazione": data_generazione.strftime('%d/%m/%Y alle %H:%M') if data_generazione else None,
-                "ha_note": note_periodo.exists()
-            }
-
-            return JsonResponse({"status": "success", "data": response_data})
+            response_data, status = _riassunto_o_job(paziente_selezionato, request.user_id, request.GET)
+            return JsonResponse({"status": "success", "data": response_data}, status=status)
 
         except Paziente.DoesNotExist:
              return JsonResponse({"status": "error", "message": "Paziente non trovato."}, status=404)
@@ -437,9 +570,98 @@ def get_or_generate_clinical_summary(request, paziente_id):
     return JsonResponse({"status": "error", "message": "Metodo non consentito"}, status=405)
 
 
+def _dati_job_riassunto(job):
+    """
+    Stato di un job di generazione del riassunto; a job completato include il riassunto
+    nello stesso formato di get_or_generate_clinical_summary.
+    """
+    periodo, _, periodo_label = calcola_finestra_periodo(job.periodo)
+    dati = {
+        "job_id": job.id,
+        "stato": job.stato,
+        "fase": job.fase,
+        "passi_completati": job.passi_completati,
+        "passi_totali": job.passi_totali,
+        "tentativi": job.tentativi,
+        # Errore dell'ultimo tentativo: un job in coda con un errore è in attesa di un nuovo tentativo
+        "ultimo_errore": job.ultimo_errore,
+        "periodo_valore": periodo,
+        "periodo_label": periodo_label,
+    }
+
+    if job.stato == 'fallito':
+        dati["errore"] = job.ultimo_errore
+    elif job.stato == 'completato':
+        riassunto = job.riassunto
+        dati.update({
+            "numero_note_analizzate": len(riassunto.note_coperte) if riassunto else 0,
+            "testo_riassunto": riassunto.testo_riassunto if riassunto else "Non sono presenti note nel periodo selezionato.",
+            "data_generazione": formatta_data_generazione(riassunto.data_generazione if riassunto else job.data_aggiornamento),
+            "ha_note": riassunto is not None,
+            "modalita_generazione": job.modalita_generazione,
+            "note_aggiunte": job.note_aggiunte,
+        })
+
+    return dati
+
+
+@csrf_exempt
+@token_required
+def get_clinical_summary_job(request, job_id):
+    """
+    API per seguire (in polling) un job di generazione del riassunto clinico.
+    """
+    if request.user_type != 'medico':
+        return JsonResponse({"status": "error", "message": "Non autorizzato"}, status=403)
+
+    if request.method != 'GET':
+        return JsonResponse({"status": "error", "message": "Metodo non consentito"}, status=405)
+
+    job = JobRiassunto.objects.select_related('riassunto').filter(id=job_id, med_id=request.user_id).first()
+    if job is None:
+        return JsonResponse({"status": "error", "message": "Job non trovato."}, status=404)
+
+    return JsonResponse({"status": "success", "data": _dati_job_riassunto(job)})
+
+
+@csrf_exempt
+@token_required
+async def get_or_generate_clinical_summary_async(request, paziente_id):
+    """
+    Versione asincrona (ASGI) di get_or_generate_clinical_summary, con le stesse risposte:
+    anche qui la generazione passa dalla coda dei job (202 + job da seguire in polling),
+    quindi la richiesta non attende Ollama e richieste concorrenti non generano due volte.
+    """
+    if request.user_type != 'medico':
+        return JsonResponse({"status": "error", "message": "Non autorizzato"}, status=403)
+
+    if request.method != 'GET':
+        return JsonResponse({"status": "error", "message": "Metodo non consentito"}, status=405)
+
+    try:
+        paziente_selezionato = await Paziente.objects.filter(codice_fiscale=paziente_id).afirst()
+        if paziente_selezionato is None:
+            return JsonResponse({"status": "error", "message": "Paziente non trovato."}, status=404)
+
+        if paziente_selezionato.med_id != request.user_id:
+            return JsonResponse({"status": "error", "message": "Paziente non assegnato a questo medico."}, status=403)
+
+        response_data, status = await sync_to_async(_riassunto_o_job)(paziente_selezionato, request.user_id, request.GET)
+        return JsonResponse({"status": "success", "data": response_data}, status=status)
+
+    except Exception as e:
+        logger.error(f"Errore generazione riassunto: {str(e)}")
+        return JsonResponse({"status": "error", "message": str(e)}, status=500)
+
+
 @csrf_exempt
 @token_required
 def get_patient_mood_stats(request, paziente_id):
+    """
+    Mood statistics, context correlations and mood chart of a patient.
+    Optional: ?from=YYYY-MM-DD&to=YYYY-MM-DD to restrict the period and
+    ?bucket=day|week|month to group the chart points.
+    """
     if request.user_type != 'medico':
         return JsonResponse({"status": "error", "message": "Non autorizzato"}, status=403)
 
@@ -449,118 +671,30 @@ def get_patient_mood_stats(request, paziente_id):
             if paziente_selezionato.med_id != request.user_id:
                 return JsonResponse({"status": "error", "message": "Paziente non assegnato a questo medico."}, status=403)
 
-            note_diario = NotaDiario.objects.filter(paz=paziente_selezionato).order_by('data_nota')
+            data_inizio, data_fine, bucket = leggi_parametri_andamento(request)
 
-            emotion_chart_data = None
-            statistiche = {
-                'totale_note': 0, 'media_emotiva': 0,
-                'emozione_frequente': None, 'emozione_frequente_count': 0, 'emozione_frequente_emoji': ''
-            }
-            correlazione_contesto_data = None
+            note_paziente = NotaDiario.objects.filter(paz=paziente_selezionato)
+            if data_inizio:
+                note_paziente = note_paziente.filter(data_nota__gte=data_inizio)
+            if data_fine:
+                note_paziente = note_paziente.filter(data_nota__lt=data_fine)
 
-            if note_diario.exists():
-                # --- A. ANDAMENTO EMOTIVO (GRAFICO) ---
-                dates = []
-                full_dates = [] # <--- QUESTO E' IL CAMPO MAGICO CHE MANCAVA!
-                emotions = []
-                emotion_values = []
-
-                category_score_map = {
-                    'positive': 4, 'neutral': 3, 'anxious': 2, 'negative': 1,
-                }
-
-                contatore_emozioni = {}
-                somma_valori = 0
-
-                for nota in note_diario:
-                    if nota.emozione_predominante:
-                        emozione_lower = nota.emozione_predominante.lower()
-                        dates.append(nota.data_nota.strftime('%d/%m'))
-                        full_dates.append(nota.data_nota.strftime('%Y-%m-%d')) # <--- AGGIUNTO QUI
-                        emotions.append(emozione_lower)
-
-                        categoria = get_emotion_category(emozione_lower)
-                        score = category_score_map.get(categoria, 2)
-                        emotion_values.append(score)
-                        somma_valori += score
-
-                        contatore_emozioni[emozione_lower] = contatore_emozioni.get(emozione_lower, 0) + 1
-
-                if dates:
-                    emotion_chart_data = {
-                        'dates': dates,
-                        'full_dates': full_dates, # <--- AGGIUNTO QUI
-                        'emotions': emotions,
-                        'values': emotion_values,
-                    }
-
-                    media_emotiva = somma_valori / len(emotion_values) if emotion_values else 0
-                    emozione_piu_frequente = max(contatore_emozioni.items(), key=lambda x: x[1]) if contatore_emozioni else (None, 0)
-
-                    statistiche = {
-                        'totale_note': note_diario.count(),
-                        'media_emotiva': round(media_emotiva, 2),
-                        'emozione_frequente': emozione_piu_frequente[0].title() if emozione_piu_frequente[0] else None,
-                        'emozione_frequente_count': emozione_piu_frequente[1],
-                        'emozione_frequente_emoji': get_emoji_for_emotion(emozione_piu_frequente[0]),
-                    }
-
-                # --- B. CORRELAZIONI CONTESTO SOCIALE ---
-                contesto_emozioni = {} 
-
-                for nota in note_diario:
-                    contesto = nota.contesto_sociale
-                    emozione = nota.emozione_predominante
-
-                    if contesto and emozione:
-                        contesto_lower = contesto.lower().strip()
-                        emozione_lower = emozione.lower().strip()
-                        categoria_emozione = get_emotion_category(emozione_lower)
-
-                        if contesto_lower not in contesto_emozioni:
-                            contesto_emozioni[contesto_lower] = {
-                                'positive': 0, 'neutral': 0, 'anxious': 0, 'negative': 0,
-                                'total': 0, 'sum': 0,
-                                'emoji': get_emoji_for_context(contesto_lower),
-                            }
-
-                        contesto_emozioni[contesto_lower][categoria_emozione] += 1
-                        contesto_emozioni[contesto_lower]['total'] += 1
-                        contesto_emozioni[contesto_lower]['sum'] += category_score_map.get(categoria_emozione, 2)
-
-                if contesto_emozioni:
-                    contesti_ordinati = sorted(contesto_emozioni.items(), key=lambda x: x[1]['total'], reverse=True)
-
-                    labels, positive_data, neutral_data, anxious_data, negative_data, medie_contesto, emojis = [], [], [], [], [], [], []
-
-                    for contesto, dati in contesti_ordinati:
-                        labels.append(contesto.title())
-                        positive_data.append(dati['positive'])
-                        neutral_data.append(dati['neutral'])
-                        anxious_data.append(dati['anxious'])
-                        negative_data.append(dati['negative'])
-                        media = round(dati['sum'] / dati['total'], 2) if dati['total'] > 0 else 0
-                        medie_contesto.append(media)
-                        emojis.append(dati['emoji'])
-
-                    contesto_migliore = max(contesti_ordinati, key=lambda x: x[1]['sum'] / x[1]['total'] if x[1]['total'] > 0 else 0)
-                    contesto_peggiore = min(contesti_ordinati, key=lambda x: x[1]['sum'] / x[1]['total'] if x[1]['total'] > 0 else 0)
-
-                    correlazione_contesto_data = {
-                        'labels': labels,
-                        'positive': positive_data,
-                        'neutral': neutral_data,
-                        'anxious': anxious_data,
-                        'negative': negative_data,
-                        'medie': medie_contesto,
-                        'emojis': emojis,
-                        'contesto_migliore': contesto_migliore[0].title(),
-                        'contesto_migliore_emoji': contesto_migliore[1]['emoji'],
-                        'contesto_migliore_media': round(contesto_migliore[1]['sum'] / contesto_migliore[1]['total'], 2) if contesto_migliore[1]['total'] > 0 else 0,
-                        'contesto_peggiore': contesto_peggiore[0].title(),
-                        'contesto_peggiore_emoji': contesto_peggiore[1]['emoji'],
-                        'contesto_peggiore_media': round(contesto_peggiore[1]['sum'] / contesto_peggiore[1]['total'], 2) if contesto_peggiore[1]['total'] > 0 else 0,
-                    }
+            # --- A. STATISTICHE E CORRELAZIONI CONTESTO SOCIALE ---
+            # Aggregati materializzati; per un intervallo di date (o con ?live=1) sono
+            # ricalcolati dal database (GROUP BY)
+            if data_inizio or data_fine or request.GET.get('live') == '1':
+                stat = aggrega_statistiche_umore(note_paziente)
+            else:
+                stat = statistiche_umore_paziente(paziente_selezionato.codice_fiscale)
+            statistiche, correlazione_contesto_data = serializza_statistiche_umore(stat)
+
+            # --- B. ANDAMENTO EMOTIVO (GRAFICO) ---
+            # Un punto per nota; raggruppato per giorno/settimana/mese se richiesto con
+            # ?bucket= o se le note superano il numero massimo di punti
+            if bucket is None and stat.note_con_emozione <= ANDAMENTO_MAX_PUNTI:
+                emotion_chart_data = andamento_emotivo(note_paziente)
+            else:
+                emotion_chart_data = andamento_emotivo_per_bucket(note_paziente, bucket or 'day', data_inizio, data_fine)
 
             return JsonResponse({
                 "status": "success", 
@@ -571,6 +705,8 @@ def get_patient_mood_stats(request, paziente_id):
                 }
             })
 
+        except ParametriAndamentoNonValidi as e:
+             return JsonResponse({"status": "error", "message": str(e)}, status=400)
         except Paziente.DoesNotExist:
              return JsonResponse({"status": "error", "message": "Paziente non trovato."}, status=404)
         except Exception as e:
@@ -1,22 +1,67 @@
 import json
-import threading
 import logging
+from asgiref.sync import sync_to_async
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
+from django.db import transaction
 from django.utils import timezone
 from django.utils.timezone import now, localtime
 from datetime import datetime
 from ..models import Paziente, NotaDiario
 from .auth_views import token_required  
+from .utils.utenti import acarica_paziente
 from .utils.ai import (
+    GenerazioneNonRiuscita,
     genera_messaggio_emergenza,
     genera_frasi_di_supporto,
-    rileva_contenuto_crisi,
-    genera_analisi_in_background
+    genera_frasi_di_supporto_async,
+    genera_frasi_di_supporto_stream,
+    rileva_contenuto_crisi
 )
+from .utils.jobs import accoda_analisi, avvia_ripresa_job, esegui_job_in_processo
+from .utils.worker_pool import get_pool_analisi, CodaAnalisiPiena
+from .utils.utils import evento_sse, risposta_sse
+from .utils.statistiche import blocca_statistiche_umore, applica_variazione_nota
+from .utils.paginazione import leggi_parametri_paginazione, pagina_note, proiezione_lista_note, testo_lista_note, CursoreNonValido
 
 logger = logging.getLogger(__name__)
 
+def _salva_nota_e_accoda_analisi(paziente, testo_paziente, testo_supporto, is_emergency, tipo_emergenza, messaggio_emergenza):
+    """
+    Saves a new note and starts its background analysis. Shared by create_nota and create_nota_async.
+    """
+    orario_per_db = datetime.now()
+    print(f"Data salvataggio nota (Locale): {orario_per_db}")
+
+    # The note and its analysis job are saved together: if the process dies
+    # before the analysis completes, a worker will pick the job up again
+    with transaction.atomic():
+        stat = blocca_statistiche_umore(paziente.codice_fiscale)
+        nota = NotaDiario.objects.create(
+            paz=paziente,
+            testo_paziente=testo_paziente,
+            testo_supporto=testo_supporto,
+            testo_clinico="",  
+            data_nota=orario_per_db,
+            is_emergency=is_emergency,
+            tipo_emergenza=tipo_emergenza,
+            messaggio_emergenza=messaggio_emergenza,
+            generazione_in_corso=True
+        )
+        applica_variazione_nota(stat, delta_note=1)
+        job = accoda_analisi(nota)
+
+    avvia_ripresa_job()
+    try:
+        get_pool_analisi().submit(esegui_job_in_processo, job.id)
+    except CodaAnalisiPiena:
+        # The job stays in the persistent queue: it is picked up when the pool frees
+        # up (riprendi_job_in_processo) or by an analysis_worker
+        logger.warning(f"Coda analisi piena, job {job.id} rimandato: {get_pool_analisi().metriche()}")
+
+    return nota
+
+
 @csrf_exempt
 @token_required 
 def create_nota(request):
@@ -27,8 +72,7 @@ def create_nota(request):
         return JsonResponse({"status": "error", "message": "Accesso negato. Solo i pazienti possono creare note nel diario."}, status=403)
 
     try:
-        paziente_id = request.user_id
-        paziente = Paziente.objects.get(codice_fiscale=paziente_id)
+        paziente = request.paziente
         medico = paziente.med
 
         data = json.loads(request.body)
@@ -46,29 +90,70 @@ def create_nota(request):
             messaggio_emergenza = genera_messaggio_emergenza(tipo_emergenza, medico)
         else:
             if generate_response_flag:
-                testo_supporto = genera_frasi_di_supporto(testo_paziente, paziente)
+                try:
+                    testo_supporto = genera_frasi_di_supporto(testo_paziente, paziente)
+                except GenerazioneNonRiuscita as e:
+                    # La nota viene salvata comunque: la frase si può richiedere dopo con generate_note_support
+                    logger.warning(f"Frase di supporto non generata: {e}")
+
+        nota = _salva_nota_e_accoda_analisi(
+            paziente, testo_paziente, testo_supporto, is_emergency, tipo_emergenza, messaggio_emergenza
+        )
 
-        orario_per_db = datetime.now()
-        print(f"Data salvataggio nota (Locale): {orario_per_db}")
+        return JsonResponse({
+            "status": "success", 
+            "message": "Nota salvata con successo", 
+            "data": {"nota_id": nota.id}
+        }, status=201)
 
-        nota = NotaDiario.objects.create(
-            paz=paziente,
-            testo_paziente=testo_paziente,
-            testo_supporto=testo_supporto,
-            testo_clinico="",  
-            data_nota=orario_per_db,
-            is_emergency=is_emergency,
-            tipo_emergenza=tipo_emergenza,
-            messaggio_emergenza=messaggio_emergenza,
-            generazione_in_corso=True
-        )
+    except Paziente.DoesNotExist:
+        return JsonResponse({"status": "error", "message": "Paziente non trovato nel sistema."}, status=404)
+    except json.JSONDecodeError:
+        return JsonResponse({"status": "error", "message": "Formato dati non valido (JSON atteso)."}, status=400)
+    except Exception as e:
+        logger.error(f"Errore nella creazione della nota: {str(e)}")
+        return JsonResponse({"status": "error", "message": f"Errore interno del server: {str(e)}"}, status=500)
+
+
+@csrf_exempt
+@token_required
+async def create_nota_async(request):
+    """
+    Async (ASGI) version of create_nota: the supporting phrase is generated without
+    holding a server thread, the note is then saved as in create_nota.
+    """
+    if request.method != 'POST':
+        return JsonResponse({"status": "error", "message": "Metodo non consentito"}, status=405)
+
+    if getattr(request, 'user_type', None) != 'paziente':
+        return JsonResponse({"status": "error", "message": "Accesso negato. Solo i pazienti possono creare note nel diario."}, status=403)
+
+    try:
+        paziente = await acarica_paziente(request.user_id)
+        medico = paziente.med
+
+        data = json.loads(request.body)
+        testo_paziente = data.get('testo', '').strip()
+        generate_response_flag = data.get('aiSupport', False)
+
+        if not testo_paziente:
+            return JsonResponse({"status": "error", "message": "Il testo della nota non può essere vuoto."}, status=400)
 
-        thread = threading.Thread(
-            target=genera_analisi_in_background,
-            args=(nota.id, testo_paziente, medico, paziente)
+        testo_supporto = ""
+        is_emergency, tipo_emergenza = rileva_contenuto_crisi(testo_paziente)
+        messaggio_emergenza = None
+
+        if is_emergency:
+            messaggio_emergenza = genera_messaggio_emergenza(tipo_emergenza, medico)
+        elif generate_response_flag:
+            try:
+                testo_supporto = await genera_frasi_di_supporto_async(testo_paziente, paziente)
+            except GenerazioneNonRiuscita as e:
+                logger.warning(f"Frase di supporto non generata: {e}")
+
+        nota = await sync_to_async(_salva_nota_e_accoda_analisi)(
+            paziente, testo_paziente, testo_supporto, is_emergency, tipo_emergenza, messaggio_emergenza
         )
-        thread.daemon = True
-        thread.start()
 
         return JsonResponse({
             "status": "success", 
@@ -99,7 +184,7 @@ def generate_note_support(request, nota_id):
 
     try:
         # We retrieve the patient via token
-        paziente = Paziente.objects.get(codice_fiscale=request.user_id)
+        paziente = request.paziente
         
         # Security: We search for the note and make sure it belongs to this patient
         nota = NotaDiario.objects.get(id=nota_id, paz=paziente)
@@ -126,14 +211,103 @@ def generate_note_support(request, nota_id):
         return JsonResponse({"status": "error", "message": "Nota non trovata o non autorizzato."}, status=404)
     except Paziente.DoesNotExist:
         return JsonResponse({"status": "error", "message": "Paziente non trovato."}, status=404)
+    except GenerazioneNonRiuscita as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=503)
+    except Exception as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=500)
+
+
+@csrf_exempt
+@token_required
+async def generate_note_support_async(request, nota_id):
+    """
+    Async (ASGI) version of generate_note_support.
+    """
+    if request.method != 'POST':
+        return JsonResponse({"status": "error", "message": "Metodo non consentito. Usa POST."}, status=405)
+
+    if request.user_type != 'paziente':
+        return JsonResponse({"status": "error", "message": "Accesso negato. Solo i pazienti possono eseguire questa azione."}, status=403)
+
+    try:
+        nota = await NotaDiario.objects.select_related('paz').aget(id=nota_id, paz__codice_fiscale=request.user_id)
+
+        # If there isn't already a supporting sentence, we generate it.
+        if not nota.testo_supporto or nota.testo_supporto.strip() == '':
+            testo_supporto = await genera_frasi_di_supporto_async(nota.testo_paziente, nota.paz)
+            nota.testo_supporto = testo_supporto
+            await nota.asave(update_fields=["testo_supporto"])
+            
+            return JsonResponse({
+                "status": "success", 
+                "message": "Frase generata con successo.", 
+                "testo_supporto": testo_supporto
+            })
+        else:
+            return JsonResponse({
+                "status": "success", 
+                "message": "Frase già esistente.", 
+                "testo_supporto": nota.testo_supporto
+            })
+
+    except NotaDiario.DoesNotExist:
+        return JsonResponse({"status": "error", "message": "Nota non trovata o non autorizzato."}, status=404)
+    except GenerazioneNonRiuscita as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=503)
     except Exception as e:
         return JsonResponse({"status": "error", "message": str(e)}, status=500)
 
 
+@csrf_exempt
+@token_required
+def generate_note_support_stream(request, nota_id):
+    """
+    Streaming version of generate_note_support: the supporting phrase is sent as
+    Server-Sent Events while it is generated ("data: {"testo": ...}"), then saved
+    and confirmed with a final "fine" event. If the generation fails an "errore"
+    event is sent instead and nothing is saved.
+    """
+    if request.method != 'POST':
+        return JsonResponse({"status": "error", "message": "Metodo non consentito. Usa POST."}, status=405)
+
+    if request.user_type != 'paziente':
+        return JsonResponse({"status": "error", "message": "Accesso negato. Solo i pazienti possono eseguire questa azione."}, status=403)
+
+    try:
+        nota = NotaDiario.objects.select_related('paz').get(id=nota_id, paz__codice_fiscale=request.user_id)
+    except NotaDiario.DoesNotExist:
+        return JsonResponse({"status": "error", "message": "Nota non trovata o non autorizzato."}, status=404)
+
+    def eventi():
+        # If there is already a supporting sentence, it is sent as is
+        if nota.testo_supporto and nota.testo_supporto.strip() != '':
+            yield evento_sse({"testo": nota.testo_supporto})
+            yield evento_sse({"testo_supporto": nota.testo_supporto}, evento="fine")
+            return
+
+        parti = []
+        try:
+            for frammento in genera_frasi_di_supporto_stream(nota.testo_paziente, nota.paz):
+                parti.append(frammento)
+                yield evento_sse({"testo": frammento})
+        except GenerazioneNonRiuscita as e:
+            yield evento_sse({"message": str(e)}, evento="errore")
+            return
+
+        nota.testo_supporto = "".join(parti).strip()
+        nota.save(update_fields=["testo_supporto"])
+        yield evento_sse({"testo_supporto": nota.testo_supporto}, evento="fine")
+
+    return risposta_sse(eventi())
+
+
 @token_required 
 def get_note(request):
     """
     Recupera l'elenco di tutte le note del paziente loggato, gestendo i fusi orari.
+    Con ?limit=N (e ?cursor= preso dal next_cursor della pagina precedente)
+    restituisce una pagina di note alla volta. Con ?vista=anteprima ogni nota
+    contiene un'anteprima del testo al posto del testo completo.
     """
     if request.method != 'GET':
         return JsonResponse({"status": "error", "message": "Metodo non consentito"}, status=405)
@@ -142,11 +316,18 @@ def get_note(request):
         return JsonResponse({"status": "error", "message": "Accesso negato."}, status=403)
 
     try:
-        paziente_id = request.user_id
-        paziente = Paziente.objects.get(codice_fiscale=paziente_id)
+        paginata, cursore, limite = leggi_parametri_paginazione(request)
+        anteprima = request.GET.get('vista') == 'anteprima'
+
+        paziente = request.paziente
 
-        # Recupera tutte le note ordinate dalla più recente
-        note_db = NotaDiario.objects.filter(paz=paziente).order_by('-data_nota')
+        # Recupera le note ordinate dalla più recente (una pagina se richiesto con limit/cursor)
+        note_db = proiezione_lista_note(NotaDiario.objects.filter(paz=paziente), anteprima)
+        next_cursor = None
+        if paginata:
+            note_db, next_cursor = pagina_note(note_db, cursore, limite)
+        else:
+            note_db = note_db.order_by('-data_nota')
 
         note_list = []
         for nota in note_db:
@@ -164,17 +345,23 @@ def get_note(request):
             
             note_list.append({
                 "id": nota.id,
-                "testo": nota.testo_paziente,
+                **testo_lista_note(nota, anteprima),
                 "data_iso": data_iso,
                 "emozione": nota.emozione_predominante,
                 "generazione_in_corso": nota.generazione_in_corso
             })
 
-        return JsonResponse({
+        risposta = {
             "status": "success", 
             "data": note_list
-        }, status=200)
+        }
+        if paginata:
+            risposta["next_cursor"] = next_cursor
 
+        return JsonResponse(risposta, status=200)
+
+    except CursoreNonValido as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=400)
     except Paziente.DoesNotExist:
         return JsonResponse({"status": "error", "message": "Paziente non trovato."}, status=404)
     except Exception as e:
@@ -189,7 +376,7 @@ def get_patient_info(request):
         return JsonResponse({"status": "error", "message": "Metodo non consentito"}, status=405)
     try:
         # Recupera il paziente usando l'ID dal token
-        paziente = Paziente.objects.get(codice_fiscale=request.user_id)
+        paziente = request.paziente
         
         # Gestione sicura della data di nascita per evitare crash 500
         data_formattata = ""
@@ -219,8 +406,8 @@ def get_doctor_info(request):
     if request.method != 'GET':
         return JsonResponse({"status": "error", "message": "Metodo non consentito"}, status=405)
     try:
-        paziente = Paziente.objects.get(codice_fiscale=request.user_id)
-        medico = paziente.med # 'med' è il nome della ForeignKey nel tuo modello
+        paziente = request.paziente
+        medico = paziente.med # 'med' è il nome della ForeignKey nel tuo modello (già caricata con il paziente)
         
         if not medico:
             return JsonResponse({"status": "error", "message": "Nessun medico associato al tuo profilo"}, status=404)
@@ -279,8 +466,8 @@ def get_note_details(request, pk):
         return JsonResponse({"status": "error", "message": "Metodo non consentito"}, status=405)
     
     try:
-        # Usa select_related per ottimizzare la query del medico
-        paziente = Paziente.objects.select_related('med').get(codice_fiscale=request.user_id)
+        # Il medico è già caricato insieme al paziente (select_related)
+        paziente = request.paziente
         nota = NotaDiario.objects.get(pk=pk, paz=paziente)
 
         return JsonResponse({
@@ -324,9 +511,12 @@ def delete_nota(request, pk):
         return JsonResponse({"status": "error", "message": "Accesso negato. Solo i pazienti possono eliminare le proprie note."}, status=403)
     
     try:
-        paziente = Paziente.objects.get(codice_fiscale=request.user_id)
-        nota = NotaDiario.objects.get(pk=pk, paz=paziente)
-        nota.delete()
+        paziente = request.paziente
+        with transaction.atomic():
+            stat = blocca_statistiche_umore(paziente.codice_fiscale)
+            nota = NotaDiario.objects.get(pk=pk, paz=paziente)
+            nota.delete()
+            applica_variazione_nota(stat, prima=(nota.emozione_predominante, nota.contesto_sociale), delta_note=-1)
         return JsonResponse({"status": "success", "message": "Nota eliminata con successo."})
         
     except NotaDiario.DoesNotExist:
@@ -1,118 +1,387 @@
+import json
 import logging
+import httpx
 import requests
 import re
-from django.db import connection
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from asgiref.sync import sync_to_async
+from django.db import connection, transaction
 from django.utils import timezone
-from ...models import Paziente, NotaDiario
+from ...models import Paziente, NotaDiario, RiassuntoCasoClinico
+from .ollama_client import get_ollama_client, get_async_ollama_client
+from .llm_cache import get_cache_llm, chiave_cache
+from .crisi import AUTOMA_CRISI, trova_contenuto_crisi
+from .statistiche import blocca_statistiche_umore, applica_variazione_nota
+from .riassunti import (
+    SintesiParziale,
+    calcola_finestra_periodo,
+    campi_impronta,
+    costruisci_contesto_note,
+    formatta_sintesi_parziali,
+    impronta_note,
+    note_da_aggiungere,
+    raggruppa_sintesi,
+    riassunto_aggiornato,
+    stima_token,
+    suddividi_note_in_blocchi,
+    unisci_sintesi
+)
 
 from .prompt import (
     get_prompt_analizza_sentiment,
     get_prompt_analizza_contesto_sociale,
+    get_prompt_analizza_emozione_e_contesto,
     get_prompt_genera_frasi_di_supporto,
     get_prompt_non_strutturato_breve,
     get_prompt_non_strutturato_lungo,
     get_prompt_strutturato_breve,
-    get_prompt_strutturato_lungo
+    get_prompt_strutturato_lungo,
+    get_summary_prompt,
+    get_summary_update_prompt,
+    get_summary_chunk_prompt,
+    get_summary_merge_prompt,
+    get_summary_reduce_prompt
 )
 
 from .constants import (
-    OLLAMA_BASE_URL, 
     OLLAMA_MODEL, 
+    OLLAMA_GENERAZIONI_CONCORRENTI,
+    OLLAMA_STREAM_BUFFER_INIZIALE,
+    ANALISI_COMBINATA,
     LUNGHEZZA_NOTA_BREVE,
     LUNGHEZZA_NOTA_LUNGA,
-    KEYWORDS_AUTOLESIONISMO,
-    KEYWORDS_SUICIDIO,
-    KEYWORDS_VIOLENZA_STALKING,
     MESSAGGI_CONFORTO,
     EMOZIONI_EMOJI,
-    CONTESTI_EMOJI
+    CONTESTI_EMOJI,
+    RIASSUNTO_BUDGET_TOKEN,
+    RIASSUNTO_BLOCCHI_CONCORRENTI,
+    RIASSUNTO_BLOCCO_MAX_CARATTERI,
+    LLM_CACHE_TEMPERATURA_MAX
 )
 
 logger = logging.getLogger(__name__)
 
+# Shared pool for the independent generations of a note: its size is the global
+# cap on concurrent generations, whatever the number of notes being analyzed
+_esecutore_generazioni = ThreadPoolExecutor(
+    max_workers=OLLAMA_GENERAZIONI_CONCORRENTI,
+    thread_name_prefix='generazione-ollama'
+)
+
+
+class GenerazioneNonRiuscita(Exception):
+    """
+    Raised when Ollama cannot produce a text (unreachable, timeout, HTTP error or
+    empty response). The message can be shown to the user as is; callers must not
+    store it in place of the generated text.
+    """
+    pass
+
+
 ##################################### --- AI --- ################################################
-def genera_con_ollama(prompt, max_chars=None, temperature=0.7):
+def _rimuovi_prefissi(text):
     """
-    Helper function to call the Ollama API and normalize the response by removing
-    any prefixes or introductory labels (e.g., "Answer:", "Your answer:").
+    Removes the introductory prefixes and labels the model tends to put at the
+    beginning of the response (e.g. "Answer:", "Ecco la nota clinica:").
+    Only the beginning of the text is touched, so it can also be applied to the
+    leading chunk of a streamed response.
+    """
+    # Removes common introductory prefixes (case-insensitive)
+    text = re.sub(
+        r'^\s*(?:La tua risposta[:\-\s]*|Risposta[:\-\s]*|Output[:\-\s]*|>\s*|Answer[:\-\s]*|Risposta del modello[:\-\s]*)+',
+        '', 
+        text, 
+        flags=re.I
+    )
+
+    # Removes introductory phrases typical of clinical notes
+    text = re.sub(
+        r'^\s*(?:Ecco la (?:nota clinica|valutazione|analisi)[:\-\s]*|Di seguito[:\-\s]*|La valutazione è[:\-\s]*|Ecco l\'analisi[:\-\s]*|Nota clinica[:\-\s]*)+',
+        '', 
+        text, 
+        flags=re.I
+    )
+
+    # Remove leading quotes, single quotes, bullets, or greater-than characters
+    return re.sub(r'^[\'"«\s\-\u2022>]+', '', text)
+
+
+def _testo_da_risposta(result):
+    """
+    Extracts the generated text from the decoded Ollama response and normalizes it.
+    """
+    # Extract text from response robustly
+    text = ''
+    if isinstance(result, dict):
+        for key in ('response', 'text', 'output', 'result'):
+            if key in result and result[key]:
+                text = result[key]
+                break
+    else:
+        text = result
+
+    # If the text is a list, join the elements
+    if isinstance(text, list):
+        text = " ".join(map(str, text))
+
+    return _rimuovi_prefissi(str(text or '').strip()).strip()
+
+
+def _cache_generazione(temperature, usa_cache):
+    """
+    LLM cache to use for a generation, or None. Only low-temperature calls
+    (up to LLM_CACHE_TEMPERATURA_MAX, e.g. emotion and context classification)
+    are cached: a free text at a higher temperature is expected to change on
+    every call, so serving it from the cache would make a regeneration
+    return the same text.
+    """
+    if not usa_cache or temperature > LLM_CACHE_TEMPERATURA_MAX:
+        return None
+    return get_cache_llm()
+
+
+class _RichiestaOllama:
+    """
+    Payload and LLM cache entry of a generation, shared by the sync, async and
+    streaming variants of genera_con_ollama so that they only differ in transport.
 
     Args:
     prompt: The prompt to send to the model
     max_chars: Maximum number of characters for the response (optional)
-    temperature: Temperature for generation (default 0.7)
+    temperature: Temperature for generation
+    usa_cache: If False, the cache is bypassed and the model is always called
+    stream: Ask Ollama for a streamed response
+    formato: JSON schema the response must follow (structured outputs, optional)
     """
-    try:
-        estimated_tokens = (max_chars * 2) if max_chars else 500
 
-        payload = {
+    def __init__(self, prompt, max_chars, temperature, usa_cache, stream=False, formato=None):
+        num_predict = (max_chars * 2) if max_chars else 500
+
+        self.payload = {
             "model": OLLAMA_MODEL,
             "prompt": prompt,
-            "stream": False,
+            "stream": stream,
             "options": {
                 "temperature": temperature,
-                "num_predict": estimated_tokens,
+                "num_predict": num_predict,
             }
         }
+        extra = {}
+        if formato is not None:
+            self.payload["format"] = formato
+            extra["format"] = formato
+
+        self.cache = _cache_generazione(temperature, usa_cache)
+        self.chiave = chiave_cache(OLLAMA_MODEL, prompt, temperature, num_predict, **extra) if self.cache is not None else None
+
+    def da_cache(self):
+        """Cached response of this request, or None."""
+        return self.cache.get(self.chiave) if self.cache is not None else None
+
+    def in_cache(self, testo):
+        """Stores the response of this request (no-op if it is not cached)."""
+        if self.cache is not None:
+            self.cache.set(self.chiave, testo)
+
+
+# Transport errors of the sync (requests) and async (httpx) clients; ValueError
+# covers a response body that is not valid JSON
+_ERRORI_OLLAMA = (requests.exceptions.RequestException, httpx.HTTPError, ValueError)
+
+
+def _errore_generazione(e):
+    """
+    Logs a failed call to Ollama and returns the GenerazioneNonRiuscita to raise
+    in its place, with a message that can be shown to the user.
+    """
+    if isinstance(e, (requests.exceptions.ConnectionError, httpx.ConnectError)):
+        logger.error("Impossibile connettersi a Ollama. Assicurati che il servizio sia in esecuzione.")
+        return GenerazioneNonRiuscita("Servizio di generazione testo non disponibile. Verifica che Ollama sia attivo.")
+    if isinstance(e, (requests.exceptions.Timeout, httpx.TimeoutException)):
+        logger.error("Timeout nella chiamata a Ollama")
+        return GenerazioneNonRiuscita("Il tempo di attesa per la generazione è scaduto. Riprova.")
+    if isinstance(e, (requests.exceptions.RequestException, httpx.HTTPError)):
+        logger.error(f"Errore nella chiamata a Ollama: {e}")
+        return GenerazioneNonRiuscita("Errore durante la generazione del testo. Riprova più tardi.")
+    logger.error(f"Risposta di Ollama non valida: {e}")
+    return GenerazioneNonRiuscita("Errore imprevisto durante la generazione. Riprova.")
+
+
+def _controlla_risposta(response):
+    """Raises GenerazioneNonRiuscita if Ollama answered with an HTTP error."""
+    if response.status_code != 200:
+        logger.error(f"Ollama ha restituito status code {response.status_code}")
+        logger.error(f"Risposta: {response.text}")
+        raise GenerazioneNonRiuscita("Il servizio di generazione testo non è al momento disponibile. Riprova più tardi.")
 
-        response = requests.post(OLLAMA_BASE_URL, json=payload, timeout=500)
 
-        if response.status_code != 200:
-            logger.error(f"Ollama ha restituito status code {response.status_code}")
-            logger.error(f"Risposta: {response.text}")
-            return "Il servizio di generazione testo non è al momento disponibile. Riprova più tardi."
+def _testo_generato(response):
+    """
+    Normalized text of a non-streamed Ollama response (requests or httpx).
+    Raises GenerazioneNonRiuscita on an HTTP error or an empty text.
+    """
+    _controlla_risposta(response)
+    text = _testo_da_risposta(response.json())
+    if not text:
+        raise GenerazioneNonRiuscita("Generazione non disponibile al momento.")
+    return text
+
+
+def genera_con_ollama(prompt, max_chars=None, temperature=0.7, usa_cache=True):
+    """
+    Helper function to call the Ollama API and normalize the response by removing
+    any prefixes or introductory labels (e.g., "Answer:", "Your answer:").
+    Identical low-temperature requests are served from the LLM cache.
+
+    Args:
+    prompt: The prompt to send to the model
+    max_chars: Maximum number of characters for the response (optional)
+    temperature: Temperature for generation (default 0.7)
+    usa_cache: If False, the cache is bypassed and the model is always called
+    (calls above LLM_CACHE_TEMPERATURA_MAX never use the cache)
+
+    Raises GenerazioneNonRiuscita if Ollama does not return a text.
+    """
+    richiesta = _RichiestaOllama(prompt, max_chars, temperature, usa_cache)
+    risposta_in_cache = richiesta.da_cache()
+    if risposta_in_cache is not None:
+        return risposta_in_cache
+
+    try:
+        text = _testo_generato(get_ollama_client().post(richiesta.payload))
+    except _ERRORI_OLLAMA as e:
+        raise _errore_generazione(e) from e
+
+    richiesta.in_cache(text)
+    return text
+
+
+async def genera_con_ollama_async(prompt, max_chars=None, temperature=0.7, usa_cache=True):
+    """
+    Async version of genera_con_ollama for the ASGI views: same payload, cache and
+    normalization, but under an ASGI server the wait for Ollama does not block a
+    thread (see get_async_ollama_client).
+    """
+    richiesta = _RichiestaOllama(prompt, max_chars, temperature, usa_cache)
+    risposta_in_cache = richiesta.da_cache()
+    if risposta_in_cache is not None:
+        return risposta_in_cache
+
+    try:
+        text = _testo_generato(await get_async_ollama_client().post(richiesta.payload))
+    except _ERRORI_OLLAMA as e:
+        raise _errore_generazione(e) from e
+
+    richiesta.in_cache(text)
+    return text
 
-        response.raise_for_status()
-        result = response.json()
 
-        # Extract text from response robustly
-        text = ''
-        if isinstance(result, dict):
-            for key in ('response', 'text', 'output', 'result'):
-                if key in result and result[key]:
-                    text = result[key]
+def genera_con_ollama_stream(prompt, max_chars=None, temperature=0.7, usa_cache=True):
+    """
+    Streaming version of genera_con_ollama: yields the text as the model produces it.
+
+    The first OLLAMA_STREAM_BUFFER_INIZIALE characters are buffered so that the same
+    prefix normalization of genera_con_ollama can be applied to the leading chunk;
+    the rest is forwarded as it arrives. As in genera_con_ollama, low-temperature
+    texts are stored in the LLM cache and a cached response is yielded in one piece.
+
+    Args:
+    prompt: The prompt to send to the model
+    max_chars: Maximum number of characters for the response (optional)
+    temperature: Temperature for generation (default 0.7)
+    usa_cache: If False, the cache is bypassed and the model is always called
+
+    Raises GenerazioneNonRiuscita if Ollama fails, also after some text was
+    yielded: the caller must then discard the partial text.
+    """
+    richiesta = _RichiestaOllama(prompt, max_chars, temperature, usa_cache, stream=True)
+    risposta_in_cache = richiesta.da_cache()
+    if risposta_in_cache is not None:
+        yield risposta_in_cache
+        return
+
+    try:
+        response = get_ollama_client().post(richiesta.payload, stream=True)
+        _controlla_risposta(response)
+
+        buffer_iniziale = ''
+        inviati = []
+        with response:
+            for linea in response.iter_lines(decode_unicode=True):
+                if not linea:
+                    continue
+                frammento = json.loads(linea)
+                testo = frammento.get('response') or ''
+
+                if inviati:
+                    if testo:
+                        inviati.append(testo)
+                        yield testo
+                else:
+                    buffer_iniziale += testo
+                    if len(buffer_iniziale.lstrip()) >= OLLAMA_STREAM_BUFFER_INIZIALE or frammento.get('done'):
+                        testo = _rimuovi_prefissi(buffer_iniziale.lstrip())
+                        if testo:
+                            inviati.append(testo)
+                            yield testo
+
+                if frammento.get('done'):
                     break
-        else:
-            text = result
 
-        # If the text is a list, join the elements
-        if isinstance(text, list):
-            text = " ".join(map(str, text))
+        if not inviati and buffer_iniziale:
+            # The response ended before the buffer was full
+            testo = _rimuovi_prefissi(buffer_iniziale.strip())
+            if testo:
+                inviati.append(testo)
+                yield testo
 
-        text = str(text or '').strip()
+    except _ERRORI_OLLAMA as e:
+        raise _errore_generazione(e) from e
 
-        # Removes common introductory prefixes (case-insensitive)
-        text = re.sub(
-            r'^\s*(?:La tua risposta[:\-\s]*|Risposta[:\-\s]*|Output[:\-\s]*|>\s*|Answer[:\-\s]*|Risposta del modello[:\-\s]*)+',
-            '', 
-            text, 
-            flags=re.I
-        )
+    completo = ''.join(inviati).strip()
+    if not completo:
+        raise GenerazioneNonRiuscita("Generazione non disponibile al momento.")
+    richiesta.in_cache(completo)
 
-        # Removes introductory phrases typical of clinical notes
-        text = re.sub(
-            r'^\s*(?:Ecco la (?:nota clinica|valutazione|analisi)[:\-\s]*|Di seguito[:\-\s]*|La valutazione è[:\-\s]*|Ecco l\'analisi[:\-\s]*|Nota clinica[:\-\s]*)+',
-            '', 
-            text, 
-            flags=re.I
-        )
 
-        # Remove leading quotes, single quotes, bullets, or greater-than characters
-        text = re.sub(r'^[\'"«\s\-\u2022>]+', '', text).strip()
+def genera_json_con_ollama(prompt, schema, max_chars=None, temperature=0.2, usa_cache=True):
+    """
+    Calls Ollama with structured outputs: the response is constrained to the
+    given JSON schema and returned already decoded.
+
+    Args:
+    prompt: The prompt to send to the model
+    schema: JSON schema the response must follow
+    max_chars: Maximum number of characters for the response (optional)
+    temperature: Temperature for generation (default 0.2)
+    usa_cache: If False, the cache is bypassed and the model is always called
 
-        return text if text else "Generazione non disponibile al momento."
+    Returns:
+    dict: the decoded object, or None if the response does not follow the schema
+    Raises GenerazioneNonRiuscita if Ollama is unreachable or returns an error.
+    """
+    richiesta = _RichiestaOllama(prompt, max_chars, temperature, usa_cache, formato=schema)
+    risposta_in_cache = richiesta.da_cache()
+    if risposta_in_cache is not None:
+        return json.loads(risposta_in_cache)
 
-    except requests.exceptions.ConnectionError:
-        logger.error("Impossibile connettersi a Ollama. Assicurati che il servizio sia in esecuzione.")
-        return "Servizio di generazione testo non disponibile. Verifica che Ollama sia attivo."
-    except requests.exceptions.Timeout:
-        logger.error("Timeout nella chiamata a Ollama")
-        return "Il tempo di attesa per la generazione è scaduto. Riprova."
+    try:
+        response = get_ollama_client().post(richiesta.payload)
     except requests.exceptions.RequestException as e:
-        logger.error(f"Errore nella chiamata a Ollama: {e}")
-        return "Errore durante la generazione del testo. Riprova più tardi."
-    except Exception as e:
-        logger.error(f"Errore imprevisto: {e}")
-        return "Errore imprevisto durante la generazione. Riprova."
+        raise _errore_generazione(e) from e
+    _controlla_risposta(response)
+
+    try:
+        testo = response.json().get('response') or ''
+        risultato = json.loads(testo)
+    except (ValueError, AttributeError) as e:
+        logger.error(f"Risposta JSON di Ollama non valida: {e}")
+        return None
+    if not isinstance(risultato, dict):
+        return None
+
+    richiesta.in_cache(testo)
+    return risultato
 
 
 def genera_frasi_di_supporto(testo, paziente=None):
@@ -130,46 +399,32 @@ def genera_frasi_di_supporto(testo, paziente=None):
     return genera_con_ollama(prompt, max_chars=500, temperature=0.3)
 
 
-def analizza_sentiment(testo, paziente=None):
+async def genera_frasi_di_supporto_async(testo, paziente=None):
     """
-    Analyzes the sentiment of the patient's text and returns the predominant emotion
-    with its explanation.
-
-    Args:
-    text: The text of the patient's note
-    patient: The Patient object (optional, to avoid confusion with other names in the text)
-
-    Returns:
-    tuple: (emotion, explanation)
+    Async version of genera_frasi_di_supporto.
     """
+    prompt = get_prompt_genera_frasi_di_supporto(paziente, testo)
 
-    emozioni_lista = ', '.join(EMOZIONI_EMOJI.keys())
+    return await genera_con_ollama_async(prompt, max_chars=500, temperature=0.3)
 
-    prompt = get_prompt_analizza_sentiment(paziente, emozioni_lista, testo)
 
-    risposta = genera_con_ollama(prompt, max_chars=300, temperature=0.2)
+def genera_frasi_di_supporto_stream(testo, paziente=None):
+    """
+    Streaming version of genera_frasi_di_supporto: yields the text as it is generated.
+    """
+    prompt = get_prompt_genera_frasi_di_supporto(paziente, testo)
 
-    # # Response parsing - improves multi-line explanation capture
-    linee = risposta.strip().split('\n')
-    emozione = None
-    spiegazione = None
-    in_spiegazione = False
-    spiegazione_parts = []
+    yield from genera_con_ollama_stream(prompt, max_chars=500, temperature=0.3)
 
-    for linea in linee:
-        linea_stripped = linea.strip()
-        if linea_stripped.lower().startswith('emozione:'):
-            emozione = linea_stripped.split(':', 1)[1].strip().lower().rstrip('.!?,;:')
-            in_spiegazione = False
-        elif linea_stripped.lower().startswith('spiegazione:'):
-            spiegazione_parts.append(linea_stripped.split(':', 1)[1].strip())
-            in_spiegazione = True
-        elif in_spiegazione and linea_stripped:
-            spiegazione_parts.append(linea_stripped)
 
-    if spiegazione_parts:
-        spiegazione = ' '.join(spiegazione_parts)
+def _valida_emozione(emozione):
+    """
+    Maps the emotion returned by the model onto a key of EMOZIONI_EMOJI
+    (exact match, partial match or synonym).
 
+    Returns:
+    str: the valid emotion, or None if it cannot be mapped
+    """
     if emozione and emozione in EMOZIONI_EMOJI:
         emozione_validata = emozione
     else:
@@ -212,32 +467,12 @@ def analizza_sentiment(testo, paziente=None):
             if emozione and emozione in sinonimi:
                 emozione_validata = sinonimi[emozione]
 
-        # If we really don't find anything, log the error and keep the model output
-        if not emozione_validata:
-            print(f"⚠️ ATTENZIONE: Emozione non valida ricevuta dal modello: '{emozione}'") 
-            emozione_validata = emozione if emozione else None
-
-    # Improve explanation fallback
-    if not spiegazione or (spiegazione and len(spiegazione) < 10):
-        if 'perché' in risposta.lower() or 'indica' in risposta.lower() or 'esprime' in risposta.lower():
-            spiegazione = risposta.replace('\n', ' ').strip()
-            if 'emozione:' in spiegazione.lower():
-                parti = spiegazione.lower().split('spiegazione:')
-                if len(parti) > 1:
-                    spiegazione = parti[1].strip()
-        else:
-            if emozione_validata:
-                spiegazione = f"Il testo esprime un vissuto emotivo riconducibile a {emozione_validata}."
-            else:
-                spiegazione = "Analisi emotiva del testo in corso."
-
-    print(f"Emozione rilevata: {emozione_validata}, Spiegazione: {spiegazione}")
-    return emozione_validata, spiegazione
+    return emozione_validata
 
 
-def analizza_contesto_sociale(testo, paziente=None):
+def analizza_sentiment(testo, paziente=None):
     """
-    Analyzes the social context of the patient's text and returns the main context
+    Analyzes the sentiment of the patient's text and returns the predominant emotion
     with its explanation.
 
     Args:
@@ -245,32 +480,65 @@ def analizza_contesto_sociale(testo, paziente=None):
     patient: The Patient object (optional, to avoid confusion with other names in the text)
 
     Returns:
-    tuple: (context, explanation)
+    tuple: (emotion, explanation)
     """
 
-    print("Analisi contesto sociale con Ollama")
-
-    contesti_lista = ', '.join(CONTESTI_EMOJI.keys())
-
-    prompt = get_prompt_analizza_contesto_sociale(paziente, testo, contesti_lista)
+    emozioni_lista = ', '.join(EMOZIONI_EMOJI.keys())
 
-    risposta = genera_con_ollama(prompt, max_chars=400, temperature=0.2)
+    prompt = get_prompt_analizza_sentiment(paziente, emozioni_lista, testo)
 
-    print(f"Risposta contesto sociale raw: {risposta}")
+    risposta = genera_con_ollama(prompt, max_chars=300, temperature=0.2)
 
+    # # Response parsing - improves multi-line explanation capture
     linee = risposta.strip().split('\n')
-    contesto = None
+    emozione = None
     spiegazione = None
+    in_spiegazione = False
+    spiegazione_parts = []
 
     for linea in linee:
         linea_stripped = linea.strip()
-        if linea_stripped.lower().startswith('contesto:'):
-            contesto = linea_stripped.split(':', 1)[1].strip().lower().rstrip('.!?,;:')
+        if linea_stripped.lower().startswith('emozione:'):
+            emozione = linea_stripped.split(':', 1)[1].strip().lower().rstrip('.!?,;:')
+            in_spiegazione = False
         elif linea_stripped.lower().startswith('spiegazione:'):
-            spiegazione = linea_stripped.split(':', 1)[1].strip()
+            spiegazione_parts.append(linea_stripped.split(':', 1)[1].strip())
+            in_spiegazione = True
+        elif in_spiegazione and linea_stripped:
+            spiegazione_parts.append(linea_stripped)
 
-    print(f"Contesto parsed: {contesto}, Spiegazione parsed: {spiegazione}")
+    if spiegazione_parts:
+        spiegazione = ' '.join(spiegazione_parts)
+
+    emozione_validata = _valida_emozione(emozione)
+    if not emozione_validata:
+        # If we really don't find anything, log the error and keep the model output
+        print(f"⚠️ ATTENZIONE: Emozione non valida ricevuta dal modello: '{emozione}'") 
+        emozione_validata = emozione if emozione else None
+
+    # Improve explanation fallback
+    if not spiegazione or (spiegazione and len(spiegazione) < 10):
+        if 'perché' in risposta.lower() or 'indica' in risposta.lower() or 'esprime' in risposta.lower():
+            spiegazione = risposta.replace('\n', ' ').strip()
+            if 'emozione:' in spiegazione.lower():
+                parti = spiegazione.lower().split('spiegazione:')
+                if len(parti) > 1:
+                    spiegazione = parti[1].strip()
+        else:
+            if emozione_validata:
+                spiegazione = f"Il testo esprime un vissuto emotivo riconducibile a {emozione_validata}."
+            else:
+                spiegazione = "Analisi emotiva del testo in corso."
 
+    print(f"Emozione rilevata: {emozione_validata}, Spiegazione: {spiegazione}")
+    return emozione_validata, spiegazione
+
+
+def _valida_contesto(contesto):
+    """
+    Maps the context returned by the model onto a key of CONTESTI_EMOJI
+    (exact match, partial match or synonym), falling back to 'altro'.
+    """
     if contesto and contesto in CONTESTI_EMOJI:
         contesto_validato = contesto
     else:
@@ -366,6 +634,47 @@ def analizza_contesto_sociale(testo, paziente=None):
         if contesto and contesto in sinonimi:
             contesto_validato = sinonimi[contesto]
 
+    return contesto_validato
+
+
+def analizza_contesto_sociale(testo, paziente=None):
+    """
+    Analyzes the social context of the patient's text and returns the main context
+    with its explanation.
+
+    Args:
+    text: The text of the patient's note
+    patient: The Patient object (optional, to avoid confusion with other names in the text)
+
+    Returns:
+    tuple: (context, explanation)
+    """
+
+    print("Analisi contesto sociale con Ollama")
+
+    contesti_lista = ', '.join(CONTESTI_EMOJI.keys())
+
+    prompt = get_prompt_analizza_contesto_sociale(paziente, testo, contesti_lista)
+
+    risposta = genera_con_ollama(prompt, max_chars=400, temperature=0.2)
+
+    print(f"Risposta contesto sociale raw: {risposta}")
+
+    linee = risposta.strip().split('\n')
+    contesto = None
+    spiegazione = None
+
+    for linea in linee:
+        linea_stripped = linea.strip()
+        if linea_stripped.lower().startswith('contesto:'):
+            contesto = linea_stripped.split(':', 1)[1].strip().lower().rstrip('.!?,;:')
+        elif linea_stripped.lower().startswith('spiegazione:'):
+            spiegazione = linea_stripped.split(':', 1)[1].strip()
+
+    print(f"Contesto parsed: {contesto}, Spiegazione parsed: {spiegazione}")
+
+    contesto_validato = _valida_contesto(contesto)
+
     if not spiegazione:
         spiegazione = "Contesto rilevato in base al contenuto generale del testo."
 
@@ -373,6 +682,73 @@ def analizza_contesto_sociale(testo, paziente=None):
     return contesto_validato, spiegazione
 
 
+def analizza_emozione_e_contesto_json(testo, paziente=None, usa_cache=True):
+    """
+    Detects emotion and social context with a single structured-output call.
+    The values are constrained by the schema to EMOZIONI_EMOJI / CONTESTI_EMOJI
+    and validated again on return.
+
+    Args:
+    text: The text of the patient's note
+    patient: The Patient object (optional, to avoid confusion with other names in the text)
+
+    Returns:
+    tuple: ((emotion, explanation), (context, explanation)), or None if the
+    response is missing or not valid
+    """
+    schema = {
+        "type": "object",
+        "properties": {
+            "emozione": {"type": "string", "enum": list(EMOZIONI_EMOJI.keys())},
+            "spiegazione_emozione": {"type": "string"},
+            "contesto": {"type": "string", "enum": list(CONTESTI_EMOJI.keys())},
+            "spiegazione_contesto": {"type": "string"},
+        },
+        "required": ["emozione", "spiegazione_emozione", "contesto", "spiegazione_contesto"],
+    }
+
+    emozioni_lista = ', '.join(EMOZIONI_EMOJI.keys())
+    contesti_lista = ', '.join(CONTESTI_EMOJI.keys())
+    prompt = get_prompt_analizza_emozione_e_contesto(paziente, emozioni_lista, contesti_lista, testo)
+
+    risultato = genera_json_con_ollama(prompt, schema, max_chars=600, temperature=0.2, usa_cache=usa_cache)
+    if not risultato:
+        return None
+
+    emozione = _valida_emozione(str(risultato.get('emozione') or '').strip().lower())
+    contesto = str(risultato.get('contesto') or '').strip().lower()
+    contesto = contesto if contesto in CONTESTI_EMOJI else None
+    spiegazione_emozione = str(risultato.get('spiegazione_emozione') or '').strip()
+    spiegazione_contesto = str(risultato.get('spiegazione_contesto') or '').strip()
+
+    if not emozione or not contesto:
+        logger.warning(f"Analisi combinata non valida: {risultato}")
+        return None
+
+    if len(spiegazione_emozione) < 10:
+        spiegazione_emozione = f"Il testo esprime un vissuto emotivo riconducibile a {emozione}."
+    if not spiegazione_contesto:
+        spiegazione_contesto = "Contesto rilevato in base al contenuto generale del testo."
+
+    return (emozione, spiegazione_emozione), (contesto, spiegazione_contesto)
+
+
+def analizza_emozione_e_contesto(testo, paziente=None):
+    """
+    Single-call analysis of emotion and social context; if the structured
+    response is not valid, falls back to analizza_sentiment + analizza_contesto_sociale.
+
+    Returns:
+    tuple: ((emotion, explanation), (context, explanation))
+    """
+    risultato = analizza_emozione_e_contesto_json(testo, paziente)
+    if risultato:
+        return risultato
+
+    logger.warning("Analisi combinata non riuscita, uso delle due chiamate separate")
+    return analizza_sentiment(testo, paziente), analizza_contesto_sociale(testo, paziente)
+
+
 def _recupera_contesto_note_precedenti(paziente, limite=5, escludi_nota_id=None):
     """
     Retrieves the patient's latest notes to provide context, excluding the current note.
@@ -436,9 +812,9 @@ def _genera_prompt_strutturato_lungo(testo, parametri_strutturati, tipo_parametr
     return get_prompt_strutturato_lungo(paziente, contesto_precedente, testo, max_chars, parametri_strutturati, tipo_parametri)
 
 
-def genera_frasi_cliniche(testo, medico, paziente, nota_id=None):
+def costruisci_prompt_clinico(testo, medico, paziente, nota_id=None):
     """
-    Generates personalized clinical notes based on the physician's preferences.
+    Builds the clinical prompt according to the physician's preferences.
     Includes the context of the patient's last 5 notes (excluding the current one) for a more comprehensive evaluation.
 
     Args:
@@ -452,55 +828,205 @@ def genera_frasi_cliniche(testo, medico, paziente, nota_id=None):
     - Structured + Long
     - Unstructured + Short
     - Unstructured + Long
+
+    Returns:
+    tuple: (prompt, max_chars)
+    """
+    tipo_nota = medico.tipo_nota  # True per "strutturato", False per "non strutturato"
+    lunghezza_nota = medico.lunghezza_nota  # True per "lungo", False per "breve"
+    tipo_parametri = medico.tipo_parametri.split(".:;!") if medico.tipo_parametri else []
+    testo_parametri = medico.testo_parametri.split(".:;!") if medico.testo_parametri else []
+    print("GENERA FRASI CLINICHE")
+    print(f"\nTipo Nota: {tipo_nota}")
+    print(f"\nLunghezza nota: {lunghezza_nota}")
+    print(f"\nTipo parametri: {tipo_parametri}")
+    print(f"\nTesto parametri: {testo_parametri}")
+
+    # Determina la lunghezza massima in caratteri
+    max_chars = LUNGHEZZA_NOTA_LUNGA if lunghezza_nota else LUNGHEZZA_NOTA_BREVE
+    print(f"\nMax chars: {max_chars}")
+
+    # Recupera il contesto delle note precedenti (esclusa quella corrente)
+    contesto_precedente = _recupera_contesto_note_precedenti(paziente, limite=5, escludi_nota_id=nota_id)
+    print(f"\nContesto prec: {contesto_precedente}")
+
+    if tipo_nota:
+        # Nota strutturata
+        parametri_strutturati = "\n".join(
+            [f"{tipo}: {txt}" for tipo, txt in zip(tipo_parametri, testo_parametri)]
+        )
+        if lunghezza_nota:
+            # Strutturata + Lunga
+            prompt = _genera_prompt_strutturato_lungo(testo, parametri_strutturati, tipo_parametri, max_chars, contesto_precedente, paziente)
+        else:
+            # Strutturata + Breve
+            prompt = _genera_prompt_strutturato_breve(testo, parametri_strutturati, tipo_parametri, max_chars, contesto_precedente, paziente)
+    else:
+        # Nota non strutturata
+        if lunghezza_nota:
+            # Non Strutturata + Lunga
+            prompt = _genera_prompt_non_strutturato_lungo(testo, max_chars, contesto_precedente, paziente)
+        else:
+            # Non Strutturata + Breve
+            prompt = _genera_prompt_non_strutturato_breve(testo, max_chars, contesto_precedente, paziente)
+
+    print(f"\nPrompt:\n{prompt }")
+    return prompt, max_chars
+
+
+def genera_frasi_cliniche(testo, medico, paziente, nota_id=None, usa_cache=True):
+    """
+    Generates personalized clinical notes based on the physician's preferences
+    (see costruisci_prompt_clinico).
+
+    Args:
+    text: Patient note text
+    doctor: Physician Subject
+    patient: Patient Subject
+    note_id: ID of the current note to exclude from the context (optional)
+    usa_cache: If False, a new text is always generated (optional)
+
+    Raises GenerazioneNonRiuscita if the text cannot be generated.
     """
 
     print("Generazione commenti clinici con Ollama")
 
+    prompt, max_chars = costruisci_prompt_clinico(testo, medico, paziente, nota_id=nota_id)
+    return genera_con_ollama(prompt, max_chars=max_chars, temperature=0.6, usa_cache=usa_cache)
+
+
+async def genera_frasi_cliniche_async(testo, medico, paziente, nota_id=None, usa_cache=True):
+    """
+    Async version of genera_frasi_cliniche: the prompt (which reads the previous
+    notes from the DB) is built in a worker thread, the generation is awaited.
+    """
+    prompt, max_chars = await sync_to_async(costruisci_prompt_clinico)(testo, medico, paziente, nota_id=nota_id)
+    return await genera_con_ollama_async(prompt, max_chars=max_chars, temperature=0.6, usa_cache=usa_cache)
+
+
+def genera_frasi_cliniche_stream(testo, medico, paziente, nota_id=None, usa_cache=True):
+    """
+    Streaming version of genera_frasi_cliniche: yields the clinical text as it is generated.
+    """
+    prompt, max_chars = costruisci_prompt_clinico(testo, medico, paziente, nota_id=nota_id)
+    yield from genera_con_ollama_stream(prompt, max_chars=max_chars, temperature=0.6, usa_cache=usa_cache)
+
+
+def _esegui_generazione(funzione, *args, **kwargs):
+    """Runs a generation in the shared pool, releasing the thread's DB connection afterwards."""
     try:
-        tipo_nota = medico.tipo_nota  # True per "strutturato", False per "non strutturato"
-        lunghezza_nota = medico.lunghezza_nota  # True per "lungo", False per "breve"
-        tipo_parametri = medico.tipo_parametri.split(".:;!") if medico.tipo_parametri else []
-        testo_parametri = medico.testo_parametri.split(".:;!") if medico.testo_parametri else []
-        print("GENERA FRASI CLINICHE")
-        print(f"\nTipo Nota: {tipo_nota}")
-        print(f"\nLunghezza nota: {lunghezza_nota}")
-        print(f"\nTipo parametri: {tipo_parametri}")
-        print(f"\nTesto parametri: {testo_parametri}")
-
-        # Determina la lunghezza massima in caratteri
-        max_chars = LUNGHEZZA_NOTA_LUNGA if lunghezza_nota else LUNGHEZZA_NOTA_BREVE
-        print(f"\nMax chars: {max_chars}")
-
-        # Recupera il contesto delle note precedenti (esclusa quella corrente)
-        contesto_precedente = _recupera_contesto_note_precedenti(paziente, limite=5, escludi_nota_id=nota_id)
-        print(f"\nContesto prec: {contesto_precedente}")
-
-        if tipo_nota:
-            # Nota strutturata
-            parametri_strutturati = "\n".join(
-                [f"{tipo}: {txt}" for tipo, txt in zip(tipo_parametri, testo_parametri)]
-            )
-            if lunghezza_nota:
-                # Strutturata + Lunga
-                prompt = _genera_prompt_strutturato_lungo(testo, parametri_strutturati, tipo_parametri, max_chars, contesto_precedente, paziente)
-            else:
-                # Strutturata + Breve
-                prompt = _genera_prompt_strutturato_breve(testo, parametri_strutturati, tipo_parametri, max_chars, contesto_precedente, paziente)
-        else:
-            # Nota non strutturata
-            if lunghezza_nota:
-                # Non Strutturata + Lunga
-                prompt = _genera_prompt_non_strutturato_lungo(testo, max_chars, contesto_precedente, paziente)
-            else:
-                # Non Strutturata + Breve
-                prompt = _genera_prompt_non_strutturato_breve(testo, max_chars, contesto_precedente, paziente)
+        return funzione(*args, **kwargs)
+    finally:
+        connection.close()
 
-        print(f"\nPrompt:\n{prompt }")
-        return genera_con_ollama(prompt, max_chars=max_chars, temperature=0.6)
 
-    except Exception as e:
-        logger.error(f"Errore nella generazione clinica: {e}")
-        return f"Errore durante la generazione: {e}"
+# Parts of the analysis of a note, each produced by its own generation
+PARTI_ANALISI = ('clinico', 'sentiment', 'contesto')
+
+
+def parti_analisi_mancanti(nota):
+    """
+    Parts of the analysis not yet stored on the note: a retry generates only these.
+    """
+    parti = []
+    if not nota.testo_clinico:
+        parti.append('clinico')
+    if nota.spiegazione_emozione is None:
+        parti.append('sentiment')
+    if nota.contesto_sociale is None:
+        parti.append('contesto')
+    return tuple(parti)
+
+
+def esegui_analisi_nota(nota_id, testo_paziente, medico, paziente, parti=PARTI_ANALISI):
+    """
+    Generates clinical analysis, sentiment and social context for a note and
+    stores them, clearing the generazione_in_corso flag.
+
+    The generations are independent and run concurrently, so the latency
+    is roughly that of the slowest one. The note is written once, after all of
+    them return: the parts that succeeded are stored, the failed ones are left
+    empty and GenerazioneNonRiuscita is raised, so that the job queue schedules
+    a retry that generates only the missing parts (see parti_analisi_mancanti).
+    The note stays generazione_in_corso until every part is stored.
+
+    Args:
+    parti: Parts to generate, a subset of PARTI_ANALISI (default all)
+    """
+    # Generate analyses (pass note_id to exclude the current note from the context)
+    futures = {}
+    if 'clinico' in parti:
+        futures['clinico'] = _esecutore_generazioni.submit(
+            _esegui_generazione, genera_frasi_cliniche, testo_paziente, medico, paziente, nota_id=nota_id
+        )
+    if ANALISI_COMBINATA and 'sentiment' in parti and 'contesto' in parti:
+        futures['combinata'] = _esecutore_generazioni.submit(
+            _esegui_generazione, analizza_emozione_e_contesto, testo_paziente, paziente
+        )
+    else:
+        if 'sentiment' in parti:
+            futures['sentiment'] = _esecutore_generazioni.submit(
+                _esegui_generazione, analizza_sentiment, testo_paziente, paziente
+            )
+        if 'contesto' in parti:
+            futures['contesto'] = _esecutore_generazioni.submit(
+                _esegui_generazione, analizza_contesto_sociale, testo_paziente, paziente
+            )
+
+    risultati = {}
+    errori = {}
+    for nome, future in futures.items():
+        try:
+            risultati[nome] = future.result()
+        except Exception as e:
+            logger.error(f"Generazione '{nome}' fallita per nota {nota_id}: {e}")
+            errori[nome] = e
+
+    if 'combinata' in risultati:
+        risultati['sentiment'], risultati['contesto'] = risultati.pop('combinata')
+
+    campi = {}
+    if 'clinico' in risultati:
+        campi['testo_clinico'] = risultati['clinico']
+    if 'sentiment' in risultati:
+        campi['emozione_predominante'], campi['spiegazione_emozione'] = risultati['sentiment']
+    if 'contesto' in risultati:
+        campi['contesto_sociale'], campi['spiegazione_contesto'] = risultati['contesto']
+    if campi:
+        campi['data_modifica'] = timezone.now()
+    if not errori:
+        campi['generazione_in_corso'] = False
+
+    # Update the note in the database, together with the patient's mood statistics
+    if campi:
+        with transaction.atomic():
+            stat = blocca_statistiche_umore(paziente.codice_fiscale)
+            prima = NotaDiario.objects.filter(id=nota_id).values_list('emozione_predominante', 'contesto_sociale').first()
+            if prima is None:
+                logger.warning(f"Nota {nota_id} eliminata durante l'analisi")
+                return
+
+            NotaDiario.objects.filter(id=nota_id).update(**campi)
+            dopo = (campi.get('emozione_predominante', prima[0]), campi.get('contesto_sociale', prima[1]))
+            applica_variazione_nota(stat, prima=prima, dopo=dopo)
+
+    if errori:
+        primo_errore = next(iter(errori.values()))
+        raise GenerazioneNonRiuscita(
+            f"Analisi incompleta per nota {nota_id} (fallite: {', '.join(errori)}): {primo_errore}"
+        ) from primo_errore
+
+    logger.info(f"Generazione in background completata per nota {nota_id}")
+
+
+def segna_analisi_fallita(nota_id):
+    """
+    Clears the generazione_in_corso flag of a note whose analysis could not be
+    completed. The parts that were generated are kept; the missing ones stay
+    empty (no error text is stored, as it would end up in the summaries) and can
+    be generated again with the regenerate endpoints.
+    """
+    NotaDiario.objects.filter(id=nota_id).update(generazione_in_corso=False)
 
 
 def genera_analisi_in_background(nota_id, testo_paziente, medico, paziente):
@@ -509,36 +1035,224 @@ def genera_analisi_in_background(nota_id, testo_paziente, medico, paziente):
     clinical analysis, sentiment, and social context in the background.
     """
     try:
-        # Generate analyses (pass note_id to exclude the current note from the context)
-        testo_clinico = genera_frasi_cliniche(testo_paziente, medico, paziente, nota_id=nota_id)
-        emozione_predominante, spiegazione_emozione = analizza_sentiment(testo_paziente, paziente)
-        contesto_sociale, spiegazione_contesto = analizza_contesto_sociale(testo_paziente, paziente)
-
-        # Update the note in the database
-        nota = NotaDiario.objects.get(id=nota_id)
-        nota.testo_clinico = testo_clinico
-        nota.emozione_predominante = emozione_predominante
-        nota.spiegazione_emozione = spiegazione_emozione
-        nota.contesto_sociale = contesto_sociale
-        nota.spiegazione_contesto = spiegazione_contesto
-        nota.generazione_in_corso = False
-        nota.save()
-
-        logger.info(f"Generazione in background completata per nota {nota_id}")
+        esegui_analisi_nota(nota_id, testo_paziente, medico, paziente)
     except Exception as e:
         logger.error(f"Errore nella generazione in background per nota {nota_id}: {e}")
         # Set generation_in_progress to False anyway to avoid crashes
         try:
-            nota = NotaDiario.objects.get(id=nota_id)
-            nota.generazione_in_corso = False
-            nota.testo_clinico = "Errore durante la generazione dell'analisi clinica."
-            nota.save()
+            segna_analisi_fallita(nota_id)
         except:
             pass
     finally:
         connection.close()
 
 
+def _genera_sintesi_blocco(paziente, blocco):
+    """
+    Map step: summary of a chunk of notes. The result is cached on the ids and
+    data_modifica of the notes, so a chunk is summarized again only when one of
+    its notes changes.
+    """
+    cache = get_cache_llm()
+    chiave = chiave_cache(
+        OLLAMA_MODEL, 'sintesi_blocco', 0.3, RIASSUNTO_BLOCCO_MAX_CARATTERI * 2,
+        note=[[nota.id, nota.data_modifica.isoformat()] for nota in blocco]
+    )
+    if cache:
+        sintesi_in_cache = cache.get(chiave)
+        if sintesi_in_cache is not None:
+            return SintesiParziale(blocco[0].data_nota, blocco[-1].data_nota, len(blocco), sintesi_in_cache)
+
+    prompt = get_summary_chunk_prompt(paziente, blocco[0].data_nota, blocco[-1].data_nota, len(blocco), costruisci_contesto_note(blocco))
+    # A failed generation raises GenerazioneNonRiuscita: what is returned can be cached
+    testo = genera_con_ollama(prompt, max_chars=RIASSUNTO_BLOCCO_MAX_CARATTERI, temperature=0.3)
+    if cache:
+        cache.set(chiave, testo)
+    return SintesiParziale(blocco[0].data_nota, blocco[-1].data_nota, len(blocco), testo)
+
+
+def _genera_sintesi_gruppo(paziente, gruppo):
+    """Intermediate reduce step: merges consecutive partial summaries into one."""
+    prompt = get_summary_merge_prompt(paziente, formatta_sintesi_parziali(gruppo))
+    return unisci_sintesi(gruppo, genera_con_ollama(prompt, max_chars=RIASSUNTO_BLOCCO_MAX_CARATTERI * 2, temperature=0.3))
+
+
+def _in_parallelo(funzione, argomenti, avanzamento=None):
+    """
+    Runs funzione(*args) for each tuple of argomenti in the shared generation pool,
+    with at most RIASSUNTO_BLOCCHI_CONCORRENTI calls in flight, so a long summary
+    does not queue all its chunks ahead of the note analyses.
+
+    Args:
+    avanzamento: Optional callback(completati, totale), called in the caller's
+    thread every time a call completes
+
+    Returns:
+    list: The results, in the order of argomenti
+    """
+    risultati = [None] * len(argomenti)
+    in_corso = {}
+    completati = 0
+
+    def raccogli(futures):
+        nonlocal completati
+        for future in futures:
+            risultati[in_corso.pop(future)] = future.result()
+            completati += 1
+            if avanzamento:
+                avanzamento(completati, len(argomenti))
+
+    for indice, args in enumerate(argomenti):
+        if len(in_corso) >= RIASSUNTO_BLOCCHI_CONCORRENTI:
+            raccogli(wait(in_corso, return_when=FIRST_COMPLETED).done)
+        in_corso[_esecutore_generazioni.submit(_esegui_generazione, funzione, *args)] = indice
+
+    while in_corso:
+        raccogli(wait(in_corso, return_when=FIRST_COMPLETED).done)
+    return risultati
+
+
+def _budget_map_reduce(paziente, note):
+    """Estimated tokens left for the notes of a chunk and for the summaries of a merge group."""
+    budget_blocco = RIASSUNTO_BUDGET_TOKEN - stima_token(get_summary_chunk_prompt(paziente, note[0].data_nota, note[-1].data_nota, 0, ''))
+    budget_gruppo = RIASSUNTO_BUDGET_TOKEN - stima_token(get_summary_merge_prompt(paziente, ''))
+    return budget_blocco, budget_gruppo
+
+
+def genera_riassunto_clinico(paziente, periodo_label, note, avanzamento=None):
+    """
+    Generates the clinical summary of a period.
+
+    When the estimated prompt fits RIASSUNTO_BUDGET_TOKEN the notes are sent in a
+    single prompt, as before. Otherwise (long periods such as '3months' or 'year'),
+    where Ollama would silently truncate the input, a map-reduce pipeline is used:
+    the notes are summarized by week in parallel, the weekly summaries are merged
+    level by level until they fit the budget, and the final summary is generated
+    from them.
+
+    Args:
+    paziente: The patient
+    periodo_label: Label of the period shown in the prompt
+    note: List of NotaDiario of the period ordered by date (not empty)
+    avanzamento: Optional callback(fase, completati, totale) reporting the progress
+    """
+    avanzamento = avanzamento or (lambda fase, completati, totale: None)
+
+    prompt = get_summary_prompt(paziente, periodo_label, len(note), costruisci_contesto_note(note))
+    if stima_token(prompt) <= RIASSUNTO_BUDGET_TOKEN:
+        avanzamento('riassunto', 0, 1)
+        return genera_con_ollama(prompt, max_chars=2000, temperature=0.5)
+
+    budget_blocco, budget_gruppo = _budget_map_reduce(paziente, note)
+    blocchi = suddividi_note_in_blocchi(note, budget_blocco)
+    logger.info(f"Riassunto map-reduce per {paziente.codice_fiscale}: {len(note)} note in {len(blocchi)} blocchi")
+
+    avanzamento('sintesi_settimanali', 0, len(blocchi))
+    sintesi = _in_parallelo(
+        _genera_sintesi_blocco,
+        [(paziente, blocco) for blocco in blocchi],
+        lambda completati, totale: avanzamento('sintesi_settimanali', completati, totale)
+    )
+    while True:
+        prompt = get_summary_reduce_prompt(paziente, periodo_label, len(note), formatta_sintesi_parziali(sintesi))
+        gruppi = raggruppa_sintesi(sintesi, budget_gruppo)
+        if stima_token(prompt) <= RIASSUNTO_BUDGET_TOKEN or len(gruppi) == len(sintesi):
+            break
+        avanzamento('unione_sintesi', 0, len(gruppi))
+        sintesi = _in_parallelo(
+            _genera_sintesi_gruppo,
+            [(paziente, gruppo) for gruppo in gruppi],
+            lambda completati, totale: avanzamento('unione_sintesi', completati, totale)
+        )
+
+    avanzamento('riassunto', 0, 1)
+    return genera_con_ollama(prompt, max_chars=2000, temperature=0.5)
+
+
+def genera_riassunto_periodo(paziente, med_id, periodo, incrementale=False, forza=False, avanzamento=None):
+    """
+    Generates and stores the clinical summary of a patient for a period (used by
+    the summary jobs). With incrementale=True the stored summary is updated with
+    only the notes it does not cover yet, when possible. The generation is skipped
+    when the stored summary was made from the same notes, unless forza=True.
+
+    Args:
+    paziente: The patient
+    med_id: Doctor the summary belongs to
+    periodo: One of the RiassuntoCasoClinico.PERIODO_CHOICES keys
+    incrementale: Update the stored summary instead of regenerating it
+    forza: Regenerate even if the notes have not changed
+    avanzamento: Optional callback(fase, completati, totale) reporting the progress
+
+    Returns:
+    tuple: (riassunto, modalita_generazione, note_aggiunte). riassunto is the
+    saved RiassuntoCasoClinico, or None if the period has no notes
+    Raises GenerazioneNonRiuscita if a generation fails: nothing is saved, so the
+    stored summary and its fingerprint stay the previous ones and the job is retried.
+    """
+    periodo, data_inizio, periodo_label = calcola_finestra_periodo(periodo)
+    note_periodo = NotaDiario.objects.filter(paz=paziente, data_nota__gte=data_inizio).order_by('data_nota')
+
+    # Computed before reading the notes: a note written during the generation
+    # leaves the summary stale instead of being silently missed
+    impronta = impronta_note(note_periodo)
+    riassunto_precedente = RiassuntoCasoClinico.objects.filter(paz=paziente, med_id=med_id, periodo=periodo).first()
+    if not forza and riassunto_aggiornato(riassunto_precedente, impronta):
+        return riassunto_precedente, 'invariato', 0
+
+    # In modalità incrementale il riassunto salvato viene aggiornato con le sole
+    # note che non copre ancora, senza rileggere tutto il periodo
+    id_nuove = None
+    if incrementale:
+        id_note = list(note_periodo.values_list('id', flat=True))
+        # Without new notes the fingerprint changed because notes were edited or left
+        # the period: the update prompt would have nothing to add, so it is regenerated
+        id_nuove = note_da_aggiungere(riassunto_precedente, id_note) or None
+
+    if id_nuove:
+        contesto_note = costruisci_contesto_note(note_periodo.filter(id__in=id_nuove))
+        prompt = get_summary_update_prompt(
+            paziente, periodo_label, data_inizio, len(id_note),
+            riassunto_precedente.testo_riassunto, len(id_nuove), contesto_note
+        )
+        # Troppe note nuove per un solo prompt: si rigenera da zero (anche a blocchi)
+        if stima_token(prompt) > RIASSUNTO_BUDGET_TOKEN:
+            id_nuove = None
+
+    if id_nuove is None:
+        note = list(note_periodo)
+        id_note = [nota.id for nota in note]
+
+    if not id_note:
+        return None, None, 0
+
+    if id_nuove is None:
+        testo_riassunto = genera_riassunto_clinico(paziente, periodo_label, note, avanzamento)
+        data_generazione = timezone.now()
+        modalita_generazione = 'completa'
+        note_aggiunte = len(id_note)
+    else:
+        if avanzamento:
+            avanzamento('aggiornamento', 0, 1)
+        testo_riassunto = genera_con_ollama(prompt, max_chars=2000, temperature=0.5)
+        data_generazione = timezone.now()
+        modalita_generazione = 'incrementale'
+        note_aggiunte = len(id_nuove)
+
+    riassunto, _ = RiassuntoCasoClinico.objects.update_or_create(
+        paz=paziente,
+        med_id=med_id,
+        periodo=periodo,
+        defaults={
+            'testo_riassunto': testo_riassunto,
+            'data_generazione': data_generazione,
+            'note_coperte': id_note,
+            **campi_impronta(impronta),
+        }
+    )
+    return riassunto, modalita_generazione, note_aggiunte
+
+
 ##################################### --- NO AI --- ################################################
 def rileva_contenuto_crisi(testo):
     """
@@ -555,24 +1269,15 @@ def rileva_contenuto_crisi(testo):
     if not testo:
         return False, 'none'
 
-    testo_lower = testo.lower()
-
-    for keyword in KEYWORDS_SUICIDIO:
-        if keyword in testo_lower:
-            logger.warning(f"EMERGENZA RILEVATA - Tipo: suicidio - Keyword: {keyword}")
-            return True, 'suicidio'
+    trovate = trova_contenuto_crisi(testo)
+    tipo_emergenza = AUTOMA_CRISI.categoria_prioritaria(trovate)
 
-    for keyword in KEYWORDS_VIOLENZA_STALKING:
-        if keyword in testo_lower:
-            logger.warning(f"EMERGENZA RILEVATA - Tipo: violenza - Keyword: {keyword}")
-            return True, 'violenza'
-
-    for keyword in KEYWORDS_AUTOLESIONISMO:
-        if keyword in testo_lower:
-            logger.warning(f"EMERGENZA RILEVATA - Tipo: autolesionismo - Keyword: {keyword}")
-            return True, 'autolesionismo'
+    if tipo_emergenza is None:
+        return False, 'none'
 
-    return False, 'none'
+    keywords = ", ".join(f"{c.categoria}: {c.keyword} @{c.inizio}" for c in trovate)
+    logger.warning(f"EMERGENZA RILEVATA - Tipo: {tipo_emergenza} - Keyword: {keywords}")
+    return True, tipo_emergenza
 
 
 def genera_messaggio_emergenza(tipo_emergenza, medico):
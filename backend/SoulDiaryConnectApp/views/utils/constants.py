@@ -1,6 +1,62 @@
 OLLAMA_BASE_URL = "http://localhost:11434/api/generate"
 OLLAMA_MODEL = "llama3.1:8b"  # Cambia in "cbt-assistant" se hai creato il modello personalizzato
 
+# Configurazione del client HTTP verso Ollama (connessioni persistenti e riutilizzate)
+OLLAMA_POOL_SIZE = 10  # Numero massimo di connessioni keep-alive tenute aperte verso Ollama
+OLLAMA_CONNECT_TIMEOUT = 5  # Secondi per stabilire la connessione TCP
+OLLAMA_READ_TIMEOUT = 500  # Secondi di attesa della risposta (la generazione può essere lenta)
+OLLAMA_GENERAZIONI_CONCORRENTI = 6  # Limite globale di generazioni eseguite in parallelo per le analisi delle note
+OLLAMA_STREAM_BUFFER_INIZIALE = 40  # Caratteri accumulati in streaming prima di inviare il primo frammento (per rimuovere i prefissi)
+ANALISI_COMBINATA = False  # True = emozione e contesto sociale in un'unica chiamata con output JSON strutturato
+
+# Cache delle risposte di Ollama (chiave: hash di modello, prompt, temperatura e num_predict)
+LLM_CACHE_BACKEND = 'memoria'  # 'memoria' (LRU in processo), 'sqlite' (file locale), 'django' (cache di Django) o None per disattivarla
+LLM_CACHE_TTL = 60 * 60 * 24  # Secondi di validità di una risposta in cache
+LLM_CACHE_MAX_VOCI = 1000  # Numero massimo di risposte conservate (le meno usate vengono eliminate)
+LLM_CACHE_TEMPERATURA_MAX = 0.2  # Solo le generazioni con temperatura fino a questo valore (classificazioni quasi deterministiche) sono servite dalla cache: i testi liberi vengono sempre rigenerati
+LLM_CACHE_FILE_SQLITE = 'llm_cache.sqlite3'  # File usato dal backend 'sqlite' (nella cartella backend)
+LLM_CACHE_ALIAS_DJANGO = 'default'  # Alias in settings.CACHES usato dal backend 'django'
+
+# Cache dei token JWT già verificati in token_required (chiave: hash del token)
+JWT_CACHE_MAX_VOCI = 10000  # Token verificati conservati in memoria (i meno usati vengono eliminati), 0 per disattivarla
+
+# Cache per processo dei profili Paziente/Medico dell'utente autenticato (request.paziente / request.medico)
+UTENTI_CACHE_TTL = 30  # Secondi di validità di un profilo in cache (le modifiche fatte da altri processi diventano visibili entro questo tempo)
+UTENTI_CACHE_MAX_VOCI = 5000  # Profili conservati in memoria (i meno usati vengono eliminati), 0 per disattivarla
+
+# Configurazione del pool di worker per l'analisi in background delle note
+ANALISI_WORKERS = 4  # Analisi eseguite in parallelo (ognuna occupa una connessione DB e chiama Ollama)
+ANALISI_CODA_MAX = 50  # Analisi che possono restare in attesa oltre a quelle in esecuzione
+ANALISI_ATTESA_INVIO = 2  # Secondi di attesa di un posto libero prima di rifiutare una nuova analisi
+ANALISI_TIMEOUT_CHIUSURA = 120  # Secondi concessi allo spegnimento per completare le analisi in coda
+
+# Configurazione della coda persistente dei job di analisi (tabella job_analisi)
+ANALISI_JOB_MAX_TENTATIVI = 5  # Tentativi prima di marcare il job come fallito
+ANALISI_JOB_BACKOFF_BASE = 30  # Secondi di attesa dopo il primo errore (raddoppia ad ogni tentativo)
+ANALISI_JOB_BACKOFF_MAX = 3600  # Attesa massima tra due tentativi (secondi)
+ANALISI_JOB_LEASE = 1800  # Secondi dopo i quali un job in esecuzione senza esito può essere ripreso da un altro worker
+ANALISI_JOB_RINNOVO_LEASE = 300  # Ogni quanti secondi il worker rinnova il lease dei job che sta eseguendo (deve essere minore di ANALISI_JOB_LEASE)
+ANALISI_RIPRESA_IN_PROCESSO = True  # True = il processo web riprende da solo i job scaduti (nuovi tentativi, job rimasti in coda a pool pieno), anche senza analysis_worker
+ANALISI_RIPRESA_INTERVALLO = 30  # Secondi tra due controlli dei job da riprendere nel processo web
+
+# Paginazione a cursore delle liste di note (parametri ?limit= e ?cursor=)
+NOTE_PAGINA_DEFAULT = 20  # Note per pagina se il client passa solo il cursore
+NOTE_PAGINA_MAX = 100  # Limite massimo di note per pagina richiedibile dal client
+NOTE_ANTEPRIMA_CARATTERI = 200  # Caratteri del testo restituiti nelle liste con ?vista=anteprima
+
+# Grafico dell'andamento emotivo (statistiche dell'umore)
+ANDAMENTO_MAX_PUNTI = 120  # Punti massimi della serie: oltre, le note vengono raggruppate per giorno/settimana/mese
+
+# Riassunti clinici incrementali (?genera=1&incrementale=1)
+RIASSUNTO_MAX_NOTE_USCITE = 0.25  # Quota di note coperte uscite dalla finestra oltre la quale il riassunto viene rigenerato da zero
+
+# Riassunti clinici map-reduce sui periodi lunghi
+RIASSUNTO_BUDGET_TOKEN = 3000  # Token stimati del prompt oltre i quali le note vengono sintetizzate per settimana e poi ricomposte (il contesto di default di Ollama è 4096)
+RIASSUNTO_CARATTERI_PER_TOKEN = 3.5  # Stima prudente dei caratteri per token del testo italiano
+RIASSUNTO_BLOCCHI_CONCORRENTI = 3  # Sintesi settimanali generate in parallelo per ogni riassunto
+RIASSUNTO_BLOCCO_MAX_CARATTERI = 600  # Lunghezza massima della sintesi di un blocco di note
+RIASSUNTO_JOB_MAX_TENTATIVI = 3  # Tentativi di un job di generazione del riassunto prima di marcarlo come fallito
+
 # Configurazione lunghezza note cliniche (in caratteri)
 LUNGHEZZA_NOTA_BREVE = 300
 LUNGHEZZA_NOTA_LUNGA = 500
@@ -0,0 +1,168 @@
+import unicodedata
+from collections import deque, namedtuple
+from itertools import groupby
+
+from .constants import (
+    KEYWORDS_SUICIDIO,
+    KEYWORDS_VIOLENZA_STALKING,
+    KEYWORDS_AUTOLESIONISMO
+)
+
+# Crisis categories in priority order: when a note matches more than one,
+# the first one is the reported emergency type
+CATEGORIE_CRISI = {
+    'suicidio': KEYWORDS_SUICIDIO,
+    'violenza': KEYWORDS_VIOLENZA_STALKING,
+    'autolesionismo': KEYWORDS_AUTOLESIONISMO,
+}
+
+Corrispondenza = namedtuple('Corrispondenza', ['categoria', 'keyword', 'inizio', 'fine'])
+
+# Byte translation table: letters and digits are kept, everything else
+# (punctuation, apostrophes, whitespace) becomes a space
+_TABELLA_SEPARATORI = bytes(c if (97 <= c <= 122 or 48 <= c <= 57) else 32 for c in range(256))
+
+
+def normalizza_testo_crisi(testo):
+    """
+    Normal form searched by the crisis matcher: lowercase ASCII without accents,
+    with punctuation, apostrophes and whitespace turned into spaces
+    ("Più'  forte!" -> "piu   forte ").
+
+    Runs of repeated characters ("voglioooo", double spaces) are not collapsed here
+    but skipped by AutomaCrisi.cerca during the scan, to avoid a second pass.
+    """
+    testo = testo.lower()
+    if not testo.isascii():
+        # NFKD splits accented letters into letter + combining mark, dropped by the ASCII encoding
+        testo = unicodedata.normalize('NFKD', testo)
+    return testo.encode('ascii', 'ignore').translate(_TABELLA_SEPARATORI).decode('ascii')
+
+
+def _comprimi_ripetizioni(testo):
+    return ''.join(carattere for carattere, _ in groupby(testo))
+
+
+class AutomaCrisi:
+    """
+    Aho-Corasick automaton over the crisis keywords: every keyword of every category
+    is found in a single pass over the text, whatever the number of keywords.
+
+    Keywords are stored in normal form (see normalizza_testo_crisi) with repeated
+    characters collapsed, so a single entry also matches accented/unaccented,
+    punctuation, spacing and repeated-letter variants.
+
+    The failure links are folded into the transition tables at build time, so the
+    scan does one dictionary lookup per character.
+
+    Args:
+    categorie: Dict {categoria: [keyword, ...]}, in priority order
+    """
+
+    def __init__(self, categorie):
+        self.priorita = list(categorie)
+        self._transizioni = [{}]
+        self._uscite = [()]
+
+        for categoria, keywords in categorie.items():
+            for keyword in keywords:
+                self._aggiungi(_comprimi_ripetizioni(' '.join(normalizza_testo_crisi(keyword).split())), keyword, categoria)
+
+        self._costruisci_fallimenti()
+
+    def _aggiungi(self, chiave, keyword, categoria):
+        stato = 0
+        for carattere in chiave:
+            prossimo = self._transizioni[stato].get(carattere)
+            if prossimo is None:
+                prossimo = len(self._transizioni)
+                self._transizioni.append({})
+                self._uscite.append(())
+                self._transizioni[stato][carattere] = prossimo
+            stato = prossimo
+
+        # Keywords with the same normal form in the same category are reported once
+        if all(uscita[0] != categoria for uscita in self._uscite[stato]):
+            self._uscite[stato] += ((categoria, keyword, len(chiave)),)
+
+    def _costruisci_fallimenti(self):
+        # Breadth-first: the failure state of a node is always shallower, so its
+        # transition table is already complete when the node is visited
+        figli = [dict(transizioni) for transizioni in self._transizioni]
+        fallimento = [0] * len(self._transizioni)
+        coda = deque(figli[0].values())
+
+        while coda:
+            stato = coda.popleft()
+            for carattere, figlio in figli[stato].items():
+                fallimento[figlio] = self._transizioni[fallimento[stato]].get(carattere, 0) if stato else 0
+                coda.append(figlio)
+
+            if stato:
+                self._transizioni[stato] = {**self._transizioni[fallimento[stato]], **figli[stato]}
+                self._uscite[stato] += self._uscite[fallimento[stato]]
+
+    def cerca(self, testo):
+        """
+        Returns every keyword occurrence in a text already passed through
+        normalizza_testo_crisi, as a list of Corrispondenza (positions are character
+        offsets in the normalized text, end excluded).
+        """
+        transizioni = self._transizioni
+        uscite = self._uscite
+        trovate = []
+        stato = 0
+        precedente = None
+
+        for posizione, carattere in enumerate(testo):
+            # Repeated characters count once, as in the collapsed keywords
+            if carattere == precedente:
+                continue
+            precedente = carattere
+
+            stato = transizioni[stato].get(carattere, 0)
+            if uscite[stato]:
+                for categoria, keyword, lunghezza in uscite[stato]:
+                    trovate.append(Corrispondenza(categoria, keyword, _inizio(testo, posizione, lunghezza), posizione + 1))
+
+        return trovate
+
+    def categoria_prioritaria(self, trovate):
+        """Returns the highest priority category among the matches, or None."""
+        categorie = {corrispondenza.categoria for corrispondenza in trovate}
+        for categoria in self.priorita:
+            if categoria in categorie:
+                return categoria
+        return None
+
+
+def _inizio(testo, ultimo, lunghezza):
+    """
+    Start offset of a match ending at `ultimo` and spanning `lunghezza` collapsed
+    characters: walks back counting only the first character of each run.
+    """
+    posizione = ultimo
+    while True:
+        if posizione == 0 or testo[posizione] != testo[posizione - 1]:
+            lunghezza -= 1
+            if lunghezza == 0:
+                return posizione
+        posizione -= 1
+
+
+# Built once at import time and shared by every request
+AUTOMA_CRISI = AutomaCrisi(CATEGORIE_CRISI)
+
+
+def trova_contenuto_crisi(testo):
+    """
+    Finds every crisis keyword in the text, ignoring case, accents, punctuation,
+    spacing and repeated letters.
+
+    Returns:
+    list: Corrispondenza(categoria, keyword, inizio, fine) for each occurrence,
+    with positions in the normalized text
+    """
+    if not testo:
+        return []
+    return AUTOMA_CRISI.cerca(normalizza_testo_crisi(testo))
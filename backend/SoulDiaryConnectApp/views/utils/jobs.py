@@ -0,0 +1,444 @@
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from django.db import transaction, connection
+from django.db.models import Q
+from django.utils import timezone
+from ...models import NotaDiario, JobAnalisi, JobRiassunto, Paziente
+from .ai import esegui_analisi_nota, parti_analisi_mancanti, segna_analisi_fallita, genera_riassunto_periodo
+from .worker_pool import get_pool_analisi, CodaAnalisiPiena
+
+from .constants import (
+    ANALISI_JOB_MAX_TENTATIVI,
+    ANALISI_JOB_BACKOFF_BASE,
+    ANALISI_JOB_BACKOFF_MAX,
+    ANALISI_JOB_LEASE,
+    ANALISI_JOB_RINNOVO_LEASE,
+    ANALISI_RIPRESA_IN_PROCESSO,
+    ANALISI_RIPRESA_INTERVALLO,
+    RIASSUNTO_JOB_MAX_TENTATIVI
+)
+
+logger = logging.getLogger(__name__)
+
+STATI_ATTIVI = ('in_coda', 'in_esecuzione')
+
+
+def chiave_job_analisi(nota_id):
+    """Idempotency key of the analysis job of a note."""
+    return f"analisi-nota-{nota_id}"
+
+
+def identificativo_worker(suffisso=''):
+    """Returns an identifier unique to this process (host:pid[:suffix])."""
+    base = f"{socket.gethostname()}:{os.getpid()}"
+    return f"{base}:{suffisso}" if suffisso else base
+
+
+def accoda_analisi(nota, riapri=False):
+    """
+    Enqueues the analysis of a note. Enqueueing the same note twice is a no-op
+    while its job is still queued or running.
+
+    Args:
+    nota: NotaDiario object
+    riapri: If True, a completed or failed job is put back in the queue
+
+    Returns:
+    JobAnalisi: the job for the note
+    """
+    adesso = timezone.now()
+    job, creato = JobAnalisi.objects.get_or_create(
+        chiave=chiave_job_analisi(nota.id),
+        defaults={
+            'nota': nota,
+            'stato': 'in_coda',
+            'disponibile_dal': adesso,
+            'data_creazione': adesso,
+            'data_aggiornamento': adesso,
+        }
+    )
+
+    if not creato and riapri and job.stato not in STATI_ATTIVI:
+        job.stato = 'in_coda'
+        job.tentativi = 0
+        job.disponibile_dal = adesso
+        job.lease_scadenza = None
+        job.worker = None
+        job.ultimo_errore = None
+        job.data_aggiornamento = adesso
+        job.save()
+        logger.info(f"Job {job.id} riaperto per nota {nota.id}")
+
+    return job
+
+
+def preleva_job(worker, limite=1, job_id=None, modello=JobAnalisi):
+    """
+    Claims up to `limite` jobs ready to run, using SELECT ... FOR UPDATE SKIP LOCKED
+    so that concurrent workers (also on different nodes) never claim the same job.
+    Running jobs whose lease has expired (crashed worker) are claimed again.
+
+    Args:
+    worker: Identifier of the claiming worker
+    limite: Maximum number of jobs to claim
+    job_id: Claim only this job (optional)
+    modello: Queue to claim from (JobAnalisi or JobRiassunto)
+
+    Returns:
+    list: the claimed job objects
+    """
+    adesso = timezone.now()
+    with transaction.atomic():
+        query = modello.objects.select_for_update(skip_locked=True).filter(
+            Q(stato='in_coda', disponibile_dal__lte=adesso) |
+            Q(stato='in_esecuzione', lease_scadenza__lt=adesso)
+        )
+        if job_id is not None:
+            query = query.filter(id=job_id)
+
+        jobs = list(query.order_by('disponibile_dal')[:limite])
+        for job in jobs:
+            job.stato = 'in_esecuzione'
+            job.tentativi += 1
+            job.worker = worker
+            job.lease_scadenza = adesso + timedelta(seconds=ANALISI_JOB_LEASE)
+            job.data_aggiornamento = adesso
+            job.save(update_fields=['stato', 'tentativi', 'worker', 'lease_scadenza', 'data_aggiornamento'])
+
+    return jobs
+
+
+@contextmanager
+def lease_rinnovato(job, worker):
+    """
+    Renews the lease of a claimed job every ANALISI_JOB_RINNOVO_LEASE seconds while
+    the block runs, from a background thread. A job running longer than
+    ANALISI_JOB_LEASE (e.g. a map-reduce summary of a long period) is therefore
+    not claimed again by another worker: only a worker that died stops renewing it.
+    """
+    modello = type(job)
+    fermo = threading.Event()
+
+    def rinnova():
+        try:
+            while not fermo.wait(ANALISI_JOB_RINNOVO_LEASE):
+                rinnovati = modello.objects.filter(id=job.id, worker=worker, stato='in_esecuzione').update(
+                    lease_scadenza=timezone.now() + timedelta(seconds=ANALISI_JOB_LEASE)
+                )
+                if not rinnovati:
+                    logger.warning(f"Lease del job {job.id} ({modello.__name__}) non più detenuto da {worker}")
+                    return
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=rinnova, name=f"lease-job-{job.id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        fermo.set()
+        thread.join()
+
+
+def _calcola_backoff(tentativi):
+    return min(ANALISI_JOB_BACKOFF_BASE * (2 ** max(tentativi - 1, 0)), ANALISI_JOB_BACKOFF_MAX)
+
+
+def _registra_fallimento(job, worker, errore):
+    adesso = timezone.now()
+    if job.tentativi >= ANALISI_JOB_MAX_TENTATIVI:
+        aggiornati = JobAnalisi.objects.filter(id=job.id, worker=worker, stato='in_esecuzione').update(
+            stato='fallito',
+            lease_scadenza=None,
+            ultimo_errore=errore,
+            data_aggiornamento=adesso
+        )
+        if aggiornati:
+            logger.error(f"Job {job.id} fallito definitivamente dopo {job.tentativi} tentativi: {errore}")
+            segna_analisi_fallita(job.nota_id)
+    else:
+        attesa = _calcola_backoff(job.tentativi)
+        JobAnalisi.objects.filter(id=job.id, worker=worker, stato='in_esecuzione').update(
+            stato='in_coda',
+            disponibile_dal=adesso + timedelta(seconds=attesa),
+            lease_scadenza=None,
+            ultimo_errore=errore,
+            data_aggiornamento=adesso
+        )
+        logger.warning(f"Job {job.id} fallito (tentativo {job.tentativi}), nuovo tentativo tra {attesa}s: {errore}")
+
+
+def esegui_job(job, worker):
+    """
+    Runs a claimed analysis job, then marks it completed or schedules a retry
+    with exponential backoff when a generation fails (GenerazioneNonRiuscita,
+    e.g. Ollama unreachable). The lease is renewed while the job runs; only the
+    worker holding it can update the job.
+    """
+    if job.tentativi > ANALISI_JOB_MAX_TENTATIVI:
+        # Claimed again after its lease expired too many times (e.g. it keeps crashing the worker)
+        _registra_fallimento(job, worker, "Numero massimo di tentativi superato.")
+        return
+
+    try:
+        nota = NotaDiario.objects.select_related('paz__med').get(id=job.nota_id)
+        # A retry generates only the parts that failed in the previous attempts
+        with lease_rinnovato(job, worker):
+            esegui_analisi_nota(nota.id, nota.testo_paziente, nota.paz.med, nota.paz, parti=parti_analisi_mancanti(nota))
+    except NotaDiario.DoesNotExist:
+        # The note has been deleted: nothing left to do
+        JobAnalisi.objects.filter(id=job.id).delete()
+        return
+    except Exception as e:
+        _registra_fallimento(job, worker, str(e))
+        return
+
+    JobAnalisi.objects.filter(id=job.id, worker=worker, stato='in_esecuzione').update(
+        stato='completato',
+        lease_scadenza=None,
+        ultimo_errore=None,
+        data_aggiornamento=timezone.now()
+    )
+
+
+def esegui_job_in_processo(job_id):
+    """
+    Runs a specific job inside the web process (through the analysis pool).
+    If a worker has already claimed it, nothing is done.
+    """
+    worker = identificativo_worker('web')
+    try:
+        for job in preleva_job(worker, job_id=job_id):
+            esegui_job(job, worker)
+    finally:
+        connection.close()
+
+
+def recupera_note_orfane():
+    """
+    Finds notes still flagged generazione_in_corso without a queued or running
+    job (e.g. the process died mid-analysis) and enqueues them again.
+
+    Returns:
+    int: number of re-enqueued notes
+    """
+    orfane = NotaDiario.objects.filter(generazione_in_corso=True).exclude(
+        jobanalisi__stato__in=STATI_ATTIVI
+    ).only('id')
+
+    recuperate = 0
+    for nota in orfane.iterator():
+        accoda_analisi(nota, riapri=True)
+        recuperate += 1
+
+    if recuperate:
+        logger.warning(f"Recuperate {recuperate} note con analisi interrotta")
+    return recuperate
+
+
+def chiave_job_riassunto(paz_id, med_id, periodo):
+    """Idempotency key of the summary job of a (patient, doctor, period)."""
+    return f"riassunto-{paz_id}-{med_id}-{periodo}"
+
+
+def accoda_riassunto(paz_id, med_id, periodo, incrementale=False, forza=False):
+    """
+    Enqueues the generation of a clinical summary. There is a single job per
+    (patient, doctor, period): while it is queued or running, further requests
+    join it instead of starting a duplicate generation; a completed or failed
+    job is put back in the queue.
+
+    Returns:
+    tuple: (job, avviato), avviato is False when the request joined a job already
+    queued or running
+    """
+    adesso = timezone.now()
+    job, creato = JobRiassunto.objects.get_or_create(
+        chiave=chiave_job_riassunto(paz_id, med_id, periodo),
+        defaults={
+            'paz_id': paz_id,
+            'med_id': med_id,
+            'periodo': periodo,
+            'incrementale': incrementale,
+            'forza': forza,
+            'stato': 'in_coda',
+            'disponibile_dal': adesso,
+            'data_creazione': adesso,
+            'data_aggiornamento': adesso,
+        }
+    )
+    if creato:
+        return job, True
+
+    # Conditional update: of two concurrent requests only one reopens the job
+    riaperti = JobRiassunto.objects.filter(id=job.id).exclude(stato__in=STATI_ATTIVI).update(
+        stato='in_coda',
+        incrementale=incrementale,
+        forza=forza,
+        tentativi=0,
+        disponibile_dal=adesso,
+        lease_scadenza=None,
+        worker=None,
+        ultimo_errore=None,
+        fase=None,
+        passi_completati=0,
+        passi_totali=0,
+        data_creazione=adesso,
+        data_aggiornamento=adesso
+    )
+    job.refresh_from_db()
+    return job, riaperti == 1
+
+
+def _registra_fallimento_riassunto(job, worker, errore):
+    adesso = timezone.now()
+    if job.tentativi >= RIASSUNTO_JOB_MAX_TENTATIVI:
+        JobRiassunto.objects.filter(id=job.id, worker=worker, stato='in_esecuzione').update(
+            stato='fallito',
+            lease_scadenza=None,
+            ultimo_errore=errore,
+            data_aggiornamento=adesso
+        )
+        logger.error(f"Job riassunto {job.id} fallito definitivamente dopo {job.tentativi} tentativi: {errore}")
+    else:
+        attesa = _calcola_backoff(job.tentativi)
+        JobRiassunto.objects.filter(id=job.id, worker=worker, stato='in_esecuzione').update(
+            stato='in_coda',
+            disponibile_dal=adesso + timedelta(seconds=attesa),
+            lease_scadenza=None,
+            ultimo_errore=errore,
+            data_aggiornamento=adesso
+        )
+        logger.warning(f"Job riassunto {job.id} fallito (tentativo {job.tentativi}), nuovo tentativo tra {attesa}s: {errore}")
+
+
+def esegui_job_riassunto(job, worker):
+    """
+    Runs a claimed summary job, recording its progress on the job row so that the
+    status endpoint can report it, then marks it completed or schedules a retry.
+    """
+    if job.tentativi > RIASSUNTO_JOB_MAX_TENTATIVI:
+        _registra_fallimento_riassunto(job, worker, "Numero massimo di tentativi superato.")
+        return
+
+    def avanzamento(fase, completati, totale):
+        JobRiassunto.objects.filter(id=job.id, worker=worker, stato='in_esecuzione').update(
+            fase=fase,
+            passi_completati=completati,
+            passi_totali=totale,
+            data_aggiornamento=timezone.now()
+        )
+
+    try:
+        paziente = Paziente.objects.get(codice_fiscale=job.paz_id)
+        with lease_rinnovato(job, worker):
+            riassunto, modalita_generazione, note_aggiunte = genera_riassunto_periodo(
+                paziente, job.med_id, job.periodo,
+                incrementale=job.incrementale, forza=job.forza, avanzamento=avanzamento
+            )
+    except Exception as e:
+        _registra_fallimento_riassunto(job, worker, str(e))
+        return
+
+    JobRiassunto.objects.filter(id=job.id, worker=worker, stato='in_esecuzione').update(
+        stato='completato',
+        lease_scadenza=None,
+        ultimo_errore=None,
+        riassunto=riassunto,
+        modalita_generazione=modalita_generazione,
+        note_aggiunte=note_aggiunte,
+        data_aggiornamento=timezone.now()
+    )
+
+
+def esegui_job_riassunto_in_processo(job_id):
+    """
+    Runs a specific summary job inside the web process (through the analysis pool).
+    If a worker has already claimed it, nothing is done.
+    """
+    worker = identificativo_worker('web')
+    try:
+        for job in preleva_job(worker, job_id=job_id, modello=JobRiassunto):
+            esegui_job_riassunto(job, worker)
+    finally:
+        connection.close()
+
+
+def _job_da_riprendere(modello, limite):
+    adesso = timezone.now()
+    return list(
+        modello.objects.filter(
+            Q(stato='in_coda', disponibile_dal__lte=adesso) |
+            Q(stato='in_esecuzione', lease_scadenza__lt=adesso)
+        ).order_by('disponibile_dal').values_list('id', flat=True)[:limite]
+    )
+
+
+def riprendi_job_in_processo():
+    """
+    Submits to the analysis pool the jobs that are due but not running: retries
+    whose backoff has expired, jobs left in the queue when the pool was full and
+    jobs of a worker that died. At most as many jobs as the pool has idle workers
+    are submitted, note analyses first; a job claimed in the meantime by someone
+    else (an analysis_worker or another web process) is skipped by preleva_job.
+
+    Returns:
+    int: number of submitted jobs
+    """
+    pool = get_pool_analisi()
+    metriche = pool.metriche()
+    liberi = metriche['workers'] - metriche['in_esecuzione'] - metriche['in_coda']
+
+    inviati = 0
+    for modello, esegui in ((JobAnalisi, esegui_job_in_processo), (JobRiassunto, esegui_job_riassunto_in_processo)):
+        if inviati >= liberi:
+            break
+        for job_id in _job_da_riprendere(modello, liberi - inviati):
+            try:
+                pool.submit(esegui, job_id)
+            except CodaAnalisiPiena:
+                return inviati
+            inviati += 1
+
+    if inviati:
+        logger.info(f"Ripresi {inviati} job in coda nel processo web")
+    return inviati
+
+
+_ripresa_avviata = False
+_ripresa_lock = threading.Lock()
+
+
+def avvia_ripresa_job():
+    """
+    Starts, once per process, the background thread that calls riprendi_job_in_processo
+    every ANALISI_RIPRESA_INTERVALLO seconds: retries and jobs refused by a full pool
+    are then run by the web process itself, even when no analysis_worker is running.
+    Called by the views that submit jobs to the pool; a no-op if
+    ANALISI_RIPRESA_IN_PROCESSO is False.
+    """
+    global _ripresa_avviata
+    if not ANALISI_RIPRESA_IN_PROCESSO or _ripresa_avviata:
+        return
+    with _ripresa_lock:
+        if _ripresa_avviata:
+            return
+        _ripresa_avviata = True
+
+    def ciclo():
+        while True:
+            time.sleep(ANALISI_RIPRESA_INTERVALLO)
+            try:
+                riprendi_job_in_processo()
+            except Exception as e:
+                logger.error(f"Errore nella ripresa dei job in coda: {e}")
+            finally:
+                connection.close()
+
+    threading.Thread(target=ciclo, name='ripresa-job', daemon=True).start()
+    logger.info(f"Ripresa dei job in coda avviata (ogni {ANALISI_RIPRESA_INTERVALLO}s)")
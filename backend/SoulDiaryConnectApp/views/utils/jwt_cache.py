@@ -0,0 +1,101 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+from django.conf import settings
+
+from .constants import JWT_CACHE_MAX_VOCI
+
+
+def decodifica_token(token):
+    """
+    Decodes and verifies (HS256 signature and expiry) a JWT token.
+
+    Returns:
+    dict: the claims used by the views (user_id, user_type and exp)
+    Raises jwt.ExpiredSignatureError or jwt.InvalidTokenError if the token is not valid.
+    """
+    data = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
+    return {'user_id': data['user_id'], 'user_type': data['user_type'], 'exp': data.get('exp')}
+
+
+class CacheTokenVerificati:
+    """
+    In-process LRU cache of already verified tokens, bounded to `max_voci` entries.
+
+    The key is the SHA-256 of the token, so the tokens themselves are not kept in
+    memory. An entry is valid until the `exp` claim of its token: after that the
+    token goes through jwt.decode again, which rejects it as expired. Tokens
+    without `exp` and tokens that fail verification are never cached.
+    """
+
+    def __init__(self, max_voci=JWT_CACHE_MAX_VOCI):
+        self.max_voci = max_voci
+        self._voci = OrderedDict()
+        self._lock = threading.Lock()
+        self._hit = 0
+        self._miss = 0
+
+    def verifica(self, token):
+        """
+        Returns the claims of the token like decodifica_token, skipping the
+        signature check if the token was already verified and has not expired.
+        """
+        chiave = hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+        with self._lock:
+            voce = self._voci.get(chiave)
+            if voce is not None and voce['exp'] > time.time():
+                self._voci.move_to_end(chiave)
+                self._hit += 1
+                return voce
+            if voce is not None:
+                del self._voci[chiave]
+            self._miss += 1
+
+        # Verification runs outside the lock: concurrent misses do not wait for each other
+        claims = decodifica_token(token)
+        if claims['exp'] is None:
+            return claims
+
+        with self._lock:
+            self._voci[chiave] = claims
+            self._voci.move_to_end(chiave)
+            while len(self._voci) > self.max_voci:
+                self._voci.popitem(last=False)
+        return claims
+
+    def clear(self):
+        with self._lock:
+            self._voci.clear()
+
+    def statistiche(self):
+        """Returns hits, misses, cached tokens and hit rate."""
+        with self._lock:
+            totale = self._hit + self._miss
+            return {
+                'hit': self._hit,
+                'miss': self._miss,
+                'voci': len(self._voci),
+                'hit_rate': round(self._hit / totale, 4) if totale else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache_token():
+    """
+    Returns the process-wide cache of verified tokens, or None if JWT_CACHE_MAX_VOCI is 0.
+    """
+    global _cache
+    if not JWT_CACHE_MAX_VOCI:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = CacheTokenVerificati()
+    return _cache
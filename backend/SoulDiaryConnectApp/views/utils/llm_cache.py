@@ -0,0 +1,219 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+
+from .constants import (
+    LLM_CACHE_BACKEND,
+    LLM_CACHE_TTL,
+    LLM_CACHE_MAX_VOCI,
+    LLM_CACHE_FILE_SQLITE,
+    LLM_CACHE_ALIAS_DJANGO
+)
+
+logger = logging.getLogger(__name__)
+
+
+def chiave_cache(modello, prompt, temperature, num_predict, **extra):
+    """
+    Content-addressed key of a generation: SHA-256 of model, prompt and options.
+    Extra options that change the output (e.g. the JSON schema) are part of the key.
+    """
+    contenuto = json.dumps(
+        {'modello': modello, 'prompt': prompt, 'temperature': temperature, 'num_predict': num_predict, **extra},
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(contenuto.encode('utf-8')).hexdigest()
+
+
+class CacheMemoriaLRU:
+    """In-process LRU cache with TTL, bounded to `max_voci` entries."""
+
+    def __init__(self, max_voci=LLM_CACHE_MAX_VOCI):
+        self.max_voci = max_voci
+        self._voci = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chiave):
+        with self._lock:
+            voce = self._voci.get(chiave)
+            if voce is None:
+                return None
+            scadenza, valore = voce
+            if scadenza < time.time():
+                del self._voci[chiave]
+                return None
+            self._voci.move_to_end(chiave)
+            return valore
+
+    def set(self, chiave, valore, ttl):
+        with self._lock:
+            self._voci[chiave] = (time.time() + ttl, valore)
+            self._voci.move_to_end(chiave)
+            while len(self._voci) > self.max_voci:
+                self._voci.popitem(last=False)
+
+    def delete(self, chiave):
+        with self._lock:
+            self._voci.pop(chiave, None)
+
+    def clear(self):
+        with self._lock:
+            self._voci.clear()
+
+
+class CacheSQLite:
+    """
+    Cache stored in a local SQLite file, shared by the processes of the same node.
+    Expired entries and, above `max_voci`, the least recently used ones are evicted.
+    """
+
+    def __init__(self, percorso, max_voci=LLM_CACHE_MAX_VOCI):
+        self.max_voci = max_voci
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(percorso, check_same_thread=False, timeout=5)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "chiave TEXT PRIMARY KEY, valore TEXT NOT NULL, scadenza REAL NOT NULL, ultimo_accesso REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accesso_idx ON llm_cache (ultimo_accesso)")
+        self._conn.commit()
+
+    def get(self, chiave):
+        adesso = time.time()
+        with self._lock:
+            riga = self._conn.execute(
+                "SELECT valore, scadenza FROM llm_cache WHERE chiave = ?", (chiave,)
+            ).fetchone()
+            if riga is None:
+                return None
+            if riga[1] < adesso:
+                self._conn.execute("DELETE FROM llm_cache WHERE chiave = ?", (chiave,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE llm_cache SET ultimo_accesso = ? WHERE chiave = ?", (adesso, chiave))
+            self._conn.commit()
+            return riga[0]
+
+    def set(self, chiave, valore, ttl):
+        adesso = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (chiave, valore, scadenza, ultimo_accesso) VALUES (?, ?, ?, ?)",
+                (chiave, valore, adesso + ttl, adesso)
+            )
+            self._conn.execute("DELETE FROM llm_cache WHERE scadenza < ?", (adesso,))
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE chiave IN ("
+                "SELECT chiave FROM llm_cache ORDER BY ultimo_accesso DESC LIMIT -1 OFFSET ?)",
+                (self.max_voci,)
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+
+class CacheDjango:
+    """Cache backed by a Django cache alias (TTL and size limits come from settings.CACHES)."""
+
+    def __init__(self, alias=LLM_CACHE_ALIAS_DJANGO):
+        from django.core.cache import caches
+        self._cache = caches[alias]
+
+    def get(self, chiave):
+        return self._cache.get(f"llm:{chiave}")
+
+    def set(self, chiave, valore, ttl):
+        self._cache.set(f"llm:{chiave}", valore, timeout=ttl)
+
+    def clear(self):
+        self._cache.clear()
+
+
+class CacheLLM:
+    """
+    Cache of the model responses on top of a pluggable backend, with hit/miss counters.
+    Backend errors are logged and treated as misses: the cache never blocks a generation.
+    """
+
+    def __init__(self, backend, ttl=LLM_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._hit = 0
+        self._miss = 0
+        self._scritture = 0
+
+    def get(self, chiave):
+        try:
+            valore = self.backend.get(chiave)
+        except Exception as e:
+            logger.error(f"Errore in lettura dalla cache LLM: {e}")
+            valore = None
+
+        with self._lock:
+            if valore is None:
+                self._miss += 1
+            else:
+                self._hit += 1
+        return valore
+
+    def set(self, chiave, valore):
+        try:
+            self.backend.set(chiave, valore, self.ttl)
+            with self._lock:
+                self._scritture += 1
+        except Exception as e:
+            logger.error(f"Errore in scrittura nella cache LLM: {e}")
+
+    def clear(self):
+        self.backend.clear()
+
+    def statistiche(self):
+        """Returns hits, misses, writes and hit rate."""
+        with self._lock:
+            totale = self._hit + self._miss
+            return {
+                'backend': type(self.backend).__name__,
+                'hit': self._hit,
+                'miss': self._miss,
+                'scritture': self._scritture,
+                'hit_rate': round(self._hit / totale, 4) if totale else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _crea_backend(nome):
+    if nome == 'memoria':
+        return CacheMemoriaLRU()
+    if nome == 'sqlite':
+        return CacheSQLite(os.path.join(settings.BASE_DIR, LLM_CACHE_FILE_SQLITE))
+    if nome == 'django':
+        return CacheDjango()
+    raise ValueError(f"Backend di cache LLM sconosciuto: {nome}")
+
+
+def get_cache_llm():
+    """
+    Returns the process-wide LLM cache, or None if LLM_CACHE_BACKEND is None.
+    """
+    global _cache
+    if LLM_CACHE_BACKEND is None:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = CacheLLM(_crea_backend(LLM_CACHE_BACKEND))
+    return _cache
@@ -0,0 +1,133 @@
+import logging
+import threading
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from requests.adapters import HTTPAdapter
+
+from .constants import (
+    OLLAMA_BASE_URL,
+    OLLAMA_POOL_SIZE,
+    OLLAMA_CONNECT_TIMEOUT,
+    OLLAMA_READ_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+
+class OllamaClient:
+    """
+    HTTP client for Ollama with connection pooling and keep-alive.
+
+    A single HTTPAdapter (and therefore a single urllib3 connection pool) is shared
+    by every thread of the process, while each thread gets its own requests.Session:
+    connections are reused across threads without sharing the non thread-safe
+    session state (cookies, hooks).
+
+    Args:
+    base_url: Ollama endpoint to call
+    pool_size: Maximum number of keep-alive connections kept open
+    connect_timeout: Seconds to wait for the TCP connection
+    read_timeout: Seconds to wait for the response
+    """
+
+    def __init__(self, base_url=OLLAMA_BASE_URL, pool_size=OLLAMA_POOL_SIZE,
+                 connect_timeout=OLLAMA_CONNECT_TIMEOUT, read_timeout=OLLAMA_READ_TIMEOUT):
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self._locale = threading.local()
+
+    def _sessione(self):
+        sessione = getattr(self._locale, 'sessione', None)
+        if sessione is None:
+            sessione = requests.Session()
+            sessione.mount('http://', self._adapter)
+            sessione.mount('https://', self._adapter)
+            self._locale.sessione = sessione
+        return sessione
+
+    def post(self, payload, **kwargs):
+        """
+        Sends the payload as JSON to the Ollama endpoint reusing a pooled connection.
+        Extra keyword arguments (e.g. stream=True) are forwarded to requests.
+        """
+        return self._sessione().post(self.base_url, json=payload, timeout=self.timeout, **kwargs)
+
+    def close(self):
+        """Closes every pooled connection."""
+        self._adapter.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_ollama_client():
+    """
+    Returns the process-wide Ollama client, creating it on first use.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OllamaClient()
+                logger.info(f"Client Ollama inizializzato (pool: {OLLAMA_POOL_SIZE} connessioni)")
+    return _client
+
+
+class AsyncOllamaClient:
+    """
+    Asynchronous Ollama client (httpx) for the ASGI views: waiting for a generation
+    does not hold a thread, so one process can keep many generations in flight.
+    Requests exceeding the pool size wait for a free connection instead of failing.
+    """
+
+    def __init__(self, base_url=OLLAMA_BASE_URL, pool_size=OLLAMA_POOL_SIZE,
+                 connect_timeout=OLLAMA_CONNECT_TIMEOUT, read_timeout=OLLAMA_READ_TIMEOUT):
+        self.base_url = base_url
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(connect=connect_timeout, read=read_timeout, write=connect_timeout, pool=None),
+        )
+
+    async def post(self, payload):
+        return await self._client.post(self.base_url, json=payload)
+
+    async def close(self):
+        await self._client.aclose()
+
+
+class OllamaClientInThread:
+    """
+    Async interface over the pooled sync client: the call runs in a thread of the
+    asgiref executor. Used when the event loop lives for a single request.
+    """
+
+    async def post(self, payload):
+        return await sync_to_async(get_ollama_client().post, thread_sensitive=False)(payload)
+
+
+_client_async = None
+_client_in_thread = OllamaClientInThread()
+
+
+def get_async_ollama_client():
+    """
+    Returns the client for the async views.
+
+    An httpx.AsyncClient is bound to the event loop it is created in. Under an ASGI
+    server (uvicorn, daphne) the loop runs in the main thread for the whole life of
+    the process, so a single AsyncOllamaClient is shared by every request. Under
+    WSGI (runserver, gunicorn) each async view runs through async_to_sync on a new
+    loop in a worker thread: a client there would open a connection pool per request
+    and never close it, so the pooled sync client is used from a thread instead.
+    The async views only save threads under an ASGI server.
+    """
+    global _client_async
+    if threading.current_thread() is not threading.main_thread():
+        return _client_in_thread
+    if _client_async is None:
+        _client_async = AsyncOllamaClient()
+        logger.info(f"Client Ollama asincrono inizializzato (pool: {OLLAMA_POOL_SIZE} connessioni)")
+    return _client_async
@@ -0,0 +1,114 @@
+import base64
+from datetime import datetime
+from django.db.models import Q
+from django.db.models.functions import Length, Substr
+
+from .constants import NOTE_PAGINA_DEFAULT, NOTE_PAGINA_MAX, NOTE_ANTEPRIMA_CARATTERI
+
+# Columns shown by the note lists: clinical texts, explanations and emergency
+# messages are only read by the detail endpoints
+CAMPI_LISTA_NOTE = ('id', 'data_nota', 'emozione_predominante', 'generazione_in_corso')
+
+
+class CursoreNonValido(ValueError):
+    pass
+
+
+def codifica_cursore(data_nota, nota_id):
+    """
+    Opaque cursor of the last note of a page: base64 of "<data_nota ISO>|<id>".
+    """
+    grezzo = f"{data_nota.isoformat()}|{nota_id}"
+    return base64.urlsafe_b64encode(grezzo.encode('utf-8')).decode('ascii')
+
+
+def decodifica_cursore(cursore):
+    """
+    Returns (data_nota, id) from a cursor created by codifica_cursore.
+    Raises CursoreNonValido if the cursor is malformed.
+    """
+    try:
+        data_iso, nota_id = base64.urlsafe_b64decode(cursore.encode('ascii')).decode('utf-8').rsplit('|', 1)
+        return datetime.fromisoformat(data_iso), int(nota_id)
+    except (ValueError, UnicodeError) as e:
+        raise CursoreNonValido("Cursore di paginazione non valido") from e
+
+
+def leggi_parametri_paginazione(request):
+    """
+    Reads ?limit= and ?cursor= from the request.
+
+    Returns:
+    tuple: (paginata, cursore, limite). paginata is False when the client passes
+    neither parameter: the endpoint then returns the whole list as before.
+    Raises CursoreNonValido for an invalid limit or cursor.
+    """
+    limite = request.GET.get('limit')
+    cursore = request.GET.get('cursor') or None
+
+    if limite is None and cursore is None:
+        return False, None, None
+
+    if limite is None:
+        limite = NOTE_PAGINA_DEFAULT
+    else:
+        try:
+            limite = int(limite)
+        except ValueError as e:
+            raise CursoreNonValido("Parametro limit non valido") from e
+        if limite < 1:
+            raise CursoreNonValido("Parametro limit non valido")
+
+    return True, cursore, min(limite, NOTE_PAGINA_MAX)
+
+
+def pagina_note(queryset, cursore, limite):
+    """
+    Keyset pagination of notes from the most recent, on (data_nota, id): the page
+    starts right after the cursor, so the cost does not depend on how many
+    notes come before it (unlike OFFSET).
+
+    Returns:
+    tuple: (note, next_cursor), next_cursor is None on the last page
+    """
+    queryset = queryset.order_by('-data_nota', '-id')
+
+    if cursore:
+        data_nota, nota_id = decodifica_cursore(cursore)
+        queryset = queryset.filter(Q(data_nota__lt=data_nota) | Q(data_nota=data_nota, id__lt=nota_id))
+
+    # One extra row tells whether there is a next page without a COUNT
+    note = list(queryset[:limite + 1])
+    if len(note) <= limite:
+        return note, None
+
+    note = note[:limite]
+    return note, codifica_cursore(note[-1].data_nota, note[-1].id)
+
+
+def proiezione_lista_note(queryset, anteprima=False):
+    """
+    Loads only the columns shown by the note lists. With anteprima=True the full
+    text is not transferred: the database returns its first
+    NOTE_ANTEPRIMA_CARATTERI characters and its length.
+    """
+    if anteprima:
+        return queryset.only(*CAMPI_LISTA_NOTE).annotate(
+            anteprima=Substr('testo_paziente', 1, NOTE_ANTEPRIMA_CARATTERI),
+            lunghezza_testo=Length('testo_paziente')
+        )
+    return queryset.only(*CAMPI_LISTA_NOTE, 'testo_paziente')
+
+
+def testo_lista_note(nota, anteprima=False):
+    """
+    Text fields of a note in a list response: the full text, or the preview with
+    its total length when the list is requested with ?vista=anteprima.
+    """
+    if anteprima:
+        return {
+            "anteprima": nota.anteprima,
+            "lunghezza_testo": nota.lunghezza_testo,
+            "troncato": nota.lunghezza_testo > NOTE_ANTEPRIMA_CARATTERI,
+        }
+    return {"testo": nota.testo_paziente}
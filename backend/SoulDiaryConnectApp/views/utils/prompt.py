@@ -135,6 +135,49 @@ def get_prompt_analizza_contesto_sociale(paziente, testo, contesti_lista):
     return prompt
 
 
+def get_prompt_analizza_emozione_e_contesto(paziente, emozioni_lista, contesti_lista, testo):
+    info_paziente = ""
+    if paziente:
+        nome_completo = f"{paziente.nome} {paziente.cognome}"
+        info_paziente = f"""INFORMAZIONE IMPORTANTE SULL'AUTORE:
+        L'autore di questo testo è {nome_completo}.
+        Questo testo è scritto in prima persona da {nome_completo}.
+        Qualsiasi altro nome menzionato (anche se uguale a "{paziente.nome}") si riferisce ad altre persone (amici, familiari, colleghi, ecc.), NON all'autore.
+        Analizza le emozioni e il contesto sociale di {nome_completo}, l'autore del testo.
+        """
+
+    prompt = f"""Sei un esperto di analisi delle emozioni e del contesto sociale. Il tuo compito è identificare l'emozione predominante e il contesto sociale principale di un testo, spiegando perché.
+
+    {info_paziente}
+    
+    EMOZIONI DISPONIBILI (scegli SOLO tra queste):
+    {emozioni_lista}
+    
+    CONTESTI DISPONIBILI (scegli SOLO tra questi):
+    {contesti_lista}
+    
+    FORMATO RISPOSTA (OBBLIGATORIO): un oggetto JSON con i campi
+    "emozione": una sola emozione dalla lista
+    "spiegazione_emozione": breve spiegazione di 1-2 frasi che cita tra virgolette parole SPECIFICHE del testo
+    "contesto": un solo contesto dalla lista
+    "spiegazione_contesto": breve spiegazione di 1-2 frasi che cita elementi specifici del testo
+    
+    REGOLE FONDAMENTALI:
+    1. NON inventare emozioni o contesti non presenti nelle liste
+    2. Se il testo esprime più emozioni, scegli quella PREDOMINANTE (la più forte/evidente)
+    3. USA "confusione" SOLO se il testo esprime esplicitamente incertezza, dubbi o disorientamento, MAI come emozione di default
+    4. L'attività fisica (palestra, allenamento, corsa, nuoto, calcio, fitness, yoga, ecc.) va SEMPRE classificata come "palestra" o "sport", MAI come "tempo libero"
+    5. "famiglia" SOLO se il testo menziona ESPLICITAMENTE familiari; "relazione" per il partner sentimentale/romantico; "amicizia" per amici e conoscenti
+    6. Se il testo non indica chiaramente un contesto, usa "altro"
+    
+    Testo da analizzare:
+    {testo}
+    
+    Rispondi ora con l'oggetto JSON richiesto:"""
+
+    return prompt
+
+
 def get_prompt_genera_frasi_di_supporto(paziente, testo):
     contesto_paziente = ""
     if paziente:
@@ -432,17 +475,114 @@ def get_prompt_strutturato_lungo(paziente, contesto_precedente, testo, max_chars
     return prompt
 
 
-def get_summary_prompt(paziente, periodo_label, note_periodo, contesto_note):
+def get_summary_prompt(paziente, periodo_label, numero_note, contesto_note):
     prompt = f"""Sei uno psicologo clinico esperto. Il tuo compito è generare un riassunto clinico professionale dello stato del paziente basandoti sulle note del diario raccolte nel periodo specificato.
 
         INFORMAZIONI PAZIENTE:
         Nome: {paziente.nome} {paziente.cognome}
         Periodo analizzato: {periodo_label}
-        Numero di note: {note_periodo.count()}
+        Numero di note: {numero_note}
+        
+        NOTE DEL DIARIO:
+        {contesto_note}
+        
+        ISTRUZIONI:
+        1. Fornisci un riassunto clinico strutturato che includa:
+            - Panoramica generale dello stato emotivo nel periodo
+            - Pattern emotivi ricorrenti identificati
+            - Eventuali miglioramenti o peggioramenti osservati
+            - Aree di attenzione o preoccupazione
+            - Raccomandazioni per il follow-up
+        
+        2. Usa un linguaggio professionale e clinico
+        3. Sii obiettivo e basati solo sui dati forniti
+        4. Evidenzia eventuali trend significativi
+        
+        Genera il riassunto clinico:"""
+    return prompt
+
+
+def get_summary_update_prompt(paziente, periodo_label, data_inizio, numero_note, riassunto_precedente, numero_note_nuove, contesto_note_nuove):
+    prompt = f"""Sei uno psicologo clinico esperto. Il tuo compito è aggiornare un riassunto clinico professionale già redatto sullo stato del paziente, integrandolo con le nuove note del diario scritte dopo la sua stesura.
+
+        INFORMAZIONI PAZIENTE:
+        Nome: {paziente.nome} {paziente.cognome}
+        Periodo analizzato: {periodo_label} (dal {data_inizio.strftime('%d/%m/%Y')})
+        Numero di note nel periodo: {numero_note}
+        
+        RIASSUNTO CLINICO PRECEDENTE:
+        {riassunto_precedente}
+        
+        NUOVE NOTE DEL DIARIO ({numero_note_nuove}):
+        {contesto_note_nuove}
+        
+        ISTRUZIONI:
+        1. Riscrivi il riassunto clinico completo integrando le nuove note, mantenendo la struttura:
+            - Panoramica generale dello stato emotivo nel periodo
+            - Pattern emotivi ricorrenti identificati
+            - Eventuali miglioramenti o peggioramenti osservati
+            - Aree di attenzione o preoccupazione
+            - Raccomandazioni per il follow-up
+        
+        2. Dai rilievo ai cambiamenti rispetto al riassunto precedente
+        3. Tralascia gli elementi riferiti a date precedenti all'inizio del periodo
+        4. Usa un linguaggio professionale e clinico, sii obiettivo e basati solo sui dati forniti
+        
+        Genera il riassunto clinico aggiornato:"""
+    return prompt
+
+
+def get_summary_chunk_prompt(paziente, data_inizio, data_fine, numero_note, contesto_note):
+    prompt = f"""Sei uno psicologo clinico esperto. Il tuo compito è sintetizzare le note del diario di un paziente scritte in un breve intervallo di tempo; la sintesi verrà poi usata per redigere il riassunto clinico di un periodo più lungo.
+
+        INFORMAZIONI PAZIENTE:
+        Nome: {paziente.nome} {paziente.cognome}
+        Intervallo: dal {data_inizio.strftime('%d/%m/%Y')} al {data_fine.strftime('%d/%m/%Y')}
+        Numero di note: {numero_note}
         
         NOTE DEL DIARIO:
         {contesto_note}
         
+        ISTRUZIONI:
+        1. Riporta in modo sintetico lo stato emotivo, gli eventi significativi e gli eventuali segnali di rischio
+        2. Indica i cambiamenti all'interno dell'intervallo
+        3. Usa un linguaggio professionale e clinico, basati solo sui dati forniti
+        4. NON usare markdown e NON aggiungere frasi introduttive
+        
+        Genera la sintesi:"""
+    return prompt
+
+
+def get_summary_merge_prompt(paziente, sintesi_parziali):
+    prompt = f"""Sei uno psicologo clinico esperto. Il tuo compito è unire in un'unica sintesi le sintesi parziali, in ordine cronologico, delle note del diario di un paziente.
+
+        INFORMAZIONI PAZIENTE:
+        Nome: {paziente.nome} {paziente.cognome}
+        
+        SINTESI PARZIALI:
+        {sintesi_parziali}
+        
+        ISTRUZIONI:
+        1. Mantieni l'evoluzione nel tempo dello stato emotivo, gli eventi significativi e i segnali di rischio
+        2. Elimina le ripetizioni tra le sintesi
+        3. Usa un linguaggio professionale e clinico, basati solo sui dati forniti
+        4. NON usare markdown e NON aggiungere frasi introduttive
+        
+        Genera la sintesi unificata:"""
+    return prompt
+
+
+def get_summary_reduce_prompt(paziente, periodo_label, numero_note, sintesi_parziali):
+    prompt = f"""Sei uno psicologo clinico esperto. Il tuo compito è generare un riassunto clinico professionale dello stato del paziente basandoti sulle sintesi, in ordine cronologico, delle note del diario raccolte nel periodo specificato.
+
+        INFORMAZIONI PAZIENTE:
+        Nome: {paziente.nome} {paziente.cognome}
+        Periodo analizzato: {periodo_label}
+        Numero di note: {numero_note}
+        
+        SINTESI DELLE NOTE DEL DIARIO:
+        {sintesi_parziali}
+        
         ISTRUZIONI:
         1. Fornisci un riassunto clinico strutturato che includa:
             - Panoramica generale dello stato emotivo nel periodo
@@ -0,0 +1,213 @@
+import math
+from collections import namedtuple
+from datetime import timedelta
+from django.contrib.postgres.aggregates import StringAgg
+from django.db.models import CharField, Count, Max, Value
+from django.db.models.functions import Cast, Concat, MD5
+from django.utils import timezone
+
+from .constants import RIASSUNTO_MAX_NOTE_USCITE, RIASSUNTO_CARATTERI_PER_TOKEN
+
+# Partial summary of the map-reduce pipeline: the notes it covers and its text
+SintesiParziale = namedtuple('SintesiParziale', ['data_inizio', 'data_fine', 'numero_note', 'testo'])
+
+# Fingerprint of the notes a summary is generated from: if it changes, the summary is stale
+Impronta = namedtuple('Impronta', ['numero_note', 'ultima_nota', 'hash_note'])
+
+PERIODI_RIASSUNTO = {
+    '7days': (7, 'Ultimi 7 giorni'),
+    '30days': (30, 'Ultimo mese'),
+    '3months': (90, 'Ultimi 3 mesi'),
+    'year': (365, 'Ultimo anno'),
+}
+
+
+def calcola_finestra_periodo(periodo):
+    """
+    Returns the time window of a summary period.
+
+    Args:
+    periodo: One of the PERIODO_CHOICES keys (unknown values fall back to '7days')
+
+    Returns:
+    tuple: (periodo, data_inizio, periodo_label)
+    """
+    if periodo not in PERIODI_RIASSUNTO:
+        periodo = '7days' # fallback sicuro
+
+    giorni, periodo_label = PERIODI_RIASSUNTO[periodo]
+    return periodo, timezone.now() - timedelta(days=giorni), periodo_label
+
+
+def costruisci_contesto_note(note):
+    """
+    Builds the text of the notes passed to the summary prompt.
+
+    Args:
+    note: Iterable of NotaDiario ordered by date
+    """
+    note_testo = []
+    for nota in note:
+        nota_info = f"Data: {nota.data_nota.strftime('%d/%m/%Y')}"
+        if nota.emozione_predominante:
+            nota_info += f" | Emozione: {nota.emozione_predominante}"
+        nota_info += f"\nNota paziente: {nota.testo_paziente}"
+        if nota.testo_clinico:
+            nota_info += f"\nAnalisi clinica: {nota.testo_clinico}"
+        note_testo.append(nota_info)
+
+    return "\n\n---\n\n".join(note_testo)
+
+
+def stima_token(testo):
+    """
+    Estimated number of tokens of a prompt. The backend has no tokenizer of the
+    model: the estimate divides the characters by RIASSUNTO_CARATTERI_PER_TOKEN,
+    chosen on the safe side for Italian text.
+    """
+    return math.ceil(len(testo) / RIASSUNTO_CARATTERI_PER_TOKEN)
+
+
+def suddividi_note_in_blocchi(note, budget_token):
+    """
+    Splits the notes into the chunks of the map step: one chunk per ISO week, and
+    a week whose notes exceed budget_token is split further. Weekly boundaries do
+    not move when the period window slides, so past chunks keep their cache entries.
+
+    Args:
+    note: List of NotaDiario ordered by date
+    budget_token: Estimated tokens available for the notes of a chunk
+
+    Returns:
+    list: Lists of notes, in chronological order
+    """
+    blocchi = []
+    settimana_blocco = None
+    token_blocco = 0
+    for nota in note:
+        settimana = nota.data_nota.isocalendar()[:2]
+        token_nota = stima_token(costruisci_contesto_note([nota]))
+        if settimana != settimana_blocco or token_blocco + token_nota > budget_token:
+            blocchi.append([])
+            settimana_blocco = settimana
+            token_blocco = 0
+        blocchi[-1].append(nota)
+        token_blocco += token_nota
+
+    return blocchi
+
+
+def formatta_sintesi_parziali(sintesi):
+    """
+    Builds the text of the partial summaries passed to the merge and reduce prompts.
+    """
+    return "\n\n---\n\n".join(
+        f"Dal {s.data_inizio.strftime('%d/%m/%Y')} al {s.data_fine.strftime('%d/%m/%Y')} ({s.numero_note} note):\n{s.testo}"
+        for s in sintesi
+    )
+
+
+def raggruppa_sintesi(sintesi, budget_token):
+    """
+    Groups consecutive partial summaries so that the text of each group fits
+    budget_token (a summary larger than the budget stays alone).
+
+    Returns:
+    list: Lists of SintesiParziale, in chronological order
+    """
+    gruppi = []
+    token_gruppo = 0
+    for s in sintesi:
+        token_sintesi = stima_token(formatta_sintesi_parziali([s]))
+        if not gruppi or token_gruppo + token_sintesi > budget_token:
+            gruppi.append([])
+            token_gruppo = 0
+        gruppi[-1].append(s)
+        token_gruppo += token_sintesi
+
+    return gruppi
+
+
+def unisci_sintesi(gruppo, testo):
+    """Partial summary covering a whole group of partial summaries."""
+    return SintesiParziale(
+        gruppo[0].data_inizio,
+        gruppo[-1].data_fine,
+        sum(s.numero_note for s in gruppo),
+        testo
+    )
+
+
+def note_da_aggiungere(riassunto, id_note_periodo):
+    """
+    Decides whether a stored summary can be updated with only the notes it does not
+    cover yet instead of being regenerated from every note of the period.
+
+    Args:
+    riassunto: The stored RiassuntoCasoClinico of the period, or None
+    id_note_periodo: Ids of the notes currently in the period window
+
+    Returns:
+    list: Ids of the notes to add (empty if the summary is already up to date), or
+    None when the summary has to be regenerated from scratch: there is no summary,
+    it does not track its notes, or too many of them have left the window
+    """
+    if riassunto is None or not riassunto.note_coperte:
+        return None
+
+    coperte = set(riassunto.note_coperte)
+    nel_periodo = set(id_note_periodo)
+    if len(coperte - nel_periodo) > len(coperte) * RIASSUNTO_MAX_NOTE_USCITE:
+        return None
+
+    return sorted(nel_periodo - coperte)
+
+
+def _aggregati_impronta():
+    return {
+        'numero_note': Count('id'),
+        'ultima_nota': Max('data_nota'),
+        # MD5 of "id:data_modifica" of every note, in id order: changes when a note is
+        # added, deleted, edited or leaves the period window
+        'hash_note': MD5(StringAgg(
+            Concat(Cast('id', CharField()), Value(':'), Cast('data_modifica', CharField()), output_field=CharField()),
+            delimiter=',',
+            ordering='id'
+        )),
+    }
+
+
+def impronta_note(note_periodo):
+    """
+    Fingerprint of the notes of a period, computed by the database in a single
+    aggregate query (no note is loaded).
+
+    Args:
+    note_periodo: QuerySet of the notes of the period
+
+    Returns:
+    Impronta: (numero_note, ultima_nota, hash_note)
+    """
+    return Impronta(**note_periodo.order_by().aggregate(**_aggregati_impronta()))
+
+
+def campi_impronta(impronta):
+    """RiassuntoCasoClinico fields storing the fingerprint of its notes."""
+    return {
+        'impronta_numero_note': impronta.numero_note,
+        'impronta_ultima_nota': impronta.ultima_nota,
+        'impronta_hash': impronta.hash_note,
+    }
+
+
+def riassunto_aggiornato(riassunto, impronta):
+    """True if the summary was generated from exactly the notes fingerprinted by impronta."""
+    return riassunto is not None and Impronta(
+        riassunto.impronta_numero_note,
+        riassunto.impronta_ultima_nota,
+        riassunto.impronta_hash
+    ) == impronta
+
+
+def formatta_data_generazione(data_generazione):
+    return data_generazione.strftime('%d/%m/%Y alle %H:%M') if data_generazione else None
@@ -0,0 +1,352 @@
+from datetime import datetime, timedelta
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, Min, Q, Sum, Value, When
+from django.db.models.functions import Lower, Trim, TruncDay, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from ...models import NotaDiario, Paziente, StatisticheUmore
+from .constants import EMOZIONI_CATEGORIE, ANDAMENTO_MAX_PUNTI
+from .utils import get_emoji_for_context, get_emoji_for_emotion, get_emotion_category
+
+# Score of each emotion category in the mood chart and averages
+PUNTEGGI_CATEGORIA = {
+    'positive': 4, 'neutral': 3, 'anxious': 2, 'negative': 1,
+}
+CATEGORIE_UMORE = tuple(PUNTEGGI_CATEGORIA)
+
+# Buckets of the mood chart, from the finest: truncation function, approximate days, label format
+BUCKET_ANDAMENTO = {
+    'day': (TruncDay, 1, '%d/%m'),
+    'week': (TruncWeek, 7, '%d/%m'),
+    'month': (TruncMonth, 30, '%m/%Y'),
+}
+
+
+class ParametriAndamentoNonValidi(ValueError):
+    pass
+
+
+def _incrementa(conteggi, chiave, segno):
+    valore = conteggi.get(chiave, 0) + segno
+    if valore > 0:
+        conteggi[chiave] = valore
+    else:
+        conteggi.pop(chiave, None)
+
+
+def _applica_contributo(stat, emozione, contesto, segno):
+    """
+    Adds (segno=1) or removes (segno=-1) the contribution of an analyzed note.
+    """
+    if not emozione:
+        return
+
+    emozione = emozione.lower().strip()
+    categoria = get_emotion_category(emozione)
+    punteggio = PUNTEGGI_CATEGORIA.get(categoria, 2)
+
+    stat.note_con_emozione += segno
+    stat.somma_punteggi += segno * punteggio
+    _incrementa(stat.conteggio_emozioni, emozione, segno)
+    _incrementa(stat.conteggio_categorie, categoria, segno)
+
+    if contesto:
+        contesto = contesto.lower().strip()
+        riga = stat.matrice_contesti.setdefault(
+            contesto, {**dict.fromkeys(CATEGORIE_UMORE, 0), 'total': 0, 'sum': 0}
+        )
+        riga[categoria] += segno
+        riga['total'] += segno
+        riga['sum'] += segno * punteggio
+        if riga['total'] <= 0:
+            del stat.matrice_contesti[contesto]
+
+
+def _blocca_paziente(paz_id):
+    Paziente.objects.select_for_update().filter(codice_fiscale=paz_id).only('codice_fiscale').first()
+
+
+def _media_contesto(dati):
+    return round(dati['sum'] / dati['total'], 2) if dati['total'] > 0 else 0
+
+
+def blocca_statistiche_umore(paz_id):
+    """
+    Locks the patient's mood statistics until the end of the current transaction
+    (to be called inside transaction.atomic(), before changing the note).
+
+    The patient row is locked, so every change to the patient's notes and the
+    rebuild of the statistics are serialized.
+
+    Returns:
+    StatisticheUmore or None if the statistics have not been built yet (they will
+    be built from scratch on first read)
+    """
+    _blocca_paziente(paz_id)
+    return StatisticheUmore.objects.filter(paz_id=paz_id).first()
+
+
+def applica_variazione_nota(stat, prima=(None, None), dopo=(None, None), delta_note=0):
+    """
+    Updates the statistics locked with blocca_statistiche_umore after a note change.
+
+    Args:
+    stat: StatisticheUmore (None is ignored)
+    prima: (emozione, contesto) of the note before the change
+    dopo: (emozione, contesto) of the note after the change
+    delta_note: 1 for a new note, -1 for a deleted note
+    """
+    if stat is None:
+        return
+
+    _applica_contributo(stat, *prima, -1)
+    _applica_contributo(stat, *dopo, 1)
+    stat.totale_note += delta_note
+    stat.data_aggiornamento = timezone.now()
+    stat.save()
+
+
+def annota_categoria_emozione(queryset):
+    """
+    Annotates each note with emozione_norm (lowercase emotion), categoria and
+    punteggio, computed by the database: the EMOZIONI_CATEGORIE mapping becomes
+    a CASE WHEN expression.
+    """
+    return queryset.annotate(
+        emozione_norm=Lower(Trim('emozione_predominante')),
+    ).annotate(
+        categoria=Case(
+            *[When(emozione_norm=emozione, then=Value(categoria)) for emozione, categoria in EMOZIONI_CATEGORIE.items()],
+            default=Value('neutral'),
+        ),
+    ).annotate(
+        punteggio=Case(
+            *[When(categoria=categoria, then=Value(punteggio)) for categoria, punteggio in PUNTEGGI_CATEGORIA.items()],
+            default=Value(2),
+            output_field=IntegerField(),
+        ),
+    )
+
+
+def _note_con_emozione(queryset):
+    return queryset.filter(emozione_predominante__isnull=False).exclude(emozione_predominante='')
+
+
+def aggrega_statistiche_umore(queryset, paz_id=None):
+    """
+    Computes the mood aggregates of a set of notes with GROUP BY queries in the
+    database (three queries, whatever the number of notes).
+
+    Returns:
+    StatisticheUmore: not saved
+    """
+    stat = StatisticheUmore(paz_id=paz_id, data_aggiornamento=timezone.now())
+    stat.totale_note = queryset.count()
+
+    note = annota_categoria_emozione(_note_con_emozione(queryset)).order_by()
+
+    per_emozione = note.values('emozione_norm', 'categoria', 'punteggio').annotate(numero=Count('id'))
+    for riga in per_emozione:
+        stat.note_con_emozione += riga['numero']
+        stat.somma_punteggi += riga['numero'] * riga['punteggio']
+        stat.conteggio_emozioni[riga['emozione_norm']] = stat.conteggio_emozioni.get(riga['emozione_norm'], 0) + riga['numero']
+        stat.conteggio_categorie[riga['categoria']] = stat.conteggio_categorie.get(riga['categoria'], 0) + riga['numero']
+
+    per_contesto = (
+        note.filter(contesto_sociale__isnull=False).exclude(contesto_sociale='')
+        .annotate(contesto_norm=Lower(Trim('contesto_sociale')))
+        .values('contesto_norm')
+        .annotate(
+            total=Count('id'),
+            sum=Sum('punteggio'),
+            **{categoria: Count('id', filter=Q(categoria=categoria)) for categoria in CATEGORIE_UMORE},
+        )
+    )
+    for riga in per_contesto:
+        stat.matrice_contesti[riga.pop('contesto_norm')] = riga
+
+    return stat
+
+
+def ricostruisci_statistiche_umore(paz_id):
+    """
+    Rebuilds the mood statistics of a patient from all their notes.
+    """
+    with transaction.atomic():
+        _blocca_paziente(paz_id)
+        stat = aggrega_statistiche_umore(NotaDiario.objects.filter(paz_id=paz_id), paz_id=paz_id)
+        stat.save()
+    return stat
+
+
+def andamento_emotivo(queryset):
+    """
+    Mood chart series (one point per note with an emotion, in date order),
+    read with a single ordered query.
+
+    Returns:
+    dict or None if no note has an emotion
+    """
+    punti = (
+        annota_categoria_emozione(_note_con_emozione(queryset))
+        .order_by('data_nota')
+        .values_list('data_nota', 'emozione_norm', 'punteggio')
+    )
+
+    dates, full_dates, emotions, values = [], [], [], []
+    for data_nota, emozione, punteggio in punti:
+        dates.append(data_nota.strftime('%d/%m'))
+        full_dates.append(data_nota.strftime('%Y-%m-%d'))
+        emotions.append(emozione)
+        values.append(punteggio)
+
+    if not dates:
+        return None
+    return {'dates': dates, 'full_dates': full_dates, 'emotions': emotions, 'values': values}
+
+
+def statistiche_umore_paziente(paz_id):
+    """
+    Returns the mood statistics of a patient, building them on first use.
+    """
+    stat = StatisticheUmore.objects.filter(paz_id=paz_id).first()
+    if stat is None:
+        stat = ricostruisci_statistiche_umore(paz_id)
+    return stat
+
+
+def serializza_statistiche_umore(stat):
+    """
+    Converts the aggregates in the 'statistiche' and 'correlazione_contesto'
+    sections of the mood stats response.
+
+    Returns:
+    tuple: (statistiche, correlazione_contesto)
+    """
+    statistiche = {
+        'totale_note': 0, 'media_emotiva': 0,
+        'emozione_frequente': None, 'emozione_frequente_count': 0, 'emozione_frequente_emoji': ''
+    }
+    if stat.note_con_emozione > 0:
+        emozione_frequente, emozione_frequente_count = max(stat.conteggio_emozioni.items(), key=lambda x: x[1])
+        statistiche = {
+            'totale_note': stat.totale_note,
+            'media_emotiva': round(stat.somma_punteggi / stat.note_con_emozione, 2),
+            'emozione_frequente': emozione_frequente.title(),
+            'emozione_frequente_count': emozione_frequente_count,
+            'emozione_frequente_emoji': get_emoji_for_emotion(emozione_frequente),
+            'conteggio_categorie': {categoria: stat.conteggio_categorie.get(categoria, 0) for categoria in CATEGORIE_UMORE},
+        }
+
+    if not stat.matrice_contesti:
+        return statistiche, None
+
+    contesti_ordinati = sorted(stat.matrice_contesti.items(), key=lambda x: x[1]['total'], reverse=True)
+    contesto_migliore = max(contesti_ordinati, key=lambda x: _media_contesto(x[1]))
+    contesto_peggiore = min(contesti_ordinati, key=lambda x: _media_contesto(x[1]))
+
+    correlazione_contesto = {
+        'labels': [contesto.title() for contesto, _ in contesti_ordinati],
+        **{categoria: [dati[categoria] for _, dati in contesti_ordinati] for categoria in CATEGORIE_UMORE},
+        'medie': [_media_contesto(dati) for _, dati in contesti_ordinati],
+        'emojis': [get_emoji_for_context(contesto) for contesto, _ in contesti_ordinati],
+        'contesto_migliore': contesto_migliore[0].title(),
+        'contesto_migliore_emoji': get_emoji_for_context(contesto_migliore[0]),
+        'contesto_migliore_media': _media_contesto(contesto_migliore[1]),
+        'contesto_peggiore': contesto_peggiore[0].title(),
+        'contesto_peggiore_emoji': get_emoji_for_context(contesto_peggiore[0]),
+        'contesto_peggiore_media': _media_contesto(contesto_peggiore[1]),
+    }
+    return statistiche, correlazione_contesto
+
+
+def leggi_parametri_andamento(request):
+    """
+    Reads ?from=YYYY-MM-DD, ?to=YYYY-MM-DD (both included) and ?bucket=day|week|month.
+
+    Returns:
+    tuple: (data_inizio, data_fine, bucket), None for the missing parameters.
+    data_fine is exclusive (the day after ?to).
+    Raises ParametriAndamentoNonValidi for invalid values.
+    """
+    try:
+        data_inizio = datetime.strptime(request.GET['from'], '%Y-%m-%d') if request.GET.get('from') else None
+        data_fine = datetime.strptime(request.GET['to'], '%Y-%m-%d') + timedelta(days=1) if request.GET.get('to') else None
+    except ValueError as e:
+        raise ParametriAndamentoNonValidi("Date non valide (formato atteso: YYYY-MM-DD)") from e
+
+    if data_inizio and data_fine and data_inizio >= data_fine:
+        raise ParametriAndamentoNonValidi("La data 'from' deve precedere la data 'to'")
+
+    bucket = request.GET.get('bucket') or None
+    if bucket is not None and bucket not in BUCKET_ANDAMENTO:
+        raise ParametriAndamentoNonValidi(f"Bucket non valido (valori ammessi: {', '.join(BUCKET_ANDAMENTO)})")
+
+    return data_inizio, data_fine, bucket
+
+
+def scegli_bucket(bucket, data_inizio, data_fine, max_punti=ANDAMENTO_MAX_PUNTI):
+    """
+    Returns the requested bucket, or the first coarser one that keeps the
+    range within max_punti points.
+    """
+    giorni = (data_fine - data_inizio).days + 1
+    nomi = list(BUCKET_ANDAMENTO)
+    for nome in nomi[nomi.index(bucket):]:
+        if -(-giorni // BUCKET_ANDAMENTO[nome][1]) <= max_punti:
+            return nome
+    return nomi[-1]
+
+
+def andamento_emotivo_per_bucket(queryset, bucket, data_inizio=None, data_fine=None, max_punti=ANDAMENTO_MAX_PUNTI):
+    """
+    Mood chart series grouped by day, week or month: average score, number of
+    notes and most frequent emotion of each bucket, computed with a GROUP BY on
+    (bucket, emotion). The bucket is widened if the range has more than
+    max_punti points, and only the most recent max_punti points are returned.
+
+    Args:
+    queryset: Notes of the patient (already filtered by date range)
+    bucket: 'day', 'week' or 'month'
+    data_inizio, data_fine: Range used to choose the bucket (defaults: first note, now)
+
+    Returns:
+    dict or None if no note has an emotion
+    """
+    note = _note_con_emozione(queryset)
+
+    if data_inizio is None:
+        data_inizio = note.aggregate(prima=Min('data_nota'))['prima']
+        if data_inizio is None:
+            return None
+    bucket = scegli_bucket(bucket, data_inizio, data_fine or timezone.now())
+    tronca, _, formato = BUCKET_ANDAMENTO[bucket]
+
+    righe = (
+        annota_categoria_emozione(note)
+        .annotate(periodo=tronca('data_nota'))
+        .values('periodo', 'emozione_norm')
+        .annotate(numero=Count('id'), somma=Sum('punteggio'))
+        .order_by('periodo')
+    )
+
+    periodi = {}
+    for riga in righe:
+        periodo = periodi.setdefault(riga['periodo'], {'numero': 0, 'somma': 0, 'emozione': None, 'emozione_numero': 0})
+        periodo['numero'] += riga['numero']
+        periodo['somma'] += riga['somma']
+        if riga['numero'] > periodo['emozione_numero']:
+            periodo['emozione'], periodo['emozione_numero'] = riga['emozione_norm'], riga['numero']
+
+    if not periodi:
+        return None
+
+    ultimi = list(periodi.items())[-max_punti:]
+    return {
+        'dates': [inizio.strftime(formato) for inizio, _ in ultimi],
+        'full_dates': [inizio.strftime('%Y-%m-%d') for inizio, _ in ultimi],
+        'emotions': [dati['emozione'] for _, dati in ultimi],
+        'values': [round(dati['somma'] / dati['numero'], 2) for _, dati in ultimi],
+        'counts': [dati['numero'] for _, dati in ultimi],
+        'bucket': bucket,
+    }
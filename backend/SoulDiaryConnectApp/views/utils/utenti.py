@@ -0,0 +1,96 @@
+import copy
+import threading
+
+from django.db.models.signals import post_delete, post_save
+
+from ...models import Medico, Paziente
+from .constants import UTENTI_CACHE_TTL, UTENTI_CACHE_MAX_VOCI
+from .llm_cache import CacheMemoriaLRU
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _get_cache():
+    global _cache
+    if not UTENTI_CACHE_MAX_VOCI:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = CacheMemoriaLRU(max_voci=UTENTI_CACHE_MAX_VOCI)
+    return _cache
+
+
+def _da_cache(chiave):
+    cache = _get_cache()
+    istanza = cache.get(chiave) if cache else None
+    # Each request gets its own copy: a view that changes and saves its profile
+    # does not touch the instance seen by concurrent requests
+    return copy.deepcopy(istanza) if istanza is not None else None
+
+
+def _in_cache(chiave, istanza):
+    cache = _get_cache()
+    if cache:
+        cache.set(chiave, copy.deepcopy(istanza), UTENTI_CACHE_TTL)
+    return istanza
+
+
+def carica_paziente(codice_fiscale):
+    """
+    Returns the patient with their doctor already loaded (select_related('med')),
+    from the per-process cache or with a single query.
+    Raises Paziente.DoesNotExist if the patient does not exist.
+    """
+    chiave = f"paziente:{codice_fiscale}"
+    paziente = _da_cache(chiave)
+    if paziente is None:
+        paziente = _in_cache(chiave, Paziente.objects.select_related('med').get(codice_fiscale=codice_fiscale))
+    return paziente
+
+
+async def acarica_paziente(codice_fiscale):
+    """Async version of carica_paziente, for the async views."""
+    chiave = f"paziente:{codice_fiscale}"
+    paziente = _da_cache(chiave)
+    if paziente is None:
+        paziente = _in_cache(chiave, await Paziente.objects.select_related('med').aget(codice_fiscale=codice_fiscale))
+    return paziente
+
+
+def carica_medico(codice_identificativo):
+    """
+    Returns the doctor from the per-process cache or with a single query.
+    Raises Medico.DoesNotExist if the doctor does not exist.
+    """
+    chiave = f"medico:{codice_identificativo}"
+    medico = _da_cache(chiave)
+    if medico is None:
+        medico = _in_cache(chiave, Medico.objects.get(codice_identificativo=codice_identificativo))
+    return medico
+
+
+def invalida_paziente(sender, instance, **kwargs):
+    cache = _get_cache()
+    if cache:
+        cache.delete(f"paziente:{instance.pk}")
+
+
+def invalida_medico(sender, instance, **kwargs):
+    cache = _get_cache()
+    if cache:
+        # The cached patients carry a copy of their doctor: doctor profiles change
+        # rarely, so the whole cache is dropped instead of tracking their patients
+        cache.clear()
+
+
+def registra_invalidazione():
+    """
+    Drops the cached profiles of this process when a Paziente or Medico is saved
+    or deleted through the ORM. Called once from AppConfig.ready().
+    """
+    post_save.connect(invalida_paziente, sender=Paziente, dispatch_uid='utenti_invalida_paziente_save')
+    post_delete.connect(invalida_paziente, sender=Paziente, dispatch_uid='utenti_invalida_paziente_delete')
+    post_save.connect(invalida_medico, sender=Medico, dispatch_uid='utenti_invalida_medico_save')
+    post_delete.connect(invalida_medico, sender=Medico, dispatch_uid='utenti_invalida_medico_delete')
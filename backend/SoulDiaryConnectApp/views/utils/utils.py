@@ -1,3 +1,5 @@
+import json
+from django.http import StreamingHttpResponse
 from .constants import EMOZIONI_EMOJI, CONTESTI_EMOJI, EMOZIONI_CATEGORIE
 
 def get_emoji_for_context(contesto):
@@ -29,4 +31,21 @@ def get_emotion_category(emozione):
     if not emozione:
         return 'neutral'
     emozione_lower = emozione.lower().strip()
-    return EMOZIONI_CATEGORIE.get(emozione_lower, 'neutral')
\ No newline at end of file
+    return EMOZIONI_CATEGORIE.get(emozione_lower, 'neutral')
+
+def evento_sse(dati, evento=None):
+    """
+    Formats a Server-Sent Event with a JSON payload.
+    """
+    riga_evento = f"event: {evento}\n" if evento else ""
+    return f"{riga_evento}data: {json.dumps(dati, ensure_ascii=False)}\n\n"
+
+def risposta_sse(eventi):
+    """
+    Wraps a generator of Server-Sent Events in a streaming response that
+    proxies and clients must not buffer.
+    """
+    response = StreamingHttpResponse(eventi, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
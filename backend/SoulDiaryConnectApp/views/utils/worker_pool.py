@@ -0,0 +1,205 @@
+import atexit
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .constants import (
+    ANALISI_WORKERS,
+    ANALISI_CODA_MAX,
+    ANALISI_ATTESA_INVIO,
+    ANALISI_TIMEOUT_CHIUSURA
+)
+
+logger = logging.getLogger(__name__)
+
+
+class CodaAnalisiPiena(Exception):
+    """Raised when the pool cannot accept new work (queue full or shutting down)."""
+    pass
+
+
+class PoolAnalisi:
+    """
+    Bounded pool of worker threads for the background note analyses.
+
+    At most `workers` tasks run at the same time and at most `capienza_coda` wait
+    for a free worker: when both are taken, submit() waits up to `attesa_invio`
+    seconds for a slot and then raises CodaAnalisiPiena, so bursts of notes push
+    back on the caller instead of piling up threads, DB connections and Ollama calls.
+
+    Args:
+    workers: Number of worker threads
+    capienza_coda: Maximum number of tasks waiting for a worker
+    attesa_invio: Seconds submit() waits for a free slot before giving up
+    """
+
+    def __init__(self, workers=ANALISI_WORKERS, capienza_coda=ANALISI_CODA_MAX, attesa_invio=ANALISI_ATTESA_INVIO):
+        self.workers = workers
+        self.capienza_coda = capienza_coda
+        self.attesa_invio = attesa_invio
+        self._esecutore = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='analisi-nota')
+        self._posti = threading.BoundedSemaphore(workers + capienza_coda)
+        self._lock = threading.Lock()
+        self._chiuso = False
+        # Tasks submitted but not started yet: id -> (description, future)
+        self._in_attesa = {}
+        self._contatore = itertools.count()
+
+        # Metriche
+        self._in_coda = 0
+        self._in_esecuzione = 0
+        self._completati = 0
+        self._falliti = 0
+        self._rifiutati = 0
+        self._attesa_totale = 0.0
+        self._attesa_max = 0.0
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedules fn(*args, **kwargs) on the pool.
+
+        Raises:
+        CodaAnalisiPiena: if no slot frees up within attesa_invio seconds or the pool is closed
+        """
+        if self._chiuso or not self._posti.acquire(timeout=self.attesa_invio):
+            with self._lock:
+                self._rifiutati += 1
+            raise CodaAnalisiPiena("Coda delle analisi piena, riprova più tardi.")
+
+        accodato_il = time.monotonic()
+        voce = next(self._contatore)
+        with self._lock:
+            self._in_coda += 1
+            self._in_attesa[voce] = (f"{getattr(fn, '__name__', fn)}({', '.join(map(repr, args))})", None)
+
+        try:
+            future = self._esecutore.submit(self._esegui, voce, fn, accodato_il, args, kwargs)
+        except RuntimeError:
+            # The executor has been shut down between the check and the submit
+            with self._lock:
+                self._in_coda -= 1
+                self._rifiutati += 1
+                self._in_attesa.pop(voce, None)
+            self._posti.release()
+            raise CodaAnalisiPiena("Il servizio di analisi è in fase di chiusura.")
+
+        with self._lock:
+            # Not there any more if the task has already started
+            if voce in self._in_attesa:
+                self._in_attesa[voce] = (self._in_attesa[voce][0], future)
+        return future
+
+    def _esegui(self, voce, fn, accodato_il, args, kwargs):
+        attesa = time.monotonic() - accodato_il
+        with self._lock:
+            self._in_attesa.pop(voce, None)
+            self._in_coda -= 1
+            self._in_esecuzione += 1
+            self._attesa_totale += attesa
+            self._attesa_max = max(self._attesa_max, attesa)
+            profondita = self._in_coda
+
+        logger.info(f"Analisi avviata dopo {attesa:.2f}s di attesa (in coda: {profondita})")
+
+        try:
+            risultato = fn(*args, **kwargs)
+            with self._lock:
+                self._completati += 1
+            return risultato
+        except Exception as e:
+            with self._lock:
+                self._falliti += 1
+            logger.error(f"Errore in un'analisi del pool: {e}")
+            raise
+        finally:
+            with self._lock:
+                self._in_esecuzione -= 1
+            self._posti.release()
+
+    def metriche(self):
+        """
+        Returns a snapshot of the pool metrics: queue depth, running tasks,
+        counters and wait time (average and max, in seconds).
+        """
+        with self._lock:
+            avviati = self._completati + self._falliti + self._in_esecuzione
+            return {
+                'workers': self.workers,
+                'capienza_coda': self.capienza_coda,
+                'in_coda': self._in_coda,
+                'in_esecuzione': self._in_esecuzione,
+                'completati': self._completati,
+                'falliti': self._falliti,
+                'rifiutati': self._rifiutati,
+                'attesa_media': round(self._attesa_totale / avviati, 4) if avviati else 0.0,
+                'attesa_max': round(self._attesa_max, 4),
+            }
+
+    def chiudi(self, timeout=ANALISI_TIMEOUT_CHIUSURA):
+        """
+        Stops accepting new work and waits up to `timeout` seconds for the queued
+        and running analyses to finish. The tasks still waiting for a worker are
+        then cancelled and logged: the pool only runs jobs of the persistent queues,
+        so their jobs stay queued and are run later (by this server when it
+        restarts or by an analysis_worker). The running tasks are not interrupted.
+        """
+        self._chiuso = True
+        scadenza = time.monotonic() + timeout
+        while time.monotonic() < scadenza:
+            with self._lock:
+                if self._in_coda == 0 and self._in_esecuzione == 0:
+                    break
+            time.sleep(0.1)
+        else:
+            logger.warning(f"Chiusura del pool di analisi con lavori ancora pendenti: {self.metriche()}")
+
+        annullati = []
+        with self._lock:
+            for voce, (descrizione, future) in list(self._in_attesa.items()):
+                if future is not None and future.cancel():
+                    del self._in_attesa[voce]
+                    self._in_coda -= 1
+                    annullati.append(descrizione)
+        if annullati:
+            logger.warning(f"Chiusura del pool: {len(annullati)} lavori in attesa annullati, i loro job restano in coda: {', '.join(annullati)}")
+
+        self._esecutore.shutdown(wait=False, cancel_futures=True)
+        logger.info(f"Pool di analisi chiuso: {self.metriche()}")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _registra_chiusura(pool):
+    # concurrent.futures joins its worker threads, running every task still queued
+    # and without any time limit, from a threading exit hook that runs before the
+    # atexit handlers. The pool is closed from a hook of the same kind: registered
+    # later, it runs first, so the ANALISI_TIMEOUT_CHIUSURA limit is applied
+    registra = getattr(threading, '_register_atexit', None)
+    if registra is None:
+        atexit.register(pool.chiudi)
+        return
+    try:
+        registra(pool.chiudi)
+    except RuntimeError:
+        # Interpreter already shutting down
+        pass
+
+
+def get_pool_analisi():
+    """
+    Returns the process-wide analysis pool, creating it on first use.
+    When the interpreter exits the pool is closed with chiudi(): the analyses get
+    up to ANALISI_TIMEOUT_CHIUSURA seconds to finish, then the ones still waiting
+    are dropped and left to the persistent job queue.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PoolAnalisi()
+                _registra_chiusura(_pool)
+    return _pool
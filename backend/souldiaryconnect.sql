@@ -8,6 +8,9 @@ DROP TABLE IF EXISTS paziente CASCADE;
 DROP TABLE IF EXISTS nota_diario CASCADE;
 DROP TABLE IF EXISTS messaggio CASCADE;
 DROP TABLE IF EXISTS riassunto_caso_clinico CASCADE;
+DROP TABLE IF EXISTS job_analisi CASCADE;
+DROP TABLE IF EXISTS statistiche_umore CASCADE;
+DROP TABLE IF EXISTS job_riassunto CASCADE;
 
 -- 1. Creazione tabella Medico
 CREATE TABLE medico (
@@ -56,6 +59,7 @@ CREATE TABLE nota_diario (
     contesto_sociale varchar(50),
     spiegazione_contesto text,
     data_nota timestamp NOT NULL,
+    data_modifica timestamp NOT NULL DEFAULT now(),
     -- Modulo Emergenza
     is_emergency boolean NOT NULL DEFAULT false,
     tipo_emergenza varchar(20) NOT NULL DEFAULT 'none',
@@ -67,6 +71,10 @@ CREATE TABLE nota_diario (
         ON UPDATE CASCADE ON DELETE CASCADE
 );
 
+CREATE INDEX nota_diario_paz_data_idx ON nota_diario (paz_id, data_nota, id);
+CREATE INDEX nota_diario_emergenza_idx ON nota_diario (paz_id, data_nota) WHERE is_emergency = true;
+CREATE INDEX nota_diario_in_generaz_idx ON nota_diario (id) WHERE generazione_in_corso = true;
+
 -- 4. Creazione tabella Messaggio
 CREATE TABLE messaggio (
     id serial PRIMARY KEY,
@@ -90,9 +98,82 @@ CREATE TABLE riassunto_caso_clinico (
     periodo varchar(10) NOT NULL,
     testo_riassunto text NOT NULL,
     data_generazione timestamp NOT NULL,
+    note_coperte jsonb NOT NULL DEFAULT '[]',
+    impronta_numero_note integer NOT NULL DEFAULT 0,
+    impronta_ultima_nota timestamp,
+    impronta_hash varchar(32),
 
     FOREIGN KEY (paz_id) REFERENCES paziente(codice_fiscale)
         ON UPDATE CASCADE ON DELETE CASCADE,
     FOREIGN KEY (med_id) REFERENCES medico(codice_identificativo)
         ON UPDATE CASCADE ON DELETE CASCADE
-);
\ No newline at end of file
+);
+
+-- 6. Creazione tabella Job Analisi (coda persistente delle analisi IA)
+CREATE TABLE job_analisi (
+    id serial PRIMARY KEY,
+    chiave varchar(64) UNIQUE NOT NULL,
+    nota_id integer NOT NULL,
+    stato varchar(15) NOT NULL DEFAULT 'in_coda',
+    tentativi integer NOT NULL DEFAULT 0,
+    disponibile_dal timestamp NOT NULL,
+    lease_scadenza timestamp,
+    worker varchar(100),
+    ultimo_errore text,
+    data_creazione timestamp NOT NULL,
+    data_aggiornamento timestamp NOT NULL,
+
+    FOREIGN KEY (nota_id) REFERENCES nota_diario(id)
+        ON UPDATE CASCADE ON DELETE CASCADE
+);
+
+CREATE INDEX job_analisi_stato_disp_idx ON job_analisi (stato, disponibile_dal);
+
+-- 7. Creazione tabella Statistiche Umore (aggregati per paziente aggiornati in modo incrementale)
+CREATE TABLE statistiche_umore (
+    paz_id varchar(16) PRIMARY KEY,
+    totale_note integer NOT NULL DEFAULT 0,
+    note_con_emozione integer NOT NULL DEFAULT 0,
+    somma_punteggi integer NOT NULL DEFAULT 0,
+    conteggio_emozioni jsonb NOT NULL DEFAULT '{}',
+    conteggio_categorie jsonb NOT NULL DEFAULT '{}',
+    matrice_contesti jsonb NOT NULL DEFAULT '{}',
+    data_aggiornamento timestamp NOT NULL,
+
+    FOREIGN KEY (paz_id) REFERENCES paziente(codice_fiscale)
+        ON UPDATE CASCADE ON DELETE CASCADE
+);
+
+-- 8. Creazione tabella Job Riassunto (generazione in background dei riassunti clinici)
+CREATE TABLE job_riassunto (
+    id serial PRIMARY KEY,
+    chiave varchar(64) UNIQUE NOT NULL,
+    paz_id varchar(16) NOT NULL,
+    med_id varchar(12) NOT NULL,
+    periodo varchar(10) NOT NULL,
+    incrementale boolean NOT NULL DEFAULT false,
+    forza boolean NOT NULL DEFAULT false,
+    stato varchar(15) NOT NULL DEFAULT 'in_coda',
+    tentativi integer NOT NULL DEFAULT 0,
+    disponibile_dal timestamp NOT NULL,
+    lease_scadenza timestamp,
+    worker varchar(100),
+    ultimo_errore text,
+    fase varchar(30),
+    passi_completati integer NOT NULL DEFAULT 0,
+    passi_totali integer NOT NULL DEFAULT 0,
+    riassunto_id integer,
+    modalita_generazione varchar(15),
+    note_aggiunte integer NOT NULL DEFAULT 0,
+    data_creazione timestamp NOT NULL,
+    data_aggiornamento timestamp NOT NULL,
+
+    FOREIGN KEY (paz_id) REFERENCES paziente(codice_fiscale)
+        ON UPDATE CASCADE ON DELETE CASCADE,
+    FOREIGN KEY (med_id) REFERENCES medico(codice_identificativo)
+        ON UPDATE CASCADE ON DELETE CASCADE,
+    FOREIGN KEY (riassunto_id) REFERENCES riassunto_caso_clinico(id)
+        ON UPDATE CASCADE ON DELETE SET NULL
+);
+
+CREATE INDEX job_riassunto_stato_disp_idx ON job_riassunto (stato, disponibile_dal);
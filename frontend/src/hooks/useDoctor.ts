@@ -1,8 +1,23 @@
-import { useState, useCallback } from 'react';
+import { useState, useCallback, useEffect, useRef } from 'react';
 import { API_URL } from '../constants/Config';
 import axios from 'axios';
 import * as SecureStore from 'expo-secure-store';
 
+// Intervallo di polling dello stato di un job di generazione del riassunto clinico
+const SUMMARY_JOB_POLL_MS = 2000;
+// Oltre questo tempo si smette di seguire il job (es. nessun worker attivo o Ollama non
+// raggiungibile): il job resta in coda sul server e il riassunto potrà essere letto più tardi
+const SUMMARY_JOB_POLL_TIMEOUT_MS = 5 * 60 * 1000;
+
+// Attesa interrompibile: termina subito se il polling viene annullato
+const attendi = (ms: number, signal: AbortSignal) => new Promise<void>(resolve => {
+  const timer = setTimeout(resolve, ms);
+  signal.addEventListener('abort', () => {
+    clearTimeout(timer);
+    resolve();
+  });
+});
+
 export interface AiParameter {
   id?: string;
   tipo: string;
@@ -28,6 +43,10 @@ export const useDoctor = () => {
     const [moodStats, setMoodStats] = useState<any>(null);
     const [aiSettings, setAiSettings] = useState<AiSettings | null>(null);
 
+    // Polling del riassunto in corso: annullato quando il componente viene smontato
+    const summaryAbortRef = useRef<AbortController | null>(null);
+    useEffect(() => () => summaryAbortRef.current?.abort(), []);
+
     // 1. Doctor profile
     const fetchProfile = useCallback(async () => {
         setLoading(true);
@@ -163,6 +182,11 @@ export const useDoctor = () => {
         periodo: string = '7days', 
         forceGenerate: boolean = false
     ) => {
+        // Una nuova richiesta sostituisce quella precedente ancora in corso
+        summaryAbortRef.current?.abort();
+        const controller = new AbortController();
+        summaryAbortRef.current = controller;
+
         setLoading(true);
         setError(null);
         try {
@@ -171,19 +195,59 @@ export const useDoctor = () => {
             const endpoint = `${API_URL}/doctor/patients/${patientId}/summary/?periodo=${periodo}&genera=${forceGenerate ? '1' : '0'}`;
 
             const response = await axios.get(endpoint, {
-                headers: { Authorization: `Bearer ${token}` }
+                headers: { Authorization: `Bearer ${token}` },
+                signal: controller.signal
             });
 
-            if (response.data.status === 'success') {
-                setClinicalSummary(response.data.data);
-                return response.data.data; // Utile se vuoi gestire la risposta direttamente nel componente
+            if (response.data.status !== 'success') {
+                return null;
             }
-            return null;
+
+            let data = response.data.data;
+
+            // Con genera=1 il backend accoda la generazione (202) e restituisce il job:
+            // ne seguiamo l'avanzamento finché il riassunto non è pronto
+            if (response.status === 202) {
+                const scadenza = Date.now() + SUMMARY_JOB_POLL_TIMEOUT_MS;
+                while (data.stato === 'in_coda' || data.stato === 'in_esecuzione') {
+                    if (Date.now() >= scadenza) {
+                        // Un job fallito torna in coda per un nuovo tentativo: si mostra il suo errore
+                        setError(data.ultimo_errore
+                            ? `Il riassunto non è ancora pronto, verrà ritentato automaticamente (${data.ultimo_errore})`
+                            : "Il riassunto è ancora in generazione, riapri la pagina più tardi per vederlo");
+                        return null;
+                    }
+
+                    await attendi(SUMMARY_JOB_POLL_MS, controller.signal);
+                    if (controller.signal.aborted) {
+                        return null;
+                    }
+                    const jobResponse = await axios.get(`${API_URL}/doctor/summary-jobs/${data.job_id}/`, {
+                        headers: { Authorization: `Bearer ${token}` },
+                        signal: controller.signal
+                    });
+                    data = jobResponse.data.data;
+                }
+
+                if (data.stato !== 'completato') {
+                    setError(data.ultimo_errore || "Errore nella generazione del riassunto clinico");
+                    return null;
+                }
+            }
+
+            setClinicalSummary(data);
+            return data; // Utile se vuoi gestire la risposta direttamente nel componente
         } catch (err: any) {
+            if (axios.isCancel(err)) {
+                return null;
+            }
             setError(err.response?.data?.message || "Errore nel caricamento del riassunto clinico");
             return null;
         } finally {
-            setLoading(false);
+            // Una richiesta annullata non tocca lo stato (componente smontato o richiesta più recente)
+            if (!controller.signal.aborted) {
+                setLoading(false);
+            }
         }
     }, []);
 
@@ -20,7 +20,7 @@ export default function SummaryScreen() {
   const route = useRoute<any>();
   const { patientId } = route.params;
 
-  const { clinicalSummary, fetchClinicalSummary, loading } = useDoctor();
+  const { clinicalSummary, fetchClinicalSummary, loading, error } = useDoctor();
   
   // Questo stato serve SOLO per decidere che periodo usare per la PROSSIMA generazione
   const [selectedPeriod, setSelectedPeriod] = useState('7days');
@@ -51,10 +51,9 @@ export default function SummaryScreen() {
     const result = await fetchClinicalSummary(patientId, selectedPeriod, true);
     setIsGenerating(false);
 
+    // In caso di errore (o riassunto ancora in generazione) il messaggio viene mostrato sotto il pulsante
     if (result) {
       Alert.alert("Successo ✨", `Il riassunto clinico per il periodo '${result.periodo_label}' è stato generato.`);
-    } else {
-      Alert.alert("Errore", "Impossibile generare il riassunto in questo momento.");
     }
   };
 
@@ -137,6 +136,10 @@ export default function SummaryScreen() {
               variant="primary"
             />
           </View>
+
+          {error && !isGenerating ? (
+            <Text style={styles.errorText}>{error}</Text>
+          ) : null}
         </View>
 
         {/* --- RESULT --- */}
@@ -266,6 +269,12 @@ const styles = StyleSheet.create({
     color: Colors.textDark,
     textTransform: 'uppercase',
   },
+  errorText: {
+    fontSize: 14,
+    color: Colors.red,
+    textAlign: 'center',
+    marginTop: 10,
+  },
   summaryText: {
     fontSize: 16,
     color: Colors.textDark,